@@ -222,6 +222,7 @@ class account_account(osv.osv):
     _name = "account.account"
     _description = "Account"
     _parent_store = True
+    _parent_cache = True
 
     def search(self, cr, uid, args, offset=0, limit=None, order=None,
             context=None, count=False):
@@ -90,6 +90,7 @@ class product_uom_categ(osv.osv):
 class product_uom(osv.osv):
     _name = 'product.uom'
     _description = 'Product Unit of Measure'
+    _read_cache = True
 
     def _compute_factor_inv(self, factor):
         return factor and (1.0 / factor) or 0.0
@@ -278,6 +279,8 @@ class product_category(osv.osv):
 
     _parent_name = "parent_id"
     _parent_store = True
+    _parent_cache = True
+    _parent_store_gap = 100
     _parent_order = 'sequence, name'
     _order = 'parent_left'
 
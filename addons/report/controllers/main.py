@@ -22,6 +22,7 @@
 from openerp.addons.web.http import Controller, route, request
 from openerp.addons.web.controllers.main import _serialize_exception
 from openerp.osv import osv
+from openerp.service.model import readonly_call, use_replica
 
 import simplejson
 from werkzeug import exceptions, url_decode
@@ -53,7 +54,14 @@ class ReportController(Controller):
             context.update(simplejson.loads(data['context']))
 
         if converter == 'html':
-            html = report_obj.get_html(cr, uid, docids, reportname, data=options_data, context=context)
+            # rendering the html version only reads data, a read replica of
+            # the database may do it
+            if use_replica(request.db, uid):
+                html = readonly_call(request.db, report_obj.get_html, uid, docids, reportname,
+                                     data=options_data, context=context)
+            else:
+                html = report_obj.get_html(request.cr, uid, docids, reportname,
+                                           data=options_data, context=context)
             return request.make_response(html)
         elif converter == 'pdf':
             pdf = report_obj.get_pdf(cr, uid, docids, reportname, data=options_data, context=context)
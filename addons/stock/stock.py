@@ -57,6 +57,8 @@ class stock_location(osv.osv):
     _description = "Inventory Locations"
     _parent_name = "location_id"
     _parent_store = True
+    _parent_cache = True
+    _parent_store_gap = 100
     _parent_order = 'name'
     _order = 'parent_left'
     _rec_name = 'complete_name'
@@ -32,6 +32,7 @@ except ImportError:
 import openerp
 import openerp.modules.registry
 from openerp.addons.base.ir.ir_qweb import AssetsBundle, QWebTemplateNotFound
+from openerp.tools.cache import stats as ormcache_stats
 from openerp.tools.translate import _
 from openerp import http
 
@@ -338,6 +339,20 @@ def make_conditional(response, last_modified=None, etag=None, max_age=0):
         response.set_etag(etag)
     return response.make_conditional(request.httprequest)
 
+def make_immutable(response, etag):
+    """ Makes the provided response cacheable forever by clients and proxies,
+    for urls whose content never changes (e.g. including a checksum of it)
+
+    :param response: Werkzeug response
+    :type response: werkzeug.wrappers.Response
+    :param str etag: checksum of the content
+    :return: the response object provided
+    :rtype: werkzeug.wrappers.Response
+    """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % (60*60*24*365)
+    return response
+
 def login_and_redirect(db, login, key, redirect_url='/web'):
     request.session.authenticate(db, login, key)
     return set_cookie_and_redirect(redirect_url)
@@ -547,37 +562,52 @@ class Home(http.Controller):
     def login(self, db, login, key, redirect="/web", **kw):
         return login_and_redirect(db, login, key, redirect_url=redirect)
 
-    @http.route('/web/js/<xmlid>', type='http', auth="public")
-    def js_bundle(self, xmlid, **kw):
-        # manifest backward compatible mode, to be removed
-        values = {'manifest_list': manifest_list}
-        try:
-            assets_html = request.render(xmlid, lazy=False, qcontext=values)
-        except QWebTemplateNotFound:
-            return request.not_found()
-        bundle = AssetsBundle(xmlid, assets_html, debug=request.debug)
+    @http.route(['/web/js/<xmlid>', '/web/js/<xmlid>/<version>'], type='http', auth="public")
+    def js_bundle(self, xmlid, version=None, **kw):
+        return self._bundle_response(xmlid, version, 'js', 'application/javascript')
 
-        response = request.make_response(
-            bundle.js(), [('Content-Type', 'application/javascript')])
+    @http.route(['/web/css/<xmlid>', '/web/css/<xmlid>/<version>'], type='http', auth='public')
+    def css_bundle(self, xmlid, version=None, **kw):
+        return self._bundle_response(xmlid, version, 'css', 'text/css')
 
-        # TODO: check that we don't do weird lazy overriding of __call__ which break body-removal
-        return make_conditional(
-            response, bundle.last_modified, bundle.checksum, max_age=60*60*24)
+    def _bundle_response(self, xmlid, version, kind, mimetype):
+        """ Serve the ``kind`` content of the assets bundle ``xmlid``. The
+        versioned urls (see :meth:`AssetsBundle.url`) are content-addressed:
+        they are cached forever, and served from the compiled bundle saved in
+        an attachment without rendering the template when possible.
+        """
+        if version and request.httprequest.if_none_match.contains(version):
+            return werkzeug.wrappers.Response(status=304)
+        headers = [('Content-Type', mimetype)]
+        if version and not request.debug:
+            content = AssetsBundle.get_attachment(xmlid, kind, version)
+            if content is not None:
+                response = request.make_response(content, headers)
+                http.gzip_response(response, lambda: AssetsBundle.get_gzip(kind, version, content))
+                return make_immutable(response, version)
 
-    @http.route('/web/css/<xmlid>', type='http', auth='public')
-    def css_bundle(self, xmlid, **kw):
         values = {'manifest_list': manifest_list} # manifest backward compatible mode, to be removed
         try:
             assets_html = request.render(xmlid, lazy=False, qcontext=values)
         except QWebTemplateNotFound:
             return request.not_found()
-        bundle = AssetsBundle(xmlid, assets_html, debug=request.debug)
-
-        response = request.make_response(
-            bundle.css(), [('Content-Type', 'text/css')])
+        if request.debug:
+            bundle = AssetsBundle(xmlid, assets_html, debug=True)
+        else:
+            bundle = request.registry['ir.qweb'].get_assets_bundle(request.cr, xmlid, assets_html)
 
+        # TODO: check that we don't do weird lazy overriding of __call__ which break body-removal
+        content = getattr(bundle, kind)()
+        response = request.make_response(content, headers)
+        if request.debug:
+            http.gzip_response(response)
+        else:
+            http.gzip_response(response, lambda: AssetsBundle.get_gzip(kind, bundle.checksum, content))
+        if version == bundle.checksum and not request.debug:
+            return make_immutable(response, version)
+        # the unversioned and outdated urls are revalidated
         return make_conditional(
-            response, bundle.last_modified, bundle.checksum, max_age=60*60*24)
+            response, bundle.last_modified, bundle.checksum, max_age=0 if version else 60*60*24)
 
 class WebClient(http.Controller):
 
@@ -662,6 +692,14 @@ class WebClient(http.Controller):
     def version_info(self):
         return openerp.service.common.exp_version()
 
+    @http.route('/web/webclient/ormcache_stats', type='json', auth="user")
+    def ormcache_stats(self):
+        """ Statistics of the orm caches of the database, to tune their sizes;
+        reserved to the administrators. """
+        if not request.registry['res.users'].has_group(request.cr, request.uid, 'base.group_system'):
+            raise openerp.exceptions.AccessError(_("Only the administrators can see the statistics of the caches."))
+        return ormcache_stats(request.registry)
+
     @http.route('/web/tests', type='http', auth="none")
     def index(self, mod=None, **kwargs):
         return request.render('web.qunit_suite')
@@ -967,7 +1005,7 @@ class Menu(http.Controller):
 
 class DataSet(http.Controller):
 
-    @http.route('/web/dataset/search_read', type='json', auth="user")
+    @http.route('/web/dataset/search_read', type='json', auth="user", model_method='search_read')
     def search_read(self, model, fields=False, offset=0, limit=False, domain=None, sort=None):
         return self.do_search_read(model, fields, offset, limit, domain, sort)
     def do_search_read(self, model, fields=False, offset=0, limit=False, domain=None
@@ -1005,7 +1043,7 @@ class DataSet(http.Controller):
             'records': records
         }
 
-    @http.route('/web/dataset/load', type='json', auth="user")
+    @http.route('/web/dataset/load', type='json', auth="user", model_method='read')
     def load(self, model, id, fields):
         m = request.session.model(model)
         value = {}
@@ -1517,7 +1555,7 @@ class ExportFormat(object):
         current export class outputs
 
         :params list fields: a list of fields to export
-        :params list rows: a list of records to export
+        :params rows: an iterable of records to export
         :returns:
         :rtype: bytes
         """
@@ -1529,11 +1567,15 @@ class ExportFormat(object):
                                 'import_compat')(
                 simplejson.loads(data))
 
-        Model = request.session.model(model)
-        ids = ids or Model.search(domain, 0, False, False, request.context)
+        # the records are browsed by chunks while from_data() writes the rows,
+        # instead of being loaded all at once (the file is still built in
+        # memory)
+        Model = request.registry[model]
+        cr, uid = request.cr, request.uid
+        ids = ids or Model._iter_search(cr, uid, domain, context=request.context)
 
         field_names = map(operator.itemgetter('name'), fields)
-        import_data = Model.export_data(ids, field_names, self.raw_data, context=request.context).get('datas',[])
+        import_data = Model._export_rows(cr, uid, ids, field_names, self.raw_data, context=request.context)
 
         if import_compat:
             columns_headers = field_names
@@ -13,6 +13,7 @@ from openerp.addons.base.ir import ir_qweb
 from openerp.addons.website.models.website import slug, url_for
 from openerp.http import request
 from openerp.osv import orm
+from openerp.service.model import use_replica
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +47,12 @@ class ir_http(orm.AbstractModel):
         try:
             func, arguments = self._find_handler()
             request.website_enabled = func.routing.get('website', False)
+            # the public pages of anonymous visitors may be served by a read
+            # replica of the database
+            if request.website_enabled and func.routing['auth'] == 'public' and \
+                    request.httprequest.method == 'GET' and not request.session.uid and \
+                    use_replica(request.db, None):
+                request.readonly = True
         except werkzeug.exceptions.NotFound:
             # either we have a language prefixed route, either a real 404
             # in all cases, website processes them
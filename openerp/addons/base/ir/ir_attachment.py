@@ -305,6 +305,11 @@ class ir_attachment(osv.osv):
         self.check(cr, uid, ids, 'write', context=context, values=vals)
         if 'file_size' in vals:
             del vals['file_size']
+        if ids and ('datas' in vals or 'url' in vals):
+            # the assets bundles may include attachments by their url
+            cr.execute("SELECT 1 FROM ir_attachment WHERE id IN %s AND url IS NOT NULL LIMIT 1", (tuple(ids),))
+            if cr.fetchone() or vals.get('url'):
+                self.pool['ir.qweb'].clear_caches()
         return super(ir_attachment, self).write(cr, uid, ids, vals, context)
 
     def copy(self, cr, uid, id, default=None, context=None):
@@ -49,6 +49,13 @@ _intervalTypes = {
     'minutes': lambda interval: relativedelta(minutes=interval),
 }
 
+# priority classes of the jobs, by decreasing priority
+_priorityClasses = [
+    ('high', 'High'),
+    ('normal', 'Normal'),
+    ('low', 'Low'),
+]
+
 class ir_cron(osv.osv):
     """ Model describing cron jobs (also called actions or tasks).
     """
@@ -73,12 +80,28 @@ class ir_cron(osv.osv):
         'model': fields.char('Object', size=64, help="Model name on which the method to be called is located, e.g. 'res.partner'."),
         'function': fields.char('Method', size=64, help="Name of the method to be called when this job is processed."),
         'args': fields.text('Arguments', help="Arguments to be passed to the method, e.g. (uid,)."),
-        'priority': fields.integer('Priority', help='The priority of the job, as an integer: 0 means higher priority, 10 means lower priority.')
+        'priority': fields.integer('Priority', help='The priority of the job, as an integer: 0 means higher priority, 10 means lower priority.'),
+        'priority_class': fields.selection(_priorityClasses, 'Priority Class', required=True,
+            help="Due jobs are started by priority class, then by priority."),
+        'max_parallel': fields.integer('Maximum Parallelism',
+            help="Maximum number of jobs of the same priority class running at the same time "
+                 "when this job starts, 0 means no limit."),
+        'run_count': fields.integer('Number of Runs', readonly=True),
+        'last_duration': fields.float('Last Duration', readonly=True,
+            help="Duration of the last run, in seconds."),
+        'avg_duration': fields.float('Average Duration', readonly=True,
+            help="Average duration of the runs, in seconds."),
+        'last_lag': fields.float('Last Lag', readonly=True,
+            help="Delay between the planned and the actual start of the last run, in seconds."),
+        'avg_lag': fields.float('Average Lag', readonly=True,
+            help="Average delay between the planned and the actual start of the runs, in seconds."),
     }
 
     _defaults = {
         'nextcall' : lambda *a: time.strftime(DEFAULT_SERVER_DATETIME_FORMAT),
         'priority' : 5,
+        'priority_class': 'normal',
+        'max_parallel': 0,
         'user_id' : lambda obj,cr,uid,context: uid,
         'interval_number' : 1,
         'interval_type' : 'months',
@@ -99,6 +122,10 @@ class ir_cron(osv.osv):
         (_check_args, 'Invalid arguments', ['args']),
     ]
 
+    _sql_constraints = [
+        ('max_parallel_positive', 'CHECK (max_parallel >= 0)', 'The maximum parallelism cannot be negative.'),
+    ]
+
     def _handle_callback_exception(self, cr, uid, model_name, method_name, args, job_id, job_exception):
         """ Method called when an exception is raised by a job.
 
@@ -161,6 +188,7 @@ class ir_cron(osv.osv):
             now = datetime.now() 
             nextcall = datetime.strptime(job['nextcall'], DEFAULT_SERVER_DATETIME_FORMAT)
             numbercall = job['numbercall']
+            lag = max((now - nextcall).total_seconds(), 0.0)
 
             ok = False
             while nextcall < now and numbercall:
@@ -176,11 +204,27 @@ class ir_cron(osv.osv):
                 addsql = ', active=False'
             cron_cr.execute("UPDATE ir_cron SET nextcall=%s, numbercall=%s"+addsql+" WHERE id=%s",
                        (nextcall.strftime(DEFAULT_SERVER_DATETIME_FORMAT), numbercall, job['id']))
+            if ok:
+                self._update_stats(cron_cr, job['id'], (datetime.now() - now).total_seconds(), lag)
+            self._notify(cron_cr)
 
         finally:
             job_cr.commit()
             cron_cr.commit()
 
+    @classmethod
+    def _update_stats(cls, cr, job_id, duration, lag):
+        """ Account a run of the given job, that took ``duration`` seconds and
+        started ``lag`` seconds after its planned date. """
+        cr.execute("""UPDATE ir_cron
+                      SET run_count=coalesce(run_count, 0) + 1,
+                          last_duration=%s,
+                          avg_duration=coalesce(avg_duration, 0) + (%s - coalesce(avg_duration, 0)) / (coalesce(run_count, 0) + 1),
+                          last_lag=%s,
+                          avg_lag=coalesce(avg_lag, 0) + (%s - coalesce(avg_lag, 0)) / (coalesce(run_count, 0) + 1)
+                      WHERE id=%s""",
+                   (duration, duration, lag, lag, job_id))
+
     @classmethod
     def _acquire_job(cls, db_name):
         # TODO remove 'check' argument from addons/base_action_rule/base_action_rule.py
@@ -221,50 +265,127 @@ class ir_cron(osv.osv):
         finally:
             cr.close()
 
-        for job in jobs:
-            lock_cr = db.cursor()
-            try:
-                # Try to grab an exclusive lock on the job row from within the task transaction
-                # Restrict to the same conditions as for the search since the job may have already
-                # been run by an other thread when cron is running in multi thread
-                lock_cr.execute("""SELECT *
-                                   FROM ir_cron
-                                   WHERE numbercall != 0
-                                      AND active
-                                      AND nextcall <= (now() at time zone 'UTC')
-                                      AND id=%s
-                                   FOR UPDATE NOWAIT""",
-                               (job['id'],), log_exceptions=False)
-
-                locked_job = lock_cr.fetchone()
-                if not locked_job:
-                    # job was already executed by another parallel process/thread, skipping it.
-                    continue
-                # Got the lock on the job row, run its code
-                _logger.debug('Starting job `%s`.', job['name'])
-                job_cr = db.cursor()
+        if jobs:
+            threads = openerp.tools.config['cron_job_threads']
+            if threads > 1 and len(jobs) > 1:
+                cls._run_jobs_parallel(db, db_name, jobs, threads)
+            else:
+                for job in cls._sort_jobs(jobs):
+                    cls._run_job(db, db_name, job)
+
+        if hasattr(threading.current_thread(), 'dbname'): # cron job could have removed it as side-effect
+            del threading.current_thread().dbname
+
+    @classmethod
+    def _sort_jobs(cls, jobs):
+        """ Return the given jobs in the order they must be started. """
+        classes = [key for key, label in _priorityClasses]
+        def key(job):
+            return (classes.index(job.get('priority_class') or 'normal'), job['priority'])
+        return sorted(jobs, key=key)
+
+    @classmethod
+    def _run_jobs_parallel(cls, db, db_name, jobs, threads):
+        """ Run the given jobs with at most ``threads`` threads at the same
+        time, starting them by priority, and honoring their maximum
+        parallelism within their priority class. """
+        todo = cls._sort_jobs(jobs)
+        running = {}                    # priority class: number of running jobs
+        condition = threading.Condition()
+
+        def next_job():
+            for job in todo:
+                limit = job.get('max_parallel') or 0
+                if limit <= 0 or running.get(job.get('priority_class'), 0) < limit:
+                    return job
+
+        def target():
+            threading.current_thread().dbname = db_name
+            while True:
+                with condition:
+                    job = next_job()
+                    while job is None and todo:
+                        condition.wait()
+                        job = next_job()
+                    if job is None:
+                        return
+                    todo.remove(job)
+                    running[job.get('priority_class')] = running.get(job.get('priority_class'), 0) + 1
                 try:
-                    registry = openerp.registry(db_name)
-                    registry[cls._name]._process_job(job_cr, job, lock_cr)
+                    cls._run_job(db, db_name, job)
                 except Exception:
-                    _logger.exception('Unexpected exception while processing cron job %r', job)
+                    _logger.exception('Unexpected exception while running cron job %r', job)
                 finally:
-                    job_cr.close()
+                    with condition:
+                        running[job.get('priority_class')] -= 1
+                        condition.notify_all()
+
+        workers = []
+        current = threading.current_thread().name
+        for i in range(min(threads, len(jobs))):
+            worker = threading.Thread(target=target, name='%s.job%d' % (current, i))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
 
-            except psycopg2.OperationalError, e:
-                if e.pgcode == '55P03':
-                    # Class 55: Object not in prerequisite state; 55P03: lock_not_available
-                    _logger.debug('Another process/thread is already busy executing job `%s`, skipping it.', job['name'])
-                    continue
-                else:
-                    # Unexpected OperationalError
-                    raise
+    @classmethod
+    def _run_job(cls, db, db_name, job):
+        """ Lock the given job and run it, unless another process/thread has
+        already locked it. """
+        lock_cr = db.cursor()
+        try:
+            # Try to grab an exclusive lock on the job row from within the task transaction
+            # Restrict to the same conditions as for the search since the job may have already
+            # been run by an other thread when cron is running in multi thread
+            lock_cr.execute("""SELECT *
+                               FROM ir_cron
+                               WHERE numbercall != 0
+                                  AND active
+                                  AND nextcall <= (now() at time zone 'UTC')
+                                  AND id=%s
+                               FOR UPDATE NOWAIT""",
+                           (job['id'],), log_exceptions=False)
+
+            locked_job = lock_cr.fetchone()
+            if not locked_job:
+                # job was already executed by another parallel process/thread, skipping it.
+                return
+            # Got the lock on the job row, run its code
+            _logger.debug('Starting job `%s`.', job['name'])
+            job_cr = db.cursor()
+            try:
+                registry = openerp.registry(db_name)
+                registry[cls._name]._process_job(job_cr, job, lock_cr)
+            except Exception:
+                _logger.exception('Unexpected exception while processing cron job %r', job)
             finally:
-                # we're exiting due to an exception while acquiring the lock
-                lock_cr.close()
+                job_cr.close()
 
-        if hasattr(threading.current_thread(), 'dbname'): # cron job could have removed it as side-effect
-            del threading.current_thread().dbname
+        except psycopg2.OperationalError, e:
+            if e.pgcode == '55P03':
+                # Class 55: Object not in prerequisite state; 55P03: lock_not_available
+                _logger.debug('Another process/thread is already busy executing job `%s`, skipping it.', job['name'])
+            else:
+                # Unexpected OperationalError
+                raise
+        finally:
+            # we're exiting due to an exception while acquiring the lock
+            lock_cr.close()
+
+    @classmethod
+    def _next_call(cls, cr):
+        """ Return the next execution date of the active jobs, as a POSIX
+        timestamp, or None if there is no active job. """
+        cr.execute("""SELECT extract(epoch FROM min(nextcall) AT TIME ZONE 'UTC')
+                      FROM ir_cron WHERE numbercall != 0 AND active""")
+        return cr.fetchone()[0]
+
+    @classmethod
+    def _notify(cls, cr):
+        """ Wake up the schedulers listening to this database (see
+        openerp.service.cron) once the current transaction is committed. """
+        cr.execute('NOTIFY "%s"' % openerp.service.cron.CHANNEL)
 
     def _try_lock(self, cr, uid, ids, context=None):
         """Try to grab a dummy exclusive write-lock to the rows with the given ids,
@@ -281,16 +402,19 @@ class ir_cron(osv.osv):
 
     def create(self, cr, uid, vals, context=None):
         res = super(ir_cron, self).create(cr, uid, vals, context=context)
+        self._notify(cr)
         return res
 
     def write(self, cr, uid, ids, vals, context=None):
         self._try_lock(cr, uid, ids, context)
         res = super(ir_cron, self).write(cr, uid, ids, vals, context=context)
+        self._notify(cr)
         return res
 
     def unlink(self, cr, uid, ids, context=None):
         self._try_lock(cr, uid, ids, context)
         res = super(ir_cron, self).unlink(cr, uid, ids, context=context)
+        self._notify(cr)
         return res
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
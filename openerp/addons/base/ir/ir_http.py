@@ -145,6 +145,13 @@ class ir_http(osv.AbstractModel):
 
         return self._routing_map
 
+    def session_gc(self, cr, uid, context=None):
+        """ Delete the http sessions unused for a week; called by a cron job,
+        as the sessions are shared by all the databases it may run several
+        times a day. """
+        http.root.session_store.gc()
+        return True
+
 def convert_exception_to(to_type, with_message=False):
     """ Should only be called from an exception handler. Fetches the current
     exception data from sys.exc_info() and creates a new exception of type
@@ -16,6 +16,7 @@ from urlparse import urlparse
 
 import babel
 import babel.dates
+import psycopg2
 import werkzeug
 from PIL import Image
 
@@ -417,11 +418,18 @@ class QWeb(orm.AbstractModel):
         d.context['inherit_branding'] = False
         content = self.render_tag_call(
             element, {'call': name}, generated_attributes, d)
-        bundle = AssetsBundle(name, html=content)
+        bundle = self.pool['ir.qweb'].get_assets_bundle(qwebcontext.cr, name, content)
         css = self.get_attr_bool(template_attributes.get('css'), default=True)
         js = self.get_attr_bool(template_attributes.get('js'), default=True)
         return bundle.to_html(css=css, js=js, debug=bool(qwebcontext.get('debug')))
 
+    @openerp.tools.ormcache(size=64)
+    def get_assets_bundle(self, cr, xmlid, html):
+        """ Return the bundle of the assets of template ``xmlid``, rendered as
+        ``html``. The bundles are parsed and hashed once per registry, and
+        follow the changes of their template as its rendering changes too. """
+        return AssetsBundle(xmlid, html=html)
+
     def render_tag_set(self, element, template_attributes, generated_attributes, qwebcontext):
         if "value" in template_attributes:
             qwebcontext[template_attributes["set"]] = self.eval_object(template_attributes["value"], qwebcontext)
@@ -986,7 +994,7 @@ def get_field_type(column, options):
     return options.get('widget', column._type)
 
 class AssetsBundle(object):
-    cache = openerp.tools.lru.LRU(32)
+    cache = openerp.tools.lru.LRU(64)
     rx_css_import = re.compile("(@import[^;{]+;?)", re.M)
 
     def __init__(self, xmlid, html=None, debug=False):
@@ -1038,9 +1046,9 @@ class AssetsBundle(object):
                     response.append(jscript.to_html())
         else:
             if css and self.stylesheets:
-                response.append('<link href="/web/css/%s" rel="stylesheet"/>' % self.xmlid)
+                response.append('<link href="%s" rel="stylesheet"/>' % self.url('css'))
             if js and self.javascripts:
-                response.append('<script type="text/javascript" src="/web/js/%s"></script>' % self.xmlid)
+                response.append('<script type="text/javascript" src="%s"></script>' % self.url('js'))
         response.extend(self.remains)
         return sep + sep.join(response)
 
@@ -1059,19 +1067,24 @@ class AssetsBundle(object):
             checksum.update(asset.content.encode("utf-8"))
         return checksum.hexdigest()
 
+    def url(self, kind):
+        """ Return the versioned url of the ``kind`` ('js' or 'css') content of
+        the bundle; its content never changes, and may be cached forever. """
+        return bundle_url(self.xmlid, kind, self.checksum)
+
     def js(self):
-        key = 'js_' + self.checksum
-        if key not in self.cache:
-            content =';\n'.join(asset.minify() for asset in self.javascripts)
-            self.cache[key] = content
+        content = self.get_cache('js')
+        if content is None:
+            content = ';\n'.join(asset.minify() for asset in self.javascripts)
+            self.set_cache('js', content)
         if self.debug:
             return "/*\n%s\n*/\n" % '\n'.join(
-                [asset.url for asset in self.javascripts if asset.url]) + self.cache[key]
-        return self.cache[key]
+                [asset.url for asset in self.javascripts if asset.url]) + content
+        return content
 
     def css(self):
-        key = 'css_' + self.checksum
-        if key not in self.cache:
+        content = self.get_cache('css')
+        if content is None:
             content = '\n'.join(asset.minify() for asset in self.stylesheets)
             # move up all @import rules to the top
             matches = []
@@ -1083,11 +1096,74 @@ class AssetsBundle(object):
 
             matches.append(content)
             content = u'\n'.join(matches)
-            self.cache[key] = content
+            self.set_cache('css', content)
         if self.debug:
             return "/*\n%s\n*/\n" % '\n'.join(
-                [asset.url for asset in self.javascripts if asset.url]) + self.cache[key]
-        return self.cache[key]
+                [asset.url for asset in self.javascripts if asset.url]) + content
+        return content
+
+    def get_cache(self, kind):
+        """ Return the compiled ``kind`` content of the bundle, from the cache
+        of the process or from the attachment it was saved in, or None. """
+        key = '%s_%s' % (kind, self.checksum)
+        content = self.cache.get(key)
+        if content is None:
+            content = self.get_attachment(self.xmlid, kind, self.checksum)
+            if content is not None:
+                self.cache[key] = content
+        return content
+
+    def set_cache(self, kind, content):
+        self.cache['%s_%s' % (kind, self.checksum)] = content
+        self.save_attachment(kind, content)
+
+    @classmethod
+    def get_gzip(cls, kind, checksum, content):
+        """ Return the ``kind`` content of the bundle with ``checksum``
+        gzipped; it is compressed once, and cached next to the content. """
+        key = '%s.gz_%s' % (kind, checksum)
+        data = cls.cache.get(key)
+        if data is None:
+            data = cls.cache[key] = openerp.http.gzip_compress(content.encode('utf-8'))
+        return data
+
+    @staticmethod
+    def get_attachment(xmlid, kind, checksum):
+        """ Return the ``kind`` content of bundle ``xmlid`` saved with
+        ``checksum`` by :meth:`save_attachment`, or None. """
+        # only trust the attachments saved by the bundles themselves
+        domain = [('type', '=', 'binary'), ('url', '=', bundle_url(xmlid, kind, checksum)),
+                  ('create_uid', '=', SUPERUSER_ID)]
+        attach = request.registry['ir.attachment'].search_read(
+            request.cr, SUPERUSER_ID, domain, ['datas'], limit=1)
+        if attach and attach[0]['datas']:
+            return attach[0]['datas'].decode('base64').decode('utf-8')
+        return None
+
+    def save_attachment(self, kind, content):
+        """ Save the compiled ``kind`` content of the bundle as an attachment,
+        replacing its previous versions, so that the other processes and the
+        next registries find it compiled already. This is best effort: the
+        current transaction may be read-only. """
+        cr = request.cr
+        ira = request.registry['ir.attachment']
+        url = self.url(kind)
+        try:
+            with cr.savepoint():
+                domain = [('type', '=', 'binary'), ('url', '=like', bundle_url(self.xmlid, kind, '%'))]
+                ira.unlink(cr, SUPERUSER_ID, ira.search(cr, SUPERUSER_ID, domain))
+                ira.create(cr, SUPERUSER_ID, {
+                    'name': url,
+                    'datas_fname': '%s.%s' % (self.xmlid, kind),
+                    'type': 'binary',
+                    'url': url,
+                    'datas': content.encode('utf-8').encode('base64'),
+                })
+        except psycopg2.Error:
+            _logger.debug("Could not save the %s of bundle %s", kind, self.xmlid, exc_info=True)
+
+def bundle_url(xmlid, kind, checksum):
+    return '/web/%s/%s/%s' % (kind, xmlid, checksum)
 
 class WebAsset(object):
     def __init__(self, source=None, url=None):
@@ -267,6 +267,27 @@ class ir_translation(osv.osv):
                 translations[res_id] = value
         return translations
 
+    def _get_ids_multi(self, cr, uid, names, tt, lang, ids):
+        """ Return the translations of the terms ``names`` (e.g. several
+            fields of a model) for the records ``ids``, as a dict mapping each
+            name to a dict ``{res_id: value or False}``. All the terms are
+            fetched with a single query per chunk of ids, and are not cached
+            (unlike with ``_get_ids()``).
+        """
+        translations = dict((name, dict.fromkeys(ids, False)) for name in names)
+        if ids and names:
+            for sub_ids in cr.split_for_in_conditions(ids):
+                cr.execute('select name,res_id,value '
+                        'from ir_translation '
+                        'where lang=%s '
+                            'and type=%s '
+                            'and name IN %s '
+                            'and res_id IN %s',
+                        (lang,tt,tuple(names),sub_ids))
+                for name, res_id, value in cr.fetchall():
+                    translations[name][res_id] = value
+        return translations
+
     def _set_ids(self, cr, uid, name, tt, lang, ids, value, src=None):
         self._get_ids.clear_cache(self)
         self._get_source.clear_cache(self)
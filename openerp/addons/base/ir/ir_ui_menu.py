@@ -47,7 +47,7 @@ class ir_ui_menu(osv.osv):
             if self._cache:
                 # Normally this is done by openerp.tools.ormcache
                 # but since we do not use it, set it by ourself.
-                self.pool._any_cache_cleared = True
+                self.pool.cache_cleared(self._name)
             self._cache = {}
 
     def _filter_visible_menus(self, cr, uid, ids, context=None):
@@ -64,6 +64,7 @@ class res_currency(osv.osv):
 
     _name = "res.currency"
     _description = "Currency"
+    _read_cache = True
     _columns = {
         # Note: 'code' column was removed as of v6.0, the 'name' should now hold the ISO code.
         'name': fields.char('Currency', size=32, required=True, help="Currency Code (ISO 4217)"),
@@ -123,9 +123,25 @@ class res_groups(osv.osv):
                 raise osv.except_osv(_('Error'),
                         _('The name of the group can not start with "-"'))
         res = super(res_groups, self).write(cr, uid, ids, vals, context=context)
-        self.pool['ir.model.access'].call_cache_clearing_methods(cr)
+        self._clear_group_caches(cr)
+        return res
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(res_groups, self).create(cr, uid, vals, context=context)
+        self._clear_group_caches(cr)
         return res
 
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(res_groups, self).unlink(cr, uid, ids, context=context)
+        self._clear_group_caches(cr)
+        return res
+
+    def _clear_group_caches(self, cr):
+        """ Clear the caches depending on the groups and their users. """
+        self.pool['ir.model.access'].call_cache_clearing_methods(cr)
+        res_users = self.pool['res.users']
+        res_users._has_groups.clear_cache(res_users)
+
 class res_users(osv.osv):
     """ User class. A res.users record models an OpenERP user and is different
         from an employee.
@@ -324,6 +340,7 @@ class res_users(osv.osv):
                 if id in self._uid_cache[db]:
                     del self._uid_cache[db][id]
         self.context_get.clear_cache(self)
+        self._has_groups.clear_cache(self)
         return res
 
     def unlink(self, cr, uid, ids, context=None):
@@ -521,6 +538,20 @@ class res_users(osv.osv):
                    (uid, module, ext_id))
         return bool(cr.fetchone())
 
+    @tools.ormcache(skiparg=2)
+    def _has_groups(self, cr, uid, groups):
+        """Checks whether user belongs to at least one of the given groups,
+        with a single query. The result is cached per user and tuple of groups.
+
+        :param tuple groups: fully-qualified external IDs of the groups, as in
+           the ``read`` and ``write`` attributes of fields.
+        """
+        xml_ids = tuple(tuple(group.split('.', 1)) for group in groups)
+        cr.execute("""SELECT 1 FROM res_groups_users_rel WHERE uid=%s AND gid IN
+                        (SELECT res_id FROM ir_model_data WHERE model='res.groups' AND (module, name) IN %s)""",
+                   (uid, xml_ids))
+        return bool(cr.fetchone())
+
 #----------------------------------------------------------
 # Implied groups
 #
@@ -19,6 +19,7 @@ import test_qweb
 import test_res_config
 import test_res_lang
 import test_search
+import test_shared_cache
 import test_translate
 #import test_uninstall
 import test_view_validation
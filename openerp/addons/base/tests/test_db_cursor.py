@@ -29,4 +29,115 @@ class test_cr_execute(unittest2.TestCase):
             with self.assertRaises(ValueError):
                 cr.execute("SELECT id FROM res_users WHERE id=%s", '1')
 
+    def test_stream(self):
+        """ Iterate over a result fetched by chunks, while querying. """
+        with registry().cursor() as cr:
+            rows = cr.stream("SELECT i FROM generate_series(1, %s) AS i", (25,), itersize=10)
+            self.assertEqual(rows.next(), (1,))
+            cr.execute("SELECT 42")
+            self.assertEqual(cr.fetchone(), (42,))
+            self.assertEqual([row[0] for row in rows], range(2, 26))
+
+    def test_modified(self):
+        """ The cursor tells whether it executed statements modifying data. """
+        with registry().cursor() as cr:
+            cr.execute("SELECT 1")
+            self.assertFalse(cr.modified)
+            cr.execute("UPDATE res_users SET login=login WHERE id=%s", (ADMIN_USER_ID,))
+            self.assertTrue(cr.modified)
+            cr.rollback()
+            self.assertFalse(cr.modified)
+            cr.execute("UPDATE res_users SET login=login WHERE id=%s", (ADMIN_USER_ID,))
+            cr.commit()
+            cr.execute("SELECT 1")
+            cr.rollback()
+            # the committed transaction did
+            self.assertTrue(cr.modified)
+
+            rows = cr.stream("SELECT i AS value FROM generate_series(1, 3) AS i", dictfetch=True)
+            self.assertEqual(list(rows), [{'value': 1}, {'value': 2}, {'value': 3}])
+
+            with self.assertRaises(ValueError):
+                cr.stream("SELECT id FROM res_users WHERE id=%s", 1)
+
+    def test_profiler(self):
+        """ Profile the queries of the current thread. """
+        with registry().cursor() as cr:
+            profiler = openerp.sql_db.start_profiler(top=2)
+            try:
+                for login in ('admin', 'demo', 'admin'):
+                    cr.execute("SELECT id FROM res_users WHERE login=%s", (login,))
+                cr.execute("SELECT id FROM res_users WHERE id = 1")
+            finally:
+                self.assertIs(openerp.sql_db.stop_profiler(), profiler)
+            cr.execute("SELECT 1")
+
+        summary = profiler.summary()
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['duplicates'], 1)
+        self.assertEqual(len(summary['slowest']), 2)
+        [repeated] = summary['repeated']
+        self.assertEqual(repeated['query'], "SELECT id FROM res_users WHERE login=?")
+        self.assertEqual(repeated['count'], 3)
+        self.assertIn('test_db_cursor.py', repeated['caller'])
+
+    def test_query_fingerprint(self):
+        fingerprint = openerp.sql_db.query_fingerprint
+        self.assertEqual(fingerprint("SELECT  a FROM t\n WHERE b = 'it''s' AND c IN (1, 2.5) AND d=%s"),
+                         "SELECT a FROM t WHERE b = ? AND c IN (?, ?) AND d=?")
+        self.assertEqual(fingerprint("SELECT res_partner_1.id FROM res_partner res_partner_1"),
+                         "SELECT res_partner_1.id FROM res_partner res_partner_1")
+
+class test_connection_pool(unittest2.TestCase):
+    """ Borrow and give back connections of a private pool """
+
+    def setUp(self):
+        self.pool = openerp.sql_db.ConnectionPool(2, wait_timeout=0)
+        self.dsn = openerp.sql_db.dsn(DB)
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_reuse(self):
+        cnx = self.pool.borrow(self.dsn)
+        self.pool.give_back(cnx)
+        self.assertIs(self.pool.borrow(self.dsn), cnx)
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['reused']), (1, 1))
+        self.assertEqual((stats['used'], stats['idle']), (1, 0))
+
+    @mute_logger('openerp.sql_db')
+    def test_full(self):
+        cnx1 = self.pool.borrow(self.dsn)
+        cnx2 = self.pool.borrow(self.dsn)
+        self.assertIsNot(cnx1, cnx2)
+        with self.assertRaises(openerp.sql_db.PoolError):
+            self.pool.borrow(self.dsn)
+        self.assertEqual(self.pool.stats()['waits'], 1)
+        # an idle connection makes room for another database
+        self.pool.give_back(cnx2)
+        cnx3 = self.pool.borrow(openerp.sql_db.dsn('postgres'))
+        self.assertTrue(cnx2.closed)
+        self.assertEqual(self.pool.stats()['evicted'], 1)
+        self.pool.give_back(cnx3, keep_in_pool=False)
+        self.assertEqual(self.pool.stats()['count'], 1)
+
+    def test_replicas(self):
+        config = openerp.tools.config
+        old_replicas = config['db_replicas']
+        try:
+            config['db_replicas'] = 'localhost, replica:5433'
+            dsns = openerp.sql_db.replica_dsns(DB)
+            self.assertEqual(len(dsns), 2)
+            self.assertIn('host=replica port=5433 ', dsns[1])
+            # the primary database is not a replica, it is never picked
+            config['db_replicas'] = config['db_host'] or 'localhost'
+            self.assertIsNone(openerp.sql_db.replica_dsn(self.pool, DB))
+            cr = openerp.sql_db.Cursor(self.pool, DB, readonly=True)
+            self.assertFalse(cr.readonly)
+            cr.close()
+        finally:
+            config['db_replicas'] = old_replicas
+            openerp.sql_db._replica_lags.clear()
+
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -467,6 +467,36 @@ class test_expression(common.TransactionCase):
         norm_domain = ['&', '&', '&'] + domain
         assert norm_domain == expression.normalize_domain(domain), "Non-normalized domains should be properly normalized"
         
+    def test_40_domain_cache(self):
+        registry, cr, uid = self.registry, self.cr, self.uid
+        partner_obj = registry('res.partner')
+        expression = openerp.osv.expression
+        partner_obj.create(cr, uid, {'name': 'test__domain_cache_A'})
+        partner_obj.create(cr, uid, {'name': 'test__domain_cache_B'})
+
+        # domains with the same shape share their SQL, not their parameters
+        self._reinit_mock()
+        for name in ('test__domain_cache_A', 'test__domain_cache_B'):
+            ids = partner_obj.search(cr, uid, [('name', '=', name)])
+            self.assertEqual([p['name'] for p in partner_obj.read(cr, uid, ids, ['name'])], [name])
+        self.assertIn(('res.partner', expression.domain_shape(partner_obj, [('active', '=', 1), ('name', '=', 'x')])),
+                      registry._domain_cache)
+        sql_a, sql_b = self.query_list[0].get_sql(), self.query_list[-1].get_sql()
+        self.assertEqual(sql_a[:2], sql_b[:2])
+        self.assertNotEqual(sql_a[2], sql_b[2])
+
+        # the SQL depends on the values which are false
+        self.assertNotEqual(expression.domain_shape(partner_obj, [('parent_id', '=', 1)]),
+                            expression.domain_shape(partner_obj, [('parent_id', '=', False)]))
+        self.assertNotEqual(expression.domain_shape(partner_obj, [('parent_id', 'in', [1, 2])]),
+                            expression.domain_shape(partner_obj, [('parent_id', 'in', [1, False])]))
+        # and on the subqueries of inselect terms
+        self.assertNotEqual(expression.domain_shape(partner_obj, [('id', 'inselect', ('SELECT id FROM res_partner WHERE id=%s', [1]))]),
+                            expression.domain_shape(partner_obj, [('id', 'inselect', ('SELECT id FROM res_users WHERE id=%s', [1]))]))
+
+        # and child_of domains are not cached at all
+        self.assertIsNone(expression.domain_shape(partner_obj, [('parent_id', 'child_of', 1)]))
+
     def test_translate_search(self):
         Country = self.registry('res.country')
         be = self.ref('base.be')
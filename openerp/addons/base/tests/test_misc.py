@@ -1,6 +1,17 @@
+import gzip
+import os
+import shutil
+import tempfile
 import unittest2
+import zlib
+from cStringIO import StringIO
 
-from openerp.tools import misc
+import simplejson
+
+from openerp import http
+from openerp.tools import misc, mute_logger
+from openerp.tools.cache import ormcache
+from openerp.tools.lru import LRU
 
 
 class test_countingstream(unittest2.TestCase):
@@ -33,5 +44,146 @@ class test_countingstream(unittest2.TestCase):
         self.assertIsNone(next(s, None))
         self.assertEqual(s.index, 0)
 
+
+class test_lru(unittest2.TestCase):
+    def test_eviction(self):
+        d = LRU(3)
+        for i in range(5):
+            d[i] = i * 10
+        self.assertEqual(sorted(d.keys()), [2, 3, 4])
+        d[2]
+        d[5] = 50
+        self.assertEqual(list(d.iteritems()), [(4, 40), (2, 20), (5, 50)])
+        self.assertEqual(d.stats()['evictions'], 3)
+
+    def test_max_size(self):
+        d = LRU(100, max_size=1000, sizeof=lambda key, value: len(value))
+        for i in range(10):
+            d[i] = 'x' * 300
+        self.assertEqual(sorted(d.keys()), [7, 8, 9])
+        self.assertEqual(d.size, 900)
+        d[9] = 'x'
+        self.assertEqual(d.size, 601)
+
+    def test_stats(self):
+        d = LRU(10)
+        d[1] = 1
+        d[1]
+        d.get(2)
+        stats = d.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['ratio']), (1, 1, 50.0))
+
+
+class test_ormcache(unittest2.TestCase):
+    def test_unhashable_arguments(self):
+        calls = []
+        cache = ormcache()
+
+        class Model(object):
+            _name = 'test.model'
+
+            @cache
+            def method(self, cr, ids):
+                calls.append(ids)
+                return len(ids)
+
+        model = Model()
+        self.assertEqual(model.method(None, [1, 2]), 2)
+        self.assertEqual(model.method(None, [1, 2]), 2)
+        self.assertEqual(calls, [[1, 2]])
+        self.assertEqual((cache.stat_hit, cache.stat_miss, cache.stat_err), (1, 1, 0))
+
+class test_gzip(unittest2.TestCase):
+    def test_compress(self):
+        data = 'openerp.web = function() {};\n' * 100
+        compressed = http.gzip_compress(data)
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(compressed)).read(), data)
+        # deterministic, so that it may be cached
+        self.assertEqual(http.gzip_compress(data), compressed)
+
+    def test_static_files(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(root, 'src', 'js'))
+        filename = os.path.join(root, 'src', 'js', 'boot.js')
+        with open(filename, 'w') as f:
+            f.write('var boot;')
+
+        middleware = http.StaticGzipMiddleware(None, {'/web/static': root})
+        self.assertEqual(middleware.get_filename('/web/static/src/js/boot.js'), filename)
+        self.assertEqual(middleware.get_filename('//web/static/src/./js/../js/boot.js'), None)
+        self.assertIsNone(middleware.get_filename('/web/static/../../%s' % filename))
+        self.assertIsNone(middleware.get_filename('/web/static/src/js/missing.js'))
+        self.assertIsNone(middleware.get_filename('/web/staticfoo/src/js/boot.js'))
+
+        stat = os.stat(filename)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(middleware.compress(filename, stat))).read(), 'var boot;')
+
+class test_session_store(unittest2.TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.store = http.SqliteSessionStore(os.path.join(root, 'sessions.sqlite'))
+
+    def test_save_get(self):
+        session = self.store.new()
+        session['uid'] = 1
+        self.store.save(session)
+
+        loaded = self.store.get(session.sid)
+        self.assertFalse(loaded.new)
+        self.assertEqual(dict(loaded), {'uid': 1})
+
+        self.store.delete(session)
+        self.assertTrue(self.store.get(session.sid).new)
+
+    def test_gc(self):
+        used, unused = self.store.new(), self.store.new()
+        self.store.save(used)
+        self.store.save(unused)
+        self.store.connection().execute("UPDATE http_session SET write_date = write_date - ? WHERE sid = ?",
+                                        (http.SESSION_MAX_AGE + 60, unused.sid))
+        self.store.gc()
+        self.assertFalse(self.store.get(used.sid).new)
+        self.assertTrue(self.store.get(unused.sid).new)
+
+class test_json_stream(unittest2.TestCase):
+    def response(self, result):
+        return {'jsonrpc': '2.0', 'id': None, 'result': result}
+
+    def test_streamable(self):
+        records = [{'id': i, 'name': u'R\xe9cord %s' % i} for i in range(http.JSON_STREAM_ITEMS + 1)]
+        self.assertTrue(http.json_streamable(self.response(records)))
+        self.assertTrue(http.json_streamable(self.response({'length': len(records), 'records': records})))
+        self.assertFalse(http.json_streamable(self.response(records[:10])))
+        self.assertFalse(http.json_streamable(self.response(None)))
+
+    def test_chunks(self):
+        records = [{'id': i, 'name': u'R\xe9cord %s' % i, 'partner_id': [i, 'Partner'], 'active': False}
+                   for i in range(5000)]
+        for result in [records, {'length': len(records), 'records': records}, {1: 'one'}, None]:
+            response = self.response(result)
+            chunks = list(http.json_chunks(response, size=1024))
+            # the same serialization as at once
+            self.assertEqual(''.join(chunks), simplejson.dumps(response))
+            self.assertTrue(all(len(chunk) >= 1024 for chunk in chunks[:-1]))
+
+            compressed = ''.join(http.gzip_chunks(iter(chunks)))
+            self.assertEqual(zlib.decompress(compressed, 16 + zlib.MAX_WBITS), ''.join(chunks))
+
+    def test_safe_chunks(self):
+        records = [{'id': i, 'name': u'R\xe9cord %s' % i} for i in range(100)]
+        # an error in the first chunk is raised before the response is sent
+        with self.assertRaises(TypeError):
+            http.json_safe_chunks(self.response([object()] + records), size=1024)
+        # an error in the next chunks ends the stream
+        chunks = http.json_safe_chunks(self.response(records + [object()]), size=1024)
+        with mute_logger('openerp.http'):
+            body = ''.join(chunks)
+        full = simplejson.dumps(self.response(records))
+        self.assertTrue(full.startswith(body))
+        self.assertLess(len(body), len(full))
+
 if __name__ == '__main__':
     unittest2.main()
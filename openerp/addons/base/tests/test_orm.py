@@ -1,4 +1,7 @@
 from collections import defaultdict
+
+from openerp.modules.registry import SignalingListener, SIGNALING_CHANNEL, process_token
+from openerp.osv import orm
 from openerp.tools import mute_logger
 from openerp.tests import common
 
@@ -101,6 +104,347 @@ class TestORM(common.TransactionCase):
         found = self.partner.search_read(self.cr, UID, [['name', '=', 'Does not exists']], ['name'])
         self.assertEqual(len(found), 0)
 
+    def test_browse_prefetch(self):
+        """ non-prefetchable fields accessed on a browse cache are fetched
+            together, for all the pending records, in a single read() """
+        cr, uid = self.cr, self.uid
+        parent_ids = [self.partner.create(cr, uid, {'name': 'Parent %d' % i}) for i in range(3)]
+        for parent_id in parent_ids:
+            self.partner.create(cr, uid, {'name': 'Child', 'parent_id': parent_id})
+
+        parents = self.partner.browse(cr, uid, parent_ids)
+        stats = parents[0]._cache.stats
+        reads = stats['read']
+        for parent in parents:
+            parent.child_ids
+            parent.category_id
+        # one read for child_ids (all parents), one for category_id (all parents)
+        self.assertEqual(stats['read'] - reads, 2)
+
+        parents = self.partner.browse(cr, uid, parent_ids)
+        parents[0]._cache.accessed['res.partner'].update(['child_ids', 'category_id'])
+        reads = stats['read']
+        for parent in parents:
+            parent.child_ids
+            parent.category_id
+        # both fields are known to be needed, they are fetched at once
+        self.assertEqual(stats['read'] - reads, 1)
+
+    def test_store_set_values_bulk(self):
+        """ stored function fields of several records are written at once """
+        cr, uid = self.cr, self.uid
+        company_id = self.partner.create(cr, uid, {'name': 'Company', 'is_company': True})
+        ids = [self.partner.create(cr, uid, {'name': 'Contact %d' % i}) for i in range(3)]
+        self.partner.write(cr, uid, ids, {'parent_id': company_id})
+        for partner in self.partner.browse(cr, uid, ids):
+            self.assertEqual(partner.display_name, 'Company, %s' % partner.name)
+            self.assertEqual(partner.commercial_partner_id.id, company_id)
+
+        # recompute to NULL values (many2one) and back
+        self.partner.write(cr, uid, ids, {'parent_id': False})
+        for partner in self.partner.browse(cr, uid, ids):
+            self.assertEqual(partner.display_name, partner.name)
+            self.assertEqual(partner.commercial_partner_id.id, partner.id)
+
+    def test_defer_store_computation(self):
+        """ stored function fields are recomputed once, when needed """
+        cr, uid = self.cr, self.uid
+        ctx = {'defer_store_computation': True}
+        pid = self.partner.create(cr, uid, {'name': 'Foo'}, context=ctx)
+
+        def stored_display_name():
+            cr.execute("SELECT display_name FROM res_partner WHERE id=%s", (pid,))
+            return cr.fetchone()[0]
+
+        self.assertFalse(stored_display_name())
+        self.partner.write(cr, uid, [pid], {'name': 'Bar'}, context=ctx)
+        self.assertFalse(stored_display_name())
+        self.assertTrue(cr.transaction.get('store_queue'))
+
+        # searching on the pending field performs the recomputation
+        self.assertEqual(self.partner.search(cr, uid, [('display_name', '=', 'Bar')]), [pid])
+        self.assertEqual(stored_display_name(), 'Bar')
+        self.assertFalse(cr.transaction.get('store_queue'))
+
+        # reading the pending field, too
+        self.partner.write(cr, uid, [pid], {'name': 'Baz'}, context=ctx)
+        self.assertEqual(self.partner.read(cr, uid, pid, ['display_name'])['display_name'], 'Baz')
+
+        # and an explicit flush
+        self.partner.write(cr, uid, [pid], {'name': 'Qux'}, context=ctx)
+        self.partner.flush_store_computation(cr, uid)
+        self.assertEqual(stored_display_name(), 'Qux')
+
+        # the recomputations keep the language and timezone of the context
+        self.partner.write(cr, uid, [pid], {'name': 'Quux'}, context=dict(ctx, tz='Europe/Brussels'))
+        self.assertTrue(any(('tz', 'Europe/Brussels') in key[2] for key in cr.transaction['store_queue']))
+        self.partner.flush_store_computation(cr, uid)
+        self.assertEqual(stored_display_name(), 'Quux')
+
+    def test_create_multi(self):
+        """ create_multi() creates several records at once """
+        cr, uid = self.cr, self.uid
+        category = self.registry('res.partner.category')
+        root_id = category.create(cr, uid, {'name': 'Root'})
+        ids = category.create_multi(cr, uid, [
+            {'name': 'A', 'parent_id': root_id},
+            {'name': 'B', 'parent_id': root_id, 'active': False},
+            {'name': 'C'},
+        ])
+        self.assertEqual(len(ids), 3)
+        records = category.read(cr, uid, ids, ['name', 'active', 'parent_id', 'parent_left', 'parent_right'])
+        records = dict((r['id'], r) for r in records)
+        self.assertEqual([records[i]['name'] for i in ids], ['A', 'B', 'C'])
+        self.assertFalse(records[ids[1]]['active'])
+        self.assertTrue(records[ids[0]]['active'], "defaults are applied")
+
+        # nested set positions are maintained
+        self.assertEqual(category.search(cr, uid, [('id', 'child_of', root_id), ('active', 'in', [True, False])]),
+                         [root_id, ids[0], ids[1]])
+        for i in ids:
+            self.assertEqual(records[i]['parent_right'] - records[i]['parent_left'], 1)
+
+        # models overriding create() fall back on it
+        partner_ids = self.partner.create_multi(cr, uid, [{'name': 'P1'}, {'name': 'P2'}])
+        self.assertEqual([p['display_name'] for p in self.partner.read(cr, uid, partner_ids, ['display_name'])],
+                         ['P1', 'P2'])
+
+    def test_read_cache(self):
+        """ read() on models with _read_cache hits the transaction cache """
+        cr, uid = self.cr, self.uid
+        currency = self.registry('res.currency')
+        currency_id = currency.search(cr, uid, [], limit=1)[0]
+        stats = cr.cache.setdefault('read_cache_stats', {'hit': 0, 'miss': 0})
+        name = currency.read(cr, uid, [currency_id], ['name'])[0]['name']
+        hits = stats['hit']
+        self.assertEqual(currency.read(cr, uid, [currency_id], ['name'])[0]['name'], name)
+        self.assertEqual(stats['hit'], hits + 1)
+
+        # the fetched and cached records are returned in the order of ids
+        other_id = currency.search(cr, uid, [('id', '!=', currency_id)], limit=1)[0]
+        for ids in ([other_id, currency_id], [currency_id, other_id]):
+            self.assertEqual([r['id'] for r in currency.read(cr, uid, ids, ['name'])], ids)
+
+        # write() invalidates the cached values
+        currency.write(cr, uid, [currency_id], {'name': 'XXX'})
+        self.assertEqual(currency.read(cr, uid, [currency_id], ['name'])[0]['name'], 'XXX')
+        self.assertEqual(stats['hit'], hits + 1)
+
+        # and so does a rollback to a savepoint
+        cr.execute('SAVEPOINT test_read_cache')
+        currency.read(cr, uid, [currency_id], ['name'])
+        cr.execute("UPDATE res_currency SET name='YYY' WHERE id=%s", (currency_id,))
+        cr.execute('ROLLBACK TO SAVEPOINT test_read_cache')
+        self.assertEqual(currency.read(cr, uid, [currency_id], ['name'])[0]['name'], 'XXX')
+
+    def test_hierarchy_cache(self):
+        """ child_of is computed in memory on models with _parent_cache """
+        cr, uid = self.cr, self.uid
+        category = self.registry('res.partner.category')
+        root_id = category.create(cr, uid, {'name': 'Root'})
+        child_id = category.create(cr, uid, {'name': 'Child', 'parent_id': root_id})
+        other_id = category.create(cr, uid, {'name': 'Other'})
+        category._parent_cache = True
+        try:
+            self.assertEqual(sorted(category.search(cr, uid, [('id', 'child_of', root_id)])),
+                             sorted([root_id, child_id]))
+            self.assertIn(category._name, self.registry._hierarchy_cache)
+
+            # an index built from a snapshot that does not see the last
+            # invalidation is not shared
+            self.registry._hierarchy_cache.pop(category._name)
+            cr.execute("SELECT txid_current() + 1000")
+            self.registry._hierarchy_invalidation[category._name] = (0, cr.fetchone()[0])
+            self.assertEqual(sorted(category.search(cr, uid, [('id', 'child_of', root_id)])),
+                             sorted([root_id, child_id]))
+            self.assertNotIn(category._name, self.registry._hierarchy_cache)
+
+            # changing the parents invalidates the index
+            grandchild_id = category.create(cr, uid, {'name': 'Grandchild', 'parent_id': child_id})
+            category.write(cr, uid, [other_id], {'parent_id': root_id})
+            self.assertEqual(sorted(category.search(cr, uid, [('id', 'child_of', root_id)])),
+                             sorted([root_id, child_id, grandchild_id, other_id]))
+            category.unlink(cr, uid, [child_id])
+            self.assertEqual(sorted(category.search(cr, uid, [('id', 'child_of', root_id)])),
+                             sorted([root_id, other_id]))
+        finally:
+            category._parent_cache = False
+            self.registry._hierarchy_cache.pop(category._name, None)
+            self.registry._hierarchy_invalidation.pop(category._name, None)
+
+    def test_parent_store_defer(self):
+        """ nested set maintenance can be deferred, and uses gaps """
+        cr, uid = self.cr, self.uid
+        category = self.registry('res.partner.category')
+
+        def check_nested_set():
+            records = category.read(cr, uid, category.search(cr, uid, [('active', 'in', [True, False])]),
+                                    ['parent_id', 'parent_left', 'parent_right'])
+            bounds = dict((r['id'], (r['parent_left'], r['parent_right'])) for r in records)
+            for r in records:
+                left, right = bounds[r['id']]
+                self.assertLess(left, right)
+                if r['parent_id']:
+                    parent_left, parent_right = bounds[r['parent_id'][0]]
+                    self.assertTrue(parent_left < left and right < parent_right)
+
+        ctx = {'defer_parent_store_computation': True}
+        root_id = category.create(cr, uid, {'name': 'Root'}, context=ctx)
+        child_id = category.create(cr, uid, {'name': 'Child', 'parent_id': root_id}, context=ctx)
+        other_id = category.create(cr, uid, {'name': 'Other'}, context=ctx)
+        category.write(cr, uid, [other_id], {'parent_id': child_id}, context=ctx)
+        self.assertIn(category._name, cr.transaction['parent_store_todo'])
+        # child_of brings the nested set up to date
+        self.assertEqual(sorted(category.search(cr, uid, [('id', 'child_of', root_id)])),
+                         sorted([root_id, child_id, other_id]))
+        self.assertNotIn(category._name, cr.transaction.get('parent_store_todo', {}))
+        check_nested_set()
+
+        category._parent_store_gap = 10
+        try:
+            category._parent_store_compute(cr)
+            check_nested_set()
+            last_id = category.create(cr, uid, {'name': 'Last'})
+            last_bounds = category.read(cr, uid, [last_id], ['parent_left', 'parent_right'])[0]
+            # inserting in a gap does not shift the other records
+            new_id = category.create(cr, uid, {'name': 'New', 'parent_id': root_id})
+            self.assertEqual(category.read(cr, uid, [last_id], ['parent_left', 'parent_right'])[0], last_bounds)
+            self.assertIn(new_id, category.search(cr, uid, [('id', 'child_of', root_id)]))
+            check_nested_set()
+        finally:
+            category._parent_store_gap = 1
+
+    def test_parent_store_insert(self):
+        """ new records inserted between siblings do not overlap them """
+        cr, uid = self.cr, self.uid
+        category = self.registry('res.partner.category')
+
+        def bounds(ids):
+            records = category.read(cr, uid, ids, ['parent_left', 'parent_right'])
+            return dict((r['id'], (r['parent_left'], r['parent_right'])) for r in records)
+
+        for gap in (1, 100):
+            category._parent_store_gap = gap
+            try:
+                parent_id = category.create(cr, uid, {'name': 'Parent %s' % gap})
+                # siblings are ordered by name
+                ids = [category.create(cr, uid, {'name': name, 'parent_id': parent_id})
+                       for name in ('A', 'C', 'D')]
+                ids.insert(1, category.create(cr, uid, {'name': 'B', 'parent_id': parent_id}))
+                positions = bounds([parent_id] + ids)
+                parent_left, parent_right = positions[parent_id]
+                siblings = [positions[id] for id in ids]
+                for left, right in siblings:
+                    self.assertTrue(parent_left < left < right < parent_right)
+                # disjoint, in the order of the siblings
+                for (left1, right1), (left2, right2) in zip(siblings, siblings[1:]):
+                    self.assertLess(right1, left2)
+                self.assertEqual(category.search(cr, uid, [('id', 'child_of', parent_id)]),
+                                 [parent_id] + ids)
+            finally:
+                category._parent_store_gap = 1
+
+    def test_read_translations(self):
+        """ read() fetches the translations of all the fields at once """
+        cr, uid = self.cr, self.uid
+        title = self.registry('res.partner.title')
+        translation = self.registry('ir.translation')
+        title_id = title.create(cr, uid, {'name': 'Doctor', 'shortcut': 'Dr.'})
+        other_id = title.create(cr, uid, {'name': 'Professor', 'shortcut': 'Prof.'})
+        for field, value in [('name', 'Docteur'), ('shortcut', 'Dr')]:
+            translation.create(cr, uid, {'name': 'res.partner.title,' + field, 'type': 'model',
+                                         'lang': 'fr_FR', 'res_id': title_id, 'value': value})
+        records = title.read(cr, uid, [title_id, other_id], ['name', 'shortcut'], context={'lang': 'fr_FR'})
+        records = dict((r['id'], r) for r in records)
+        self.assertEqual((records[title_id]['name'], records[title_id]['shortcut']), ('Docteur', 'Dr'))
+        self.assertEqual((records[other_id]['name'], records[other_id]['shortcut']), ('Professor', 'Prof.'))
+
+    def test_has_groups_cache(self):
+        """ group membership checks are cached, and invalidated by changes of groups """
+        cr, uid = self.cr, self.uid
+        users = self.registry('res.users')
+        user_id = users.create(cr, uid, {'name': 'Groupless', 'login': 'groupless', 'groups_id': [(6, 0, [])]})
+        groups = ('base.group_system', 'base.group_erp_manager')
+        self.assertTrue(users._has_groups(cr, uid, groups))
+        self.assertFalse(users._has_groups(cr, user_id, groups))
+        self.assertFalse(users._has_groups(cr, user_id, groups))
+        group_id = self.ref('base.group_erp_manager')
+        users.write(cr, uid, [user_id], {'groups_id': [(4, group_id)]})
+        self.assertTrue(users._has_groups(cr, user_id, groups))
+
+        # and by the creation and deletion of groups
+        res_groups = self.registry('res.groups')
+        test_group_id = res_groups.create(cr, uid, {'name': 'Test group', 'users': [(4, user_id)]})
+        self.registry('ir.model.data').create(cr, uid, {'module': 'base', 'name': 'test_has_groups',
+                                                        'model': 'res.groups', 'res_id': test_group_id})
+        self.assertTrue(users._has_groups(cr, user_id, ('base.test_has_groups',)))
+        res_groups.unlink(cr, uid, [test_group_id])
+        self.assertFalse(users._has_groups(cr, user_id, ('base.test_has_groups',)))
+
+    def test_export_rows(self):
+        """ Export the records found by a streamed search, by chunks. """
+        cr, uid = self.cr, self.uid
+        partners = self.registry('res.partner')
+        domain = [('name', 'like', 'A')]
+        ids = partners.search(cr, uid, domain, order='id')
+        self.assertEqual(list(partners._iter_search(cr, uid, domain, order='id')), ids)
+        # overrides of search() filter the records, like the menus by groups
+        menus = self.registry('ir.ui.menu')
+        demo = self.ref('base.user_demo')
+        self.assertEqual(list(menus._iter_search(cr, demo, [], order='id')),
+                         menus.search(cr, demo, [], order='id'))
+
+        chunk_size = orm.EXPORT_CHUNK_SIZE
+        orm.EXPORT_CHUNK_SIZE = 2
+        try:
+            rows = list(partners._export_rows(cr, uid, iter(ids), ['name']))
+        finally:
+            orm.EXPORT_CHUNK_SIZE = chunk_size
+        self.assertEqual(rows, partners.export_data(cr, uid, ids, ['name'])['datas'])
+        self.assertEqual(len(rows), len(ids))
+
+        # overrides of export_data() alter the rows
+        def export_data(self, cr, uid, ids, fields_to_export, raw_data=False, context=None):
+            return {'datas': [['overridden'] for id in ids]}
+        type(partners).export_data = export_data
+        try:
+            rows = list(partners._export_rows(cr, uid, iter(ids), ['name']))
+        finally:
+            del type(partners).export_data
+        self.assertEqual(rows, [['overridden']] * len(ids))
+
+    def test_cache_signaling_channels(self):
+        """ clearing the caches of a model only marks that model for signaling """
+        registry = self.registry
+        registry.reset_any_cache_cleared()
+        registry('ir.model.data').clear_caches()
+        self.assertEqual(registry._caches_cleared, set(['ir.model.data']))
+        self.assertFalse(registry._any_cache_cleared)
+        registry.clear_model_caches(self.cr, ['ir.model.data'])
+        self.assertTrue(registry.any_cache_cleared())
+        registry.reset_any_cache_cleared()
+        self.assertFalse(registry.any_cache_cleared())
+
+    def test_signaling_listener(self):
+        """ the notifications of the other processes flag the registry """
+        registry = self.registry
+        listener = SignalingListener(interval=1)
+        listener._sync()
+        self.addCleanup(lambda: [listener._disconnect(db_name) for db_name in listener.connections.keys()])
+        self.assertIn(self.cr.dbname, listener.listening)
+        self.assertTrue(registry.signaling_stale)
+
+        def notify(payload):
+            registry.signaling_stale = False
+            with registry.cursor() as cr:
+                cr.execute("SELECT pg_notify(%s, %s)", (SIGNALING_CHANNEL, payload))
+            listener._wait()
+
+        notify(process_token())
+        self.assertFalse(registry.signaling_stale)
+        notify('another process')
+        self.assertTrue(registry.signaling_stale)
+
     def test_groupby_date(self):
         partners = dict(
             A='2012-11-19',
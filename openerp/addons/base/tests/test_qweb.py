@@ -79,3 +79,18 @@ class TestQWebTField(common.TransactionCase):
             self.engine.render_node(field, self.context({
                 'company': None
             }))
+
+class TestAssetsBundle(common.TransactionCase):
+    def test_bundle_cache(self):
+        engine = self.registry('ir.qweb')
+        html = '<script type="text/javascript">var a = 1;</script>'
+        bundle = engine.get_assets_bundle(self.cr, 'test.assets', html)
+        # the bundle is parsed and hashed once
+        self.assertIs(engine.get_assets_bundle(self.cr, 'test.assets', html), bundle)
+        self.assertEqual(bundle.url('js'), '/web/js/test.assets/%s' % bundle.checksum)
+        self.assertIn(bundle.url('js'), bundle.to_html())
+
+        # a different rendering of the template gives another bundle and url
+        other = engine.get_assets_bundle(self.cr, 'test.assets', html.replace('1', '2'))
+        self.assertIsNot(other, bundle)
+        self.assertNotEqual(other.url('js'), bundle.url('js'))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+
+import unittest2
+
+from openerp.service import shared_cache
+from openerp.tools.cache import SharedLRU
+from openerp.tools.lru import LRU
+
+
+class test_shared_cache(unittest2.TestCase):
+    """ The cache shared by the workers of the prefork server """
+
+    def setUp(self):
+        self.path = shared_cache.socket_path()
+        self.server = shared_cache.SharedCacheServer(self.path, 2)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.client = shared_cache.SharedCacheClient(self.path)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_get_set(self):
+        self.assertIsNone(self.client.get('a'))
+        self.client.set('a', 'x' * 100000)
+        self.assertEqual(self.client.get('a'), 'x' * 100000)
+        # the least recently used entries are dropped
+        self.client.set('b', '')
+        self.client.set('c', 'z')
+        self.assertIsNone(self.client.get('a'))
+        self.assertEqual(self.client.get('b'), '')
+        stats = self.client.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries'], stats['sets']), (2, 2, 2, 3))
+
+    def test_shared_lru(self):
+        first = SharedLRU(LRU(10), self.client, ('db', 'model', 'method', 1, 1))
+        second = SharedLRU(LRU(10), self.client, ('db', 'model', 'method', 1, 1))
+        first[(1, 'fr_FR')] = ['value']
+        self.assertEqual(second[(1, 'fr_FR')], ['value'])
+        # values which cannot be pickled are only kept locally
+        lock = threading.Lock()
+        first[2] = lock
+        self.assertIs(first[2], lock)
+        with self.assertRaises(KeyError):
+            second[2]
+        # another version of the caches does not see the values
+        other = SharedLRU(LRU(10), self.client, ('db', 'model', 'method', 1, 2))
+        with self.assertRaises(KeyError):
+            other[(1, 'fr_FR')]
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
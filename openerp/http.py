@@ -5,15 +5,19 @@
 import ast
 import collections
 import contextlib
+import cPickle
+import cStringIO
+import datetime
 import errno
 import functools
 import getpass
+import gzip
 import inspect
 import logging
 import mimetypes
 import os
-import random
 import re
+import sqlite3
 import sys
 import tempfile
 import threading
@@ -21,10 +25,12 @@ import time
 import traceback
 import urlparse
 import warnings
+import zlib
 
 import babel.core
 import psutil
 import psycopg2
+import psycopg2.errorcodes
 import simplejson
 import werkzeug.contrib.sessions
 import werkzeug.datastructures
@@ -37,8 +43,10 @@ import werkzeug.wsgi
 import openerp
 from openerp.service import security, model as service_model
 from openerp.tools.func import lazy_property
+from openerp.tools.lru import LRU
 
 _logger = logging.getLogger(__name__)
+_profiler_logger = logging.getLogger(__name__ + '.profiler')
 
 #----------------------------------------------------------
 # RequestHandler
@@ -199,10 +207,16 @@ class WebRequest(object):
         self.auth_method = None
         self._cr_cm = None
         self._cr = None
+        # whether the cursor of the request may be connected to a read replica
+        # of the database, to be set before the first use of the cursor
+        self.readonly = False
 
         # prevents transaction commit, use when you catch an exception during handling
         self._failed = None
 
+        # profiler of the SQL queries of the request, see __enter__()
+        self.profiler = None
+
         # set db/uid trackers - they're cleaned up at the WSGI
         # dispatching phase in openerp.service.wsgi_server.application
         if self.db:
@@ -237,23 +251,43 @@ class WebRequest(object):
         """
         # some magic to lazy create the cr
         if not self._cr:
-            self._cr = self.registry.cursor()
+            self._cr = self.registry.cursor(readonly=self.readonly)
         return self._cr
 
     def __enter__(self):
         _request_stack.push(self)
+        # profile the SQL queries when asked to, either with the debug mode or
+        # the X-OpenERP-Profile header, if the server allows it
+        if openerp.tools.config['sql_profiler'] and \
+                (self.debug or self.httprequest.headers.get('X-OpenERP-Profile')):
+            self.profiler = openerp.sql_db.start_profiler()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         _request_stack.pop()
 
-        if self._cr:
-            if exc_type is None and not self._failed:
-                self._cr.commit()
-            self._cr.close()
-        # just to be sure no one tries to re-use the request
-        self.disable_db = True
-        self.uid = None
+        try:
+            if self._cr:
+                if exc_type is None and not self._failed:
+                    self._cr.commit()
+                self._cr.close()
+        finally:
+            if self.profiler:
+                openerp.sql_db.stop_profiler()
+                self.profiler.log(_profiler_logger, path=self.httprequest.path,
+                                  db=self.db, uid=self.uid)
+            # just to be sure no one tries to re-use the request
+            self.disable_db = True
+            self.uid = None
+
+    def _profile_visible(self):
+        """ Whether the profile of the request (SQL queries and code
+        locations) may be returned to its user: only to the administrators. """
+        if not (self.db and self.uid):
+            return False
+        # the cursor of the request may be unusable after an error
+        with self.registry.cursor() as cr:
+            return self.registry['res.users']._has_groups(cr, self.uid, ('base.group_system',))
 
     def set_handler(self, endpoint, arguments, auth):
         # is this needed ?
@@ -265,6 +299,19 @@ class WebRequest(object):
         self.auth_method = auth
 
 
+    def _json_stream_response(self, response):
+        """ Return a response streaming the serialization of ``response``,
+        without Content-Length, compressed on the fly like the other
+        responses (see ``gzip_min_size``). """
+        body = json_safe_chunks(response)
+        headers = [('Content-Type', 'application/json')]
+        if openerp.tools.config['gzip_min_size'] and accepts_gzip(self.httprequest):
+            body = gzip_chunks(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        response = Response(body, headers=headers, direct_passthrough=True)
+        response.vary.add('Accept-Encoding')
+        return response
+
     def _handle_exception(self, exception):
         """Called within an except block to allow converting exceptions
            to abitrary responses. Anything returned (except None) will
@@ -293,7 +340,26 @@ class WebRequest(object):
             return self.endpoint(*a, **kw)
 
         if self.db:
-            return checked_call(self.db, *args, **kwargs)
+            try:
+                result = checked_call(self.db, *args, **kwargs)
+            except psycopg2.Error, e:
+                if not (self._cr and self._cr.readonly) or \
+                        e.pgcode != psycopg2.errorcodes.READ_ONLY_SQL_TRANSACTION:
+                    raise
+            else:
+                if self._cr and self._cr.modified:
+                    # the user reads its own writes on the primary database
+                    service_model.primary_used(self.db, self.uid)
+                return result
+            # the request modifies data, run it again on the primary database
+            _logger.info("%s cannot run on a read replica, retrying on the primary database", self.httprequest.path)
+            self._cr.close()
+            self._cr = None
+            self.readonly = False
+            result = checked_call(self.db, *args, **kwargs)
+            if self._cr and self._cr.modified:
+                service_model.primary_used(self.db, self.uid)
+            return result
         return self.endpoint(*args, **kwargs)
 
     @property
@@ -330,6 +396,10 @@ def route(route=None, **kw):
     :param methods: A sequence of http methods this route applies to. If not
                     specified, all methods are allowed.
     :param cors: The Access-Control-Allow-Origin cors directive value.
+    :param model_method: for json routes, the method the route calls on the
+                         model given by the parameter ``model``; if it is
+                         one of its ``_readonly_methods``, the request may
+                         be served by a read replica of the database.
     """
     routing = kw.copy()
     assert not 'type' in routing or routing['type'] in ("http", "json")
@@ -359,6 +429,79 @@ def route(route=None, **kw):
         return response_wrap
     return decorator
 
+# The JSON responses including a list longer than this (as their result, or
+# one level below like the records of search_read) are streamed, in chunks of
+# about this size.
+JSON_STREAM_ITEMS = 1000
+JSON_CHUNK_SIZE = 64 * 1024
+
+def json_streamable(value, depth=0):
+    """ Whether the serialization of ``value`` should be streamed, i.e. it
+    includes a long list that :func:`json_iterencode` serializes item by
+    item. """
+    if isinstance(value, (list, tuple)):
+        if len(value) > JSON_STREAM_ITEMS:
+            return True
+        return depth < 2 and any(json_streamable(item, depth + 1) for item in value)
+    if isinstance(value, dict) and depth < 2:
+        return any(json_streamable(item, depth + 1) for item in value.itervalues())
+    return False
+
+def json_iterencode(value, depth=0):
+    """ Iterate over the JSON serialization of ``value`` in small pieces. The
+    outer containers and the long lists are serialized item by item, and the
+    items themselves at once, by the (C-accelerated) ``simplejson.dumps``. """
+    if isinstance(value, (list, tuple)) and (depth < 2 or len(value) > JSON_STREAM_ITEMS):
+        yield '['
+        for index, item in enumerate(value):
+            if index:
+                yield ', '
+            for piece in json_iterencode(item, depth + 1):
+                yield piece
+        yield ']'
+    elif isinstance(value, dict) and depth < 2 and all(isinstance(key, basestring) for key in value):
+        yield '{'
+        for index, (key, item) in enumerate(value.iteritems()):
+            if index:
+                yield ', '
+            yield simplejson.dumps(key)
+            yield ': '
+            for piece in json_iterencode(item, depth + 1):
+                yield piece
+        yield '}'
+    else:
+        yield simplejson.dumps(value)
+
+def json_chunks(value, size=JSON_CHUNK_SIZE):
+    """ Iterate over the JSON serialization of ``value`` in chunks of at least
+    ``size`` bytes (but the last one). """
+    chunk, length = [], 0
+    for piece in json_iterencode(value):
+        chunk.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+def json_safe_chunks(value, size=JSON_CHUNK_SIZE):
+    """ Return an iterator over :func:`json_chunks` of ``value``, whose first
+    chunk is serialized right away: its errors (e.g. a value that cannot be
+    serialized, usually present in every record) are raised to the caller,
+    before any part of the response is sent. An error in the next chunks is
+    logged, and ends the stream early. """
+    chunks = json_chunks(value, size)
+    first = next(chunks)
+    def stream():
+        yield first
+        try:
+            for chunk in chunks:
+                yield chunk
+        except Exception:
+            _logger.exception("Failure while streaming a JSON response, the response is truncated")
+    return stream()
+
 class JsonRequest(WebRequest):
     """ JSON-RPC2 over HTTP.
 
@@ -428,6 +571,22 @@ class JsonRequest(WebRequest):
         self.params = dict(self.jsonrequest.get("params", {}))
         self.context = self.params.pop('context', dict(self.session.context))
 
+    def _readonly_call(self):
+        """ Whether the call only runs a read-only method of a model (see
+        ``_readonly_methods``), so that the cursor of the request may be
+        connected to a read replica of the database. The model is given by
+        the parameter ``model``, and the method by the option ``model_method``
+        of the route, or by the parameter ``method`` (like /web/dataset/call_kw).
+        """
+        model_name = self.params.get('model')
+        method = self.endpoint.routing.get('model_method') or self.params.get('method')
+        if not (self.db and self.uid and isinstance(model_name, basestring)
+                and isinstance(method, basestring)):
+            return False
+        model = self.registry.get(model_name)
+        return method in getattr(model, '_readonly_methods', ()) and \
+            service_model.use_replica(self.db, self.uid)
+
     def _json_response(self, result=None, error=None):
         response = {
             'jsonrpc': '2.0',
@@ -437,6 +596,10 @@ class JsonRequest(WebRequest):
             response['error'] = error
         if result is not None:
             response['result'] = result
+        if self.profiler:
+            profile = self.profiler.summary()
+            if self._profile_visible():
+                response['profile'] = profile
 
         if self.jsonp:
             # If we use jsonp, that's mean we are called from another host
@@ -445,13 +608,21 @@ class JsonRequest(WebRequest):
             response['session_id'] = self.session_id
             mime = 'application/javascript'
             body = "%s(%s);" % (self.jsonp, simplejson.dumps(response),)
+        elif json_streamable(response):
+            # large results are written as they are serialized, instead of
+            # being serialized at once in memory
+            return self._json_stream_response(response)
         else:
             mime = 'application/json'
             body = simplejson.dumps(response)
 
-        return Response(
+        response = Response(
                     body, headers=[('Content-Type', mime),
                                    ('Content-Length', len(body))])
+        gzip_min_size = openerp.tools.config['gzip_min_size']
+        if gzip_min_size and len(body) >= gzip_min_size:
+            gzip_response(response)
+        return response
 
     def _handle_exception(self, exception):
         """Called within an except block to allow converting exceptions
@@ -475,6 +646,8 @@ class JsonRequest(WebRequest):
         if self.jsonp_handler:
             return self.jsonp_handler()
         try:
+            if self._readonly_call():
+                self.readonly = True
             result = self._call_function(**self.params)
             return self._json_response(result)
         except Exception, e:
@@ -998,18 +1171,163 @@ class OpenERPSession(werkzeug.contrib.sessions.Session):
         saved_actions = self.get('saved_actions', {})
         return saved_actions.get("actions", {}).get(key)
 
-def session_gc(session_store):
-    if random.random() < 0.001:
-        # we keep session one week
-        last_week = time.time() - 60*60*24*7
-        for fname in os.listdir(session_store.path):
-            path = os.path.join(session_store.path, fname)
+#----------------------------------------------------------
+# Session stores
+#----------------------------------------------------------
+# sessions are kept one week after their last use
+SESSION_MAX_AGE = 60 * 60 * 24 * 7
+# the last use of an unmodified session is recorded at most once an hour
+SESSION_TOUCH_INTERVAL = 60 * 60
+
+class FilesystemSessionStore(werkzeug.contrib.sessions.FilesystemSessionStore):
+    """ Sessions stored in a pickle file each, in directory ``path``. """
+    def gc(self, max_age=SESSION_MAX_AGE):
+        """ Delete the sessions unused for ``max_age`` seconds. """
+        deadline = time.time() - max_age
+        for fname in os.listdir(self.path):
+            path = os.path.join(self.path, fname)
             try:
-                if os.path.getmtime(path) < last_week:
+                if os.path.getmtime(path) < deadline:
                     os.unlink(path)
             except OSError:
                 pass
 
+class PostgresSessionStore(werkzeug.contrib.sessions.SessionStore):
+    """ Sessions stored in table ``http_session`` of the PostgreSQL database
+    ``db_name``, shared by the server processes of all the hosts using it.
+    The table is created on first use.
+    """
+    def __init__(self, db_name, session_class=None):
+        super(PostgresSessionStore, self).__init__(session_class)
+        self.db_name = db_name
+        self.table_ok = False
+
+    def cursor(self):
+        # sessions are read and written concurrently by the requests of the
+        # session: no serialization failures
+        cr = openerp.sql_db.db_connect(self.db_name).cursor(serialized=False)
+        if not self.table_ok:
+            cr.execute("SELECT 1 FROM pg_class WHERE relname = 'http_session'")
+            if not cr.fetchone():
+                cr.execute("""CREATE TABLE http_session (
+                                  sid varchar PRIMARY KEY,
+                                  data bytea NOT NULL,
+                                  write_date timestamp NOT NULL)""")
+                cr.execute("CREATE INDEX http_session_write_date_index ON http_session (write_date)")
+                cr.commit()
+            self.table_ok = True
+        return cr
+
+    def save(self, session):
+        data = psycopg2.Binary(cPickle.dumps(dict(session), cPickle.HIGHEST_PROTOCOL))
+        with self.cursor() as cr:
+            update = """UPDATE http_session SET data = %s, write_date = now() at time zone 'UTC'
+                          WHERE sid = %s"""
+            cr.execute(update, (data, session.sid))
+            if not cr.rowcount:
+                try:
+                    with cr.savepoint():
+                        cr.execute("""INSERT INTO http_session (sid, data, write_date)
+                                      VALUES (%s, %s, now() at time zone 'UTC')""", (session.sid, data))
+                except psycopg2.IntegrityError:
+                    # inserted meanwhile by another request of the session
+                    cr.execute(update, (data, session.sid))
+
+    def delete(self, session):
+        with self.cursor() as cr:
+            cr.execute("DELETE FROM http_session WHERE sid = %s", (session.sid,))
+
+    def get(self, sid):
+        if not self.is_valid_key(sid):
+            return self.new()
+        with self.cursor() as cr:
+            cr.execute("""SELECT data, write_date < now() at time zone 'UTC' - interval '%s seconds'
+                          FROM http_session WHERE sid = %s""", (SESSION_TOUCH_INTERVAL, sid))
+            row = cr.fetchone()
+            if row is None:
+                return self.session_class({}, sid, True)
+            data, stale = row
+            if stale:
+                # touching the session only delays its garbage collection,
+                # never fail the request for it (e.g. on a lock timeout)
+                try:
+                    with cr.savepoint():
+                        cr.execute("UPDATE http_session SET write_date = now() at time zone 'UTC' WHERE sid = %s", (sid,))
+                except psycopg2.Error, e:
+                    _logger.warning("Could not touch session %s: %s", sid, e)
+        return self.session_class(cPickle.loads(str(data)), sid, False)
+
+    def gc(self, max_age=SESSION_MAX_AGE):
+        """ Delete the sessions unused for ``max_age`` seconds. """
+        with self.cursor() as cr:
+            cr.execute("DELETE FROM http_session WHERE write_date < now() at time zone 'UTC' - interval '%s seconds'",
+                       (max_age,))
+
+class SqliteSessionStore(werkzeug.contrib.sessions.SessionStore):
+    """ Sessions stored in the local SQLite database file ``path``, shared by
+    the server processes of the host.
+    """
+    def __init__(self, path, session_class=None):
+        super(SqliteSessionStore, self).__init__(session_class)
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        # the connection is neither shared between threads nor inherited by
+        # forked processes
+        cnx = getattr(self.local, 'cnx', None)
+        if cnx is not None and self.local.pid == os.getpid():
+            return cnx
+        cnx = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        cnx.execute("PRAGMA journal_mode=WAL")
+        cnx.execute("""CREATE TABLE IF NOT EXISTS http_session (
+                           sid TEXT PRIMARY KEY,
+                           data BLOB NOT NULL,
+                           write_date REAL NOT NULL)""")
+        cnx.execute("CREATE INDEX IF NOT EXISTS http_session_write_date_index ON http_session (write_date)")
+        self.local.cnx = cnx
+        self.local.pid = os.getpid()
+        return cnx
+
+    def save(self, session):
+        data = sqlite3.Binary(cPickle.dumps(dict(session), cPickle.HIGHEST_PROTOCOL))
+        self.connection().execute("INSERT OR REPLACE INTO http_session (sid, data, write_date) VALUES (?, ?, ?)",
+                                  (session.sid, data, time.time()))
+
+    def delete(self, session):
+        self.connection().execute("DELETE FROM http_session WHERE sid = ?", (session.sid,))
+
+    def get(self, sid):
+        if not self.is_valid_key(sid):
+            return self.new()
+        cnx = self.connection()
+        row = cnx.execute("SELECT data, write_date FROM http_session WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            return self.session_class({}, sid, True)
+        data, write_date = row
+        now = time.time()
+        if write_date < now - SESSION_TOUCH_INTERVAL:
+            cnx.execute("UPDATE http_session SET write_date = ? WHERE sid = ?", (now, sid))
+        return self.session_class(cPickle.loads(str(data)), sid, False)
+
+    def gc(self, max_age=SESSION_MAX_AGE):
+        """ Delete the sessions unused for ``max_age`` seconds. """
+        self.connection().execute("DELETE FROM http_session WHERE write_date < ?", (time.time() - max_age,))
+
+def session_store():
+    """ Return the session store selected by the ``session_store`` option. """
+    config = openerp.tools.config
+    if config['session_store'] == 'postgresql':
+        _logger.debug('HTTP sessions stored in database: %s', config['session_db'])
+        return PostgresSessionStore(config['session_db'], session_class=OpenERPSession)
+    if config['session_store'] == 'sqlite':
+        path = os.path.join(config.session_dir, 'sessions.sqlite')
+        _logger.debug('HTTP sessions stored in: %s', path)
+        return SqliteSessionStore(path, session_class=OpenERPSession)
+    path = config.session_dir
+    _logger.debug('HTTP sessions stored in: %s', path)
+    return FilesystemSessionStore(path, session_class=OpenERPSession)
+
 #----------------------------------------------------------
 # WSGI Layer
 #----------------------------------------------------------
@@ -1064,6 +1382,110 @@ class Response(werkzeug.wrappers.Response):
         self.response.append(self.render())
         self.template = None
 
+def accepts_gzip(httprequest):
+    """ Whether the client of ``httprequest`` accepts gzipped responses """
+    return httprequest.accept_encodings['gzip'] > 0
+
+def gzip_compress(data):
+    """ Return ``data`` compressed in the gzip format; the result only
+    depends on ``data``, so that it may be cached. """
+    buf = cStringIO.StringIO()
+    with contextlib.closing(gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)) as f:
+        f.write(data)
+    return buf.getvalue()
+
+def gzip_chunks(chunks):
+    """ Iterate over the gzip compression of the strings ``chunks``. """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def gzip_response(response, compress=None):
+    """ Compress the body of ``response`` if the client of the current request
+    accepts it.
+
+    :param response: Werkzeug response, with its body in memory
+    :param compress: function returning the compressed body, e.g. from a
+        cache; by default the body is compressed on the fly
+    :return: the response object provided
+    """
+    response.vary.add('Accept-Encoding')
+    if not accepts_gzip(request.httprequest):
+        return response
+    data = compress() if compress else gzip_compress(response.data)
+    response.data = data
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = len(data)
+    return response
+
+class StaticGzipMiddleware(object):
+    """ Serve the compressible static files of the addons gzipped to the
+    clients accepting it, and pass the other requests to ``app``.
+
+    The compressed variant of a file is taken from a ``<file>.gz`` file next
+    to it if there is an up-to-date one, or compressed once; in both cases it
+    is kept in memory, by file modification time.
+
+    :param statics: the directories of the static files, by url prefix
+    """
+    compressible = ('text/', 'application/javascript', 'application/x-javascript',
+                    'application/json', 'application/xml', 'image/svg+xml')
+    cache_timeout = 60 * 60 * 12
+
+    def __init__(self, app, statics, max_size=64 * 1024 * 1024):
+        self.app = app
+        self.statics = statics
+        self.cache = LRU(4096, max_size=max_size)
+
+    def __call__(self, environ, start_response):
+        httprequest = werkzeug.wrappers.Request(environ)
+        if httprequest.method in ('GET', 'HEAD') and accepts_gzip(httprequest):
+            filename = self.get_filename(httprequest.path)
+            mimetype = filename and mimetypes.guess_type(filename)[0]
+            if mimetype and mimetype.startswith(self.compressible):
+                response = self.get_response(httprequest, filename, mimetype)
+                return response(environ, start_response)
+        return self.app(environ, start_response)
+
+    def get_filename(self, path):
+        """ Return the static file served at ``path``, or None """
+        parts = [part for part in path.split('/') if part and part != '..']
+        if any(os.sep in part or (os.altsep and os.altsep in part) for part in parts):
+            return None
+        path = '/' + '/'.join(parts)
+        for prefix, directory in self.statics.iteritems():
+            if path.startswith(prefix + '/'):
+                filename = os.path.join(directory, *path[len(prefix) + 1:].split('/'))
+                if os.path.isfile(filename):
+                    return filename
+        return None
+
+    def get_response(self, httprequest, filename, mimetype):
+        stat = os.stat(filename)
+        key = (filename, stat.st_mtime, stat.st_size)
+        data = self.cache.get(key)
+        if data is None:
+            data = self.cache[key] = self.compress(filename, stat)
+        response = werkzeug.wrappers.Response(data, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = self.cache_timeout
+        response.last_modified = datetime.datetime.utcfromtimestamp(stat.st_mtime)
+        response.set_etag('gz-%s-%s-%s' % (stat.st_mtime, stat.st_size, zlib.adler32(filename) & 0xffffffff))
+        return response.make_conditional(httprequest)
+
+    def compress(self, filename, stat):
+        gzipped = filename + '.gz'
+        if os.path.isfile(gzipped) and os.path.getmtime(gzipped) >= stat.st_mtime:
+            with open(gzipped, 'rb') as f:
+                return f.read()
+        with open(filename, 'rb') as f:
+            return gzip_compress(f.read())
+
 class DisableCacheMiddleware(object):
     def __init__(self, app):
         self.app = app
@@ -1090,12 +1512,14 @@ class Root(object):
     """Root WSGI application for the OpenERP Web Client.
     """
     def __init__(self):
-        # Setup http sessions
-        path = openerp.tools.config.session_dir
-        _logger.debug('HTTP sessions stored in: %s', path)
-        self.session_store = werkzeug.contrib.sessions.FilesystemSessionStore(path, session_class=OpenERPSession)
         self._loaded = False
 
+    @lazy_property
+    def session_store(self):
+        # the store depends on the configuration, which is not loaded yet
+        # when this module is imported
+        return session_store()
+
     @lazy_property
     def nodb_routing_map(self):
         _logger.info("Generating nondb routing")
@@ -1135,12 +1559,12 @@ class Root(object):
         if statics:
             _logger.info("HTTP Configuring static files")
         app = werkzeug.wsgi.SharedDataMiddleware(self.dispatch, statics)
+        app = StaticGzipMiddleware(app, statics)
         self.dispatch = DisableCacheMiddleware(app)
 
     def setup_session(self, httprequest):
         # recover or create session
-        session_gc(self.session_store)
-
+        # (the unused sessions are deleted by a cron job, see ir.http)
         sid = httprequest.args.get('session_id')
         explicit_session = True
         if not sid:
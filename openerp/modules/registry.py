@@ -22,10 +22,18 @@
 """ Models registries.
 
 """
-from collections import Mapping
+from collections import Counter, Mapping
 from contextlib import contextmanager
+import errno
 import logging
+import os
+import select
 import threading
+import time
+import uuid
+
+import psycopg2
+import psycopg2.extensions
 
 import openerp.sql_db
 import openerp.osv.orm
@@ -33,9 +41,44 @@ import openerp.tools
 import openerp.modules.db
 import openerp.tools.config
 from openerp.tools import assertion_report
+from openerp.tools.lru import LRU
 
 _logger = logging.getLogger(__name__)
 
+# The values of the registry and cache signaling. The cache signaling is the
+# last sequence of the signaling channels, not the last value of the sequence:
+# a value returned by nextval() is visible before the transaction that signals
+# the channels is committed.
+SIGNALING_QUERY = """
+    SELECT base_registry_signaling.last_value,
+           (SELECT max(sequence) FROM base_cache_signaling_channels)
+    FROM base_registry_signaling"""
+
+# PostgreSQL channel notified when a process signals a change of the registry
+# or the caches of a database; the payload is the process_token() of the
+# process.
+SIGNALING_CHANNEL = 'openerp_signaling'
+
+# Delay in seconds after which the signaling is checked even if no other
+# process notified a change, in case a notification was missed (e.g. the
+# LISTEN connection was silently dropped).
+SIGNALING_MAX_DELAY = 60
+
+# Options of the LISTEN connections, so that a dead connection to the database
+# server is detected within a couple of minutes.
+SIGNALING_KEEPALIVES = 'keepalives=1 keepalives_idle=60 keepalives_interval=10 keepalives_count=6'
+
+_process_token = (None, None)   # (pid, token)
+
+def process_token():
+    """ Return a token identifying the current process among the processes
+    of all hosts (the pids of distinct hosts or containers may collide). """
+    global _process_token
+    pid = os.getpid()
+    if _process_token[0] != pid:
+        _process_token = (pid, uuid.uuid4().hex)
+    return _process_token[1]
+
 class Registry(Mapping):
     """ Model registry for a particular database.
 
@@ -49,6 +92,10 @@ class Registry(Mapping):
         self.models = {}    # model name/model instance mapping
         self._sql_error = {}
         self._store_function = {}
+        self._store_delays = None   # derived from _store_function, see store_delays()
+        self._domain_cache = LRU(8192)    # see osv.expression.domain_shape()
+        self._hierarchy_cache = {}        # see BaseModel._hierarchy_index()
+        self._hierarchy_invalidation = {} # model name: (count, txid), see hierarchy_invalidate()
         self._init = True
         self._init_parent = {}
         self._assertion_report = assertion_report.assertion_report()
@@ -66,18 +113,37 @@ class Registry(Mapping):
         # Indicates that the registry is 
         self.ready = False
 
+        # Time spent in RegistryManager.new() to load the registry, in seconds
+        self.load_time = 0.0
+
         # Inter-process signaling (used only when openerp.multi_process is True):
         # The `base_registry_signaling` sequence indicates the whole registry
         # must be reloaded.
-        # The `base_cache_signaling sequence` indicates all caches must be
-        # invalidated (i.e. cleared).
+        # The `base_cache_signaling_channels` table indicates which caches
+        # must be invalidated (i.e. cleared), and the last value of its
+        # `sequence` column is kept in `base_cache_signaling_sequence`.
         self.base_registry_signaling_sequence = None
         self.base_cache_signaling_sequence = None
+        # Whether the signaling may have changed since it was last checked;
+        # reset by the checks, and set by the SignalingListener.
+        self.signaling_stale = True
+        self.signaling_checked = 0      # time of the last check
 
-        # Flag indicating if at least one model cache has been cleared.
+        # Names of the models whose caches have been cleared, and flag
+        # indicating that all caches have been cleared.
         # Useful only in a multi-process context.
+        self._caches_cleared = set()
         self._any_cache_cleared = False
 
+        # Number of invalidations of the caches of each model signaled to and
+        # received from the other processes ('*' stands for all caches).
+        self.cache_signaled = Counter()
+        self.cache_received = Counter()
+
+        # Sequence of the last invalidation of the caches of each model ('*'
+        # for all caches), which versions the caches shared between processes.
+        self.cache_versions = {}
+
         cr = self.cursor()
         has_unaccent = openerp.modules.db.has_unaccent(cr)
         if openerp.tools.config['unaccent'] and not has_unaccent:
@@ -114,6 +180,21 @@ class Registry(Mapping):
             self.get(o)._parent_store_compute(cr)
         self._init = False
 
+    def store_delays(self, model_name):
+        """ Return the list of ``(field_name, hours)`` of the store triggers
+        of the given model that have a time length, i.e. for which stored
+        fields must not be recomputed until ``hours`` after the last write.
+
+        The table is computed once for all models from ``_store_function``,
+        and is reset when the store triggers are modified.
+        """
+        if self._store_delays is None:
+            self._store_delays = dict(
+                (model, [(t[1], t[5]) for t in triggers if t[5]])
+                for model, triggers in self._store_function.iteritems()
+            )
+        return self._store_delays.get(model_name, [])
+
     def obj_list(self):
         """ Return the list of model names in this registry."""
         return self.keys()
@@ -149,19 +230,75 @@ class Registry(Mapping):
         """
         for model in self.models.itervalues():
             model.clear_caches()
+        self._hierarchy_cache.clear()
         # Special case for ir_ui_menu which does not use openerp.tools.ormcache.
         ir_ui_menu = self.models.get('ir.ui.menu')
         if ir_ui_menu:
             ir_ui_menu.clear_cache()
+        self._any_cache_cleared = True
 
+    def hierarchy_invalidate(self, model_name, txid):
+        """ Drop the shared hierarchy index of ``model_name`` after its
+        change by the committed transaction ``txid``. The indexes being built
+        meanwhile, or from a snapshot that does not see that transaction, are
+        no longer shared (see BaseModel._hierarchy_index()).
+        """
+        count = self._hierarchy_invalidation.get(model_name, (0, None))[0]
+        self._hierarchy_invalidation[model_name] = (count + 1, txid)
+        self._hierarchy_cache.pop(model_name, None)
+
+    def clear_model_caches(self, cr, model_names):
+        """ Clear the caches of the given models only, as signaled by another
+        process. The caches of the models are the ones cleared by their
+        method ``clear_caches``, and their hierarchy index.
+        """
+        for model_name in model_names:
+            model = self.models.get(model_name)
+            if model is None:
+                continue
+            model.clear_caches()
+            if model._parent_cache:
+                # the change was committed before the signaling was read,
+                # hence before the transaction of cr started
+                cr.execute("SELECT txid_current()")
+                self.hierarchy_invalidate(model_name, cr.fetchone()[0])
+            else:
+                self._hierarchy_cache.pop(model_name, None)
+            if model_name == 'ir.ui.menu':
+                model.clear_cache()
+        # the digits of the float columns depend on decimal.precision
+        if 'decimal.precision' in model_names:
+            for model in self.models.itervalues():
+                for column in model._columns.itervalues():
+                    if hasattr(column, 'digits_change'):
+                        column.digits_change(cr)
+
+    # Useful only in a multi-process context.
+    def cache_cleared(self, model_name):
+        """ Record that the caches of ``model_name`` have been cleared, in
+        order to signal it to the other processes. """
+        self._caches_cleared.add(model_name)
+
+    # Useful only in a multi-process context.
+    def cache_version(self, model_name):
+        """ Return the version of the caches of ``model_name`` shared between
+        processes, or None if they must not be shared: their invalidation has
+        not been signaled yet, or there is no signaling at all. """
+        if self.base_registry_signaling_sequence is None or \
+                self._any_cache_cleared or model_name in self._caches_cleared:
+            return None
+        versions = self.cache_versions
+        return (self.base_registry_signaling_sequence,
+                max(versions.get('*', 0), versions.get(model_name, 0)))
 
     # Useful only in a multi-process context.
     def reset_any_cache_cleared(self):
+        self._caches_cleared.clear()
         self._any_cache_cleared = False
 
     # Useful only in a multi-process context.
     def any_cache_cleared(self):
-        return self._any_cache_cleared
+        return self._any_cache_cleared or bool(self._caches_cleared)
 
     @classmethod
     def setup_multi_process_signaling(cls, cr):
@@ -171,19 +308,26 @@ class Registry(Mapping):
         # Inter-process signaling:
         # The `base_registry_signaling` sequence indicates the whole registry
         # must be reloaded.
-        # The `base_cache_signaling sequence` indicates all caches must be
-        # invalidated (i.e. cleared).
+        # The `base_cache_signaling_channels` table indicates the caches that
+        # must be invalidated (i.e. cleared): it has a row per model (or '*'
+        # for all caches) with the value of the `base_cache_signaling`
+        # sequence at its last invalidation, and the number of invalidations.
         cr.execute("""SELECT sequence_name FROM information_schema.sequences WHERE sequence_name='base_registry_signaling'""")
         if not cr.fetchall():
             cr.execute("""CREATE SEQUENCE base_registry_signaling INCREMENT BY 1 START WITH 1""")
             cr.execute("""SELECT nextval('base_registry_signaling')""")
             cr.execute("""CREATE SEQUENCE base_cache_signaling INCREMENT BY 1 START WITH 1""")
             cr.execute("""SELECT nextval('base_cache_signaling')""")
-        
-        cr.execute("""
-                    SELECT base_registry_signaling.last_value,
-                           base_cache_signaling.last_value
-                    FROM base_registry_signaling, base_cache_signaling""")
+        cr.execute("""SELECT relname FROM pg_class WHERE relname='base_cache_signaling_channels'""")
+        if not cr.fetchall():
+            cr.execute("""CREATE TABLE base_cache_signaling_channels (
+                            name varchar PRIMARY KEY,
+                            sequence integer NOT NULL,
+                            flushes integer NOT NULL DEFAULT 0)""")
+            cr.execute("""INSERT INTO base_cache_signaling_channels (name, sequence)
+                          SELECT '*', last_value FROM base_cache_signaling""")
+
+        cr.execute(SIGNALING_QUERY)
         r, c = cr.fetchone()
         _logger.debug("Multiprocess load registry signaling: [Registry: # %s] "\
                     "[Cache: # %s]",
@@ -203,9 +347,12 @@ class Registry(Mapping):
         self.test_cr = None
         RegistryManager.leave_test_mode()
 
-    def cursor(self):
+    def cursor(self, readonly=False):
         """ Return a new cursor for the database. The cursor itself may be used
             as a context manager to commit/rollback and close automatically.
+
+            :param readonly: whether the cursor may be connected to a read
+                replica of the database (see ``Cursor.readonly``)
         """
         cr = self.test_cr
         if cr is not None:
@@ -215,7 +362,7 @@ class Registry(Mapping):
             # cursor itself in its method close().
             cr.acquire()
             return cr
-        return self._db.cursor()
+        return self._db.cursor(readonly=readonly)
 
 class DummyRLock(object):
     """ Dummy reentrant lock, to be used while running rpc and js tests """
@@ -228,6 +375,99 @@ class DummyRLock(object):
     def __exit__(self, type, value, traceback):
         self.release()
 
+class SignalingListener(object):
+    """ Flag the registries of the current process whose signaling changed.
+
+    A thread listens (LISTEN/NOTIFY) to the signaling of the other processes,
+    on a dedicated connection per database, and sets the flag
+    ``signaling_stale`` of the registry of the signaled database. The requests
+    then only query the signaling in the database when the flag is set. The
+    databases that are not listened to (yet, or any longer after the loss of
+    their connection) are checked at every request, as before, and the others
+    at least every ``SIGNALING_MAX_DELAY`` seconds.
+
+    :param interval: delay in seconds between two updates of the list of
+        databases to listen to
+    """
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.pid = os.getpid()
+        self.token = process_token()
+        self.connections = {}           # database name: LISTEN connection
+        self.listening = frozenset()    # read by the request threads
+
+    def start(self):
+        t = threading.Thread(target=self.run, name="openerp.modules.registry.signaling_listener")
+        t.setDaemon(True)
+        t.start()
+
+    def run(self):
+        while True:
+            try:
+                self._sync()
+                self._wait()
+            except Exception:
+                _logger.exception("Failure while listening to the registry signaling")
+                time.sleep(self.interval)
+
+    def _flag(self, db_name):
+        registry = RegistryManager.registries.get(db_name)
+        if registry is not None:
+            registry.signaling_stale = True
+
+    def _sync(self):
+        """ Listen to the databases that have a registry (only). """
+        db_names = set(RegistryManager.registries.keys())
+        for db_name in set(self.connections) - db_names:
+            self._disconnect(db_name)
+        for db_name in db_names - set(self.connections):
+            try:
+                cnx = psycopg2.connect('%s %s' % (openerp.sql_db.dsn(db_name), SIGNALING_KEEPALIVES))
+                cnx.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cnx.cursor().execute('LISTEN "%s"' % SIGNALING_CHANNEL)
+            except psycopg2.Error:
+                _logger.warning("Cannot listen to the registry signaling of database %s.", db_name, exc_info=True)
+                continue
+            self.connections[db_name] = cnx
+            # the signaling may have changed before listening
+            self._flag(db_name)
+            self.listening = frozenset(self.connections)
+
+    def _disconnect(self, db_name):
+        cnx = self.connections.pop(db_name)
+        self.listening = frozenset(self.connections)
+        try:
+            cnx.close()
+        except psycopg2.Error:
+            pass
+
+    def _wait(self):
+        """ Wait ``interval`` seconds at most, and flag the registries of the
+        databases signaled by the other processes. """
+        fds = dict((cnx.fileno(), db_name) for db_name, cnx in self.connections.iteritems())
+        if not fds:
+            time.sleep(self.interval)
+            return
+        try:
+            ready = select.select(fds.keys(), [], [], self.interval)[0]
+        except select.error, e:
+            if e[0] != errno.EINTR:
+                raise
+            return
+        for fd in ready:
+            db_name = fds[fd]
+            cnx = self.connections[db_name]
+            try:
+                cnx.poll()
+            except psycopg2.Error:
+                _logger.warning("Lost the connection listening to the registry signaling of database %s.",
+                                db_name, exc_info=True)
+                self._disconnect(db_name)
+                continue
+            if any(getattr(notify, 'payload', None) != self.token for notify in cnx.notifies):
+                self._flag(db_name)
+            del cnx.notifies[:]
+
 class RegistryManager(object):
     """ Model registries manager.
 
@@ -240,6 +480,8 @@ class RegistryManager(object):
     registries = {}
     _lock = threading.RLock()
     _saved_lock = None
+    _listener = None
+    _listener_lock = threading.Lock()
 
     @classmethod
     def lock(cls):
@@ -281,6 +523,7 @@ class RegistryManager(object):
 
         """
         import openerp.modules
+        t0 = time.time()
         with cls.lock():
             registry = Registry(db_name)
 
@@ -295,6 +538,9 @@ class RegistryManager(object):
                     seq_registry, seq_cache = Registry.setup_multi_process_signaling(cr)
                     registry.base_registry_signaling_sequence = seq_registry
                     registry.base_cache_signaling_sequence = seq_cache
+                    if openerp.multi_process:
+                        cr.execute("""SELECT name, sequence FROM base_cache_signaling_channels""")
+                        registry.cache_versions = dict(cr.fetchall())
                 # This should be a method on Registry
                 openerp.modules.load_modules(registry._db, force_demo, status, update_module)
             except Exception:
@@ -314,6 +560,7 @@ class RegistryManager(object):
                 cr.close()
 
         registry.ready = True
+        registry.load_time = time.time() - t0
 
         if update_module:
             # only in case of update, otherwise we'll have an infinite reload loop!
@@ -350,6 +597,16 @@ class RegistryManager(object):
             if db_name in cls.registries:
                 cls.registries[db_name].clear_caches()
 
+    @classmethod
+    def signaling_listener(cls):
+        """ Return the signaling listener of the current process, started on
+        first use (and in each forked process). """
+        with cls._listener_lock:
+            if cls._listener is None or cls._listener.pid != os.getpid():
+                cls._listener = SignalingListener()
+                cls._listener.start()
+            return cls._listener
+
     @classmethod
     def check_registry_signaling(cls, db_name):
         """
@@ -362,12 +619,15 @@ class RegistryManager(object):
         changed = False
         if openerp.multi_process and db_name in cls.registries:
             registry = cls.get(db_name)
+            # skip the query when no other process signaled a change
+            if not registry.signaling_stale and db_name in cls.signaling_listener().listening and \
+                    time.time() < registry.signaling_checked + SIGNALING_MAX_DELAY:
+                return changed
+            registry.signaling_stale = False
+            registry.signaling_checked = time.time()
             cr = registry.cursor()
             try:
-                cr.execute("""
-                    SELECT base_registry_signaling.last_value,
-                           base_cache_signaling.last_value
-                    FROM base_registry_signaling, base_cache_signaling""")
+                cr.execute(SIGNALING_QUERY)
                 r, c = cr.fetchone()
                 _logger.debug("Multiprocess signaling check: [Registry - old# %s new# %s] "\
                     "[Cache - old# %s new# %s]",
@@ -384,16 +644,24 @@ class RegistryManager(object):
                 # has been reload.
                 elif registry.base_cache_signaling_sequence is not None and registry.base_cache_signaling_sequence != c:
                     changed = True
-                    _logger.info("Invalidating all model caches after database signaling.")
-                    registry.clear_caches()
-                    registry.reset_any_cache_cleared()
-                    # One possible reason caches have been invalidated is the
-                    # use of decimal_precision.write(), in which case we need
-                    # to refresh fields.float columns.
-                    for model in registry.models.values():
-                        for column in model._columns.values():
-                            if hasattr(column, 'digits_change'):
-                                column.digits_change(cr)
+                    cr.execute("""SELECT name, sequence FROM base_cache_signaling_channels WHERE sequence > %s""",
+                               (registry.base_cache_signaling_sequence,))
+                    versions = dict(cr.fetchall())
+                    names = set(versions)
+                    registry.cache_versions.update(versions)
+                    registry.cache_received.update(names)
+                    if '*' in names:
+                        _logger.info("Invalidating all model caches after database signaling.")
+                        registry.clear_caches()
+                        # also guards the hierarchy indexes being rebuilt
+                        registry.clear_model_caches(cr, ['decimal.precision'] +
+                            [name for name, model in registry.models.iteritems() if model._parent_cache])
+                        registry.reset_any_cache_cleared()
+                    else:
+                        _logger.info("Invalidating the caches of %s after database signaling.", ', '.join(sorted(names)))
+                        registry.clear_model_caches(cr, names)
+                        # do not signal those invalidations back
+                        registry._caches_cleared -= names
                 registry.base_registry_signaling_sequence = r
                 registry.base_cache_signaling_sequence = c
             finally:
@@ -407,15 +675,33 @@ class RegistryManager(object):
             # through the database to other processes.
             registry = cls.get(db_name)
             if registry.any_cache_cleared():
-                _logger.info("At least one model cache has been cleared, signaling through the database.")
+                names = ['*'] if registry._any_cache_cleared else sorted(registry._caches_cleared)
+                _logger.info("The caches of %s have been cleared, signaling through the database.", ', '.join(names))
                 cr = registry.cursor()
                 r = 1
                 try:
+                    # The lock orders the signaling transactions, so that the
+                    # sequences of the channels are committed in order, and
+                    # other processes do not miss any of them.
+                    cr.execute("LOCK TABLE base_cache_signaling_channels IN EXCLUSIVE MODE")
                     cr.execute("select nextval('base_cache_signaling')")
                     r = cr.fetchone()[0]
+                    for name in names:
+                        cr.execute("""UPDATE base_cache_signaling_channels
+                                      SET sequence=%s, flushes=flushes+1 WHERE name=%s""", (r, name))
+                        if not cr.rowcount:
+                            cr.execute("""INSERT INTO base_cache_signaling_channels (name, sequence, flushes)
+                                          VALUES (%s, %s, 1)""", (name, r))
+                    cr.execute("SELECT pg_notify(%s, %s)", (SIGNALING_CHANNEL, process_token()))
+                    cr.commit()
                 finally:
                     cr.close()
-                registry.base_cache_signaling_sequence = r
+                # Only move forward if no other process signaled in between,
+                # otherwise their invalidations would be missed.
+                if registry.base_cache_signaling_sequence == r - 1:
+                    registry.base_cache_signaling_sequence = r
+                registry.cache_signaled.update(names)
+                registry.cache_versions.update(dict.fromkeys(names, r))
                 registry.reset_any_cache_cleared()
 
     @classmethod
@@ -428,6 +714,8 @@ class RegistryManager(object):
             try:
                 cr.execute("select nextval('base_registry_signaling')")
                 r = cr.fetchone()[0]
+                cr.execute("SELECT pg_notify(%s, %s)", (SIGNALING_CHANNEL, process_token()))
+                cr.commit()
             finally:
                 cr.close()
             registry.base_registry_signaling_sequence = r
@@ -307,6 +307,70 @@ def distribute_not(domain):
         return done + distribute_not(todo)
 
 
+def _value_shape(value):
+    """ Return what the SQL generated for a domain term depends on in its
+        value: its type and whether it is false. Strings of length 10 are
+        distinguished, as such dates are completed by the parsing of terms on
+        datetime fields, and list values are described item by item.
+    """
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple((type(item), item == False) for item in value)
+    if isinstance(value, basestring):
+        return type(value), bool(value), len(value) == 10
+    return type(value), value == False
+
+
+def _path_shape(model, path):
+    """ Return the ``_auto_join`` flags of the fields followed by the dotted
+        ``path`` from ``model``, or ``None`` if the path is invalid.
+    """
+    flags = []
+    for name in path.split('.')[:-1]:
+        column_info = model._all_columns.get(name)
+        if not column_info or not column_info.column._obj:
+            return None
+        flags.append(column_info.column._auto_join)
+        model = model.pool[column_info.column._obj]
+    return tuple(flags)
+
+
+def domain_shape(model, domain):
+    """ Return a hashable key describing the structure of ``domain`` on
+        ``model``, i.e. its operators, the fields and operators of its terms
+        and the shape of their values, but not the values themselves. Domains
+        with the same shape are translated into the same SQL, with different
+        parameters: see :class:`expression`. The subqueries of ``inselect``
+        terms are part of the shape.
+
+        Return ``None`` for the domains that cannot be cached, because they
+        are empty, malformed, or use an operator computing its SQL from the
+        data in the database (``child_of``).
+    """
+    if not domain:
+        return None
+    shape = []
+    for element in domain:
+        if is_operator(element):
+            shape.append(element)
+        elif is_leaf(element) and element[1] != 'child_of':
+            left, operator, right = element
+            path = _path_shape(model, left) if '.' in str(left) else ()
+            if path is None:
+                return None
+            if operator in ('inselect', 'not inselect'):
+                # the SQL of the subquery is part of the translated domain
+                if not (isinstance(right, (list, tuple)) and len(right) == 2
+                        and isinstance(right[0], basestring)):
+                    return None
+                value = (right[0], _value_shape(right[1]))
+            else:
+                value = _value_shape(right)
+            shape.append((left, operator, value, path))
+        else:
+            return None
+    return tuple(shape)
+
+
 # --------------------------------------------------
 # Generic leaf manipulation
 # --------------------------------------------------
@@ -621,7 +685,9 @@ class expression(object):
 
     def __init__(self, cr, uid, exp, table, context):
         """ Initialize expression object and automatically parse the expression
-            right after initialization.
+            right after initialization. The parsing is skipped when the SQL of
+            a domain with the same shape (see :func:`domain_shape`) has been
+            cached on the registry: only the parameters are computed then.
 
             :param exp: expression (using domain ('foo', '=', 'bar' format))
             :param table: root model
@@ -638,6 +704,22 @@ class expression(object):
         self.joins = []
         self.root_model = table
 
+        # look up the SQL of the domain's shape; the models may still change
+        # while the registry is being loaded
+        self._cache_key = None
+        self._cacheable = True
+        self._compiled = None
+        shape = domain_shape(table, exp) if not table.pool._init else None
+        if shape is not None:
+            # the values of the terms, in the order of the domain
+            self._values = [element[2] for element in exp if not is_operator(element)]
+            self._cache_key = (table._name, shape)
+            try:
+                self._compiled = table.pool._domain_cache[self._cache_key]
+                return
+            except KeyError:
+                pass
+
         # normalize and prepare the expression for parsing
         self.expression = distribute_not(normalize_domain(exp))
 
@@ -650,6 +732,8 @@ class expression(object):
 
     def get_tables(self):
         """ Returns the list of tables for SQL queries, like select from ... """
+        if self._compiled:
+            return list(self._compiled[0])
         tables = []
         for leaf in self.result:
             for table in leaf.get_tables():
@@ -709,7 +793,12 @@ class expression(object):
             """ Return a domain implementing the child_of operator for [(left,child_of,ids)],
                 either as a range using the parent_left/right tree lookup fields
                 (when available), or as an expanded [(left,in,child_ids)] """
-            if left_model._parent_store and (not left_model.pool._init):
+            if left_model._parent_cache and (parent or left_model._parent_name) == left_model._parent_name \
+                    and (not left_model.pool._init):
+                # all the descendants at once from the in-memory hierarchy
+                return [(left, 'in', left_model._hierarchy_children(cr, ids))]
+            elif left_model._parent_store and (not left_model.pool._init):
+                left_model._parent_store_flush(cr)
                 # TODO: Improve where joins are implemented for many with '.', replace by:
                 # doms += ['&',(prefix+'.parent_left','<',o.parent_right),(prefix+'.parent_left','>=',o.parent_left)]
                 doms = []
@@ -873,7 +962,10 @@ class expression(object):
                 push(leaf)
 
             elif isinstance(field, fields.function) and not field.store:
-                # this is a function field that is not stored
+                # this is a function field that is not stored; the domain
+                # returned by its search function may depend on the value,
+                # hence the SQL of the domain cannot be cached
+                self._cacheable = False
                 fct_domain = field.search(cr, uid, working_model, left, [leaf.leaf], context=context)
                 if not fct_domain:
                     leaf.leaf = TRUE_LEAF
@@ -1216,6 +1308,19 @@ class expression(object):
         return query, params
 
     def to_sql(self):
+        if self._compiled:
+            # reuse the SQL of the domain's shape, with the values of the domain
+            tables, query, leaves = self._compiled
+            params = [self.__leaf_to_sql(create_substitution_leaf(leaf, (leaf.leaf[0], leaf.leaf[1], value)))[1]
+                      for leaf, value in zip(leaves, self._values)]
+            return query, tools.flatten(params)
+
+        # The SQL can be cached when each term of the domain gave exactly one
+        # term of the result, with the same value.
+        leaves = [leaf for leaf in self.result if leaf.is_leaf(internal=True)]
+        cacheable = self._cache_key and self._cacheable and len(leaves) == len(self._values) \
+            and all(leaf.leaf[2] is value for leaf, value in zip(leaves, self._values))
+
         stack = []
         params = []
         # Process the domain from right to left, using a stack, to generate a SQL expression.
@@ -1239,6 +1344,9 @@ class expression(object):
         if joins:
             query = '(%s) AND %s' % (joins, query)
 
+        if cacheable:
+            self.root_model.pool._domain_cache[self._cache_key] = (self.get_tables(), query, leaves)
+
         return query, tools.flatten(params)
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
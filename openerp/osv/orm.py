@@ -80,6 +80,13 @@ regex_object_name = re.compile(r'^[a-z0-9_.]+$')
 
 AUTOINIT_RECALCULATE_STORED_FIELDS = 1000
 
+# number of records browsed at once by export_data()
+EXPORT_CHUNK_SIZE = 1000
+
+# context keys kept with the deferred recomputations of stored function
+# fields, see BaseModel._store_defer()
+STORE_DEFER_CONTEXT = ('lang', 'tz')
+
 def transfer_field_to_modifiers(field, modifiers):
     default_values = {}
     state_exceptions = {}
@@ -290,6 +297,32 @@ class browse_null(object):
         raise NotImplementedError("Iteration is not allowed on %s" % self)
 
 
+class browse_cache(dict):
+    """ Cache shared by the browse_records created by a same ``browse()``
+        call, mapping model names to ``{id: {field: value}}`` dictionaries.
+
+        Besides the cached values, it keeps track of the non-prefetchable
+        fields (function, one2many, many2many, ...) that were accessed on each
+        model, so that the next access to one of them fetches the others as
+        well, for all the pending records of that model, in a single read().
+
+        .. attribute:: stats
+
+            Counters of the browse accesses (``hit``, ``miss``) and of the
+            ``read`` calls issued to fill in the cache. The counters are
+            shared by all the browse caches of a cursor, and thus report the
+            figures of the whole request.
+    """
+
+    def __init__(self, cr=None):
+        super(browse_cache, self).__init__()
+        self.accessed = {}
+        cursor_cache = getattr(cr, 'cache', None)
+        if cursor_cache is not None:
+            self.stats = cursor_cache.setdefault('browse_stats', {'hit': 0, 'miss': 0, 'read': 0})
+        else:
+            self.stats = {'hit': 0, 'miss': 0, 'read': 0}
+
 #
 # TODO: execute an object method on browse_record_list
 #
@@ -346,6 +379,10 @@ class browse_record(object):
 
         cache.setdefault(table._name, {})
         self._data = cache[table._name]
+        # prefetch planning and statistics, only available on browse_cache
+        self._stats = getattr(cache, 'stats', None)
+        accessed = getattr(cache, 'accessed', None)
+        self._accessed = accessed.setdefault(table._name, set()) if accessed is not None else None
 
 #        if not (id and isinstance(id, (int, long,))):
 #            raise BrowseRecordError(_('Wrong ID for the browse record, got %r, expected an integer.') % (id,))
@@ -361,7 +398,10 @@ class browse_record(object):
         if name == 'id':
             return self._id
 
-        if name not in self._data[self._id]:
+        if name in self._data[self._id]:
+            if self._stats is not None:
+                self._stats['hit'] += 1
+        else:
             # build the list of fields we will fetch
 
             # fetch the definition of the field which was asked for
@@ -397,13 +437,25 @@ class browse_record(object):
                 inherits = map(lambda x: (x[0], x[1][2]), self._table._inherit_fields.items())
                 # complete the field list with the inherited fields which are classic or many2one
                 fields_to_fetch += filter(field_filter, inherits)
-            # otherwise we fetch only that field
+            # otherwise we fetch that field, together with the other
+            # non-prefetchable fields previously accessed on this model
             else:
                 fields_to_fetch = [(name, col)]
+                if self._accessed is not None:
+                    for other in self._accessed:
+                        if other == name or other in self._data[self._id]:
+                            continue
+                        other_col = self._table._all_columns[other].column
+                        if not (other_col.groups or other_col.deprecated):
+                            fields_to_fetch.append((other, other_col))
+                    self._accessed.add(name)
 
             ids = filter(lambda id: name not in self._data[id], self._data.keys())
             # read the results
             field_names = map(lambda x: x[0], fields_to_fetch)
+            if self._stats is not None:
+                self._stats['miss'] += 1
+                self._stats['read'] += 1
             try:
                 field_values = self._table.read(self._cr, self._uid, ids, field_names, context=self._context, load="_classic_write")
             except (openerp.exceptions.AccessError, except_orm):
@@ -696,6 +748,14 @@ class BaseModel(object):
     _parent_name = 'parent_id'
     _parent_store = False
     _parent_order = False
+    # Spacing of the nested set positions (parent_left, parent_right): with a
+    # gap greater than 1, free positions are left inside and after each node,
+    # so that new nodes can be inserted without shifting the rest of the tree.
+    _parent_store_gap = 1
+    # Whether child_of domains on the model are computed from an in-memory
+    # index of the hierarchy (see _hierarchy_children()) instead of the
+    # database; the index is kept on the registry until the hierarchy changes.
+    _parent_cache = False
     _date_name = 'date'
     _order = 'id'
     _sequence = None
@@ -732,6 +792,19 @@ class BaseModel(object):
     _invalids = set()
     _log_create = False
     _sql_constraints = []
+
+    # Whether the classic fields read by _read_flat() are kept in a cache for
+    # the rest of the transaction; meant for small, seldom modified models
+    # which are read over and over (companies, currencies, units of measure).
+    # The cache is invalidated by write(), unlink() and the recomputation of
+    # stored fields, but not by raw SQL updates.
+    _read_cache = False
+    # Methods which do not modify any data; when called remotely, they may be
+    # served by a read replica of the database (see Registry.cursor()). They
+    # are run again on the primary database if they attempt to write anyway.
+    _readonly_methods = ['read', 'search', 'search_read', 'search_count', 'read_group',
+                         'name_get', 'name_search', 'fields_get', 'fields_view_get',
+                         'default_get', 'exists', 'check_access_rights']
     _protected = ['read', 'write', 'create', 'default_get', 'perm_read', 'unlink', 'fields_get', 'fields_view_get', 'search', 'name_get', 'distinct_field_get', 'name_search', 'copy', 'import_data', 'search_count', 'exists']
 
     CONCURRENCY_CHECK_FIELD = '__last_update'
@@ -1030,6 +1103,7 @@ class BaseModel(object):
                 if not t in self.pool._store_function[object]:
                     self.pool._store_function[object].append((self._name, store_field, fnct, tuple(fields2) if fields2 else None, order, length))
                     self.pool._store_function[object].sort(lambda x, y: cmp(x[4], y[4]))
+                    self.pool._store_delays = None
 
         for (key, _, msg) in self._sql_constraints:
             self.pool._sql_error[self._table+'_'+key] = msg
@@ -1250,16 +1324,31 @@ class BaseModel(object):
         This method is used when exporting data via client menu
 
         """
+        return {'datas': list(self._iter_export_rows(cr, uid, ids, fields_to_export, raw_data=raw_data, context=context))}
+
+    def _export_rows(self, cr, uid, ids, fields_to_export, raw_data=False, context=None):
+        """ Iterate over the rows exported by :meth:`export_data`. The records
+        are browsed by chunks, so that memory use does not depend on the
+        number of records.
+
+        Overrides of :meth:`export_data` may alter its result, so the rows of
+        models overriding it are simply taken from :meth:`export_data`.
+
+        :param ids: an iterable of ids, e.g. from :meth:`_iter_search`
+        """
+        if type(self).export_data.im_func is not BaseModel.export_data.im_func:
+            result = self.export_data(cr, uid, list(ids), fields_to_export, raw_data=raw_data, context=context)
+            return iter(result['datas'])
+        return self._iter_export_rows(cr, uid, ids, fields_to_export, raw_data=raw_data, context=context)
+
+    def _iter_export_rows(self, cr, uid, ids, fields_to_export, raw_data=False, context=None):
         if context is None:
             context = {}
-        cols = self._columns.copy()
-        for f in self._inherit_fields:
-            cols.update({f: self._inherit_fields[f][2]})
         fields_to_export = map(fix_import_export_id_paths, fields_to_export)
-        datas = []
-        for row in self.browse(cr, uid, ids, context):
-            datas += self.__export_row(cr, uid, row, fields_to_export, raw_data=raw_data, context=context)
-        return {'datas': datas}
+        for sub_ids in tools.misc.split_every(EXPORT_CHUNK_SIZE, ids):
+            for row in self.browse(cr, uid, list(sub_ids), context):
+                for data in self.__export_row(cr, uid, row, fields_to_export, raw_data=raw_data, context=context):
+                    yield data
 
     def import_data(self, cr, uid, fields, datas, mode='init', current_module='', noupdate=False, context=None, filename=None):
         """
@@ -1334,14 +1423,14 @@ class BaseModel(object):
                     with open(config.get('import_partial'), 'wb') as partial_import:
                         pickle.dump(data, partial_import)
                     if context.get('defer_parent_store_computation'):
-                        self._parent_store_compute(cr)
+                        self._parent_store_flush(cr)
                     cr.commit()
         except Exception, e:
             cr.rollback()
             return -1, {}, 'Line %d : %s' % (position + 1, tools.ustr(e)), ''
 
         if context.get('defer_parent_store_computation'):
-            self._parent_store_compute(cr)
+            self._parent_store_flush(cr)
         return position, 0, 0, 0
 
     def load(self, cr, uid, fields, data, context=None):
@@ -2148,7 +2237,7 @@ class BaseModel(object):
         try:
             getattr(self, '_ormcache')
             self._ormcache = {}
-            self.pool._any_cache_cleared = True
+            self.pool.cache_cleared(self._name)
         except AttributeError:
             pass
 
@@ -2514,29 +2603,128 @@ class BaseModel(object):
     def _parent_store_compute(self, cr):
         if not self._parent_store:
             return
+        self._hierarchy_invalidate(cr)
+        cr.transaction.get('parent_store_todo', {}).pop(self._name, None)
         _logger.info('Computing parent left and right for table %s...', self._table)
-        def browse_rec(root, pos=0):
-            # TODO: set order
-            where = self._parent_name+'='+str(root)
-            if not root:
-                where = self._parent_name+' IS NULL'
-            if self._parent_order:
-                where += ' order by '+self._parent_order
-            cr.execute('SELECT id FROM '+self._table+' WHERE '+where)
-            pos2 = pos + 1
-            for id in cr.fetchall():
-                pos2 = browse_rec(id[0], pos2)
-            cr.execute('update '+self._table+' set parent_left=%s, parent_right=%s where id=%s', (pos, pos2, root))
-            return pos2 + 1
         query = 'SELECT id FROM '+self._table+' WHERE '+self._parent_name+' IS NULL'
         if self._parent_order:
             query += ' order by ' + self._parent_order
-        pos = 0
         cr.execute(query)
-        for (root,) in cr.fetchall():
-            pos = browse_rec(root, pos)
+        rows, pos = self._parent_store_positions(cr, [root for (root,) in cr.fetchall()], 0)
+        self._store_write_rows(cr, ('parent_left', 'parent_right'), rows)
         return True
 
+    def _parent_store_positions(self, cr, ids, pos):
+        """ Compute the nested set positions of the subtrees rooted at
+            ``ids``, placed one after the other from position ``pos``, with
+            the spacing given by ``_parent_store_gap``. The subtrees are loaded
+            one level at a time.
+
+            :return: the list of ``(id, (parent_left, parent_right))`` of the
+                     nodes of the subtrees, and the next free position
+        """
+        gap = self._parent_store_gap
+        parent_order = self._parent_order or self._order
+        query = 'SELECT id, "%s" FROM "%s" WHERE "%s" IN %%s ORDER BY %s' % (
+            self._parent_name, self._table, self._parent_name, parent_order)
+        children = {}
+        seen = set(ids)
+        level = list(ids)
+        while level:
+            next_level = []
+            for sub_ids in cr.split_for_in_conditions(level):
+                cr.execute(query, (sub_ids,))
+                for id, parent_id in cr.fetchall():
+                    if id not in seen:
+                        seen.add(id)
+                        children.setdefault(parent_id, []).append(id)
+                        next_level.append(id)
+            level = next_level
+
+        rows = []
+        def assign(id, pos):
+            left = pos
+            pos += gap
+            for child_id in children.get(id, ()):
+                pos = assign(child_id, pos)
+            rows.append((id, (left, pos)))
+            return pos + gap
+        for id in ids:
+            pos = assign(id, pos)
+        return rows, pos
+
+    def _parent_store_defer(self, cr, ids, parent_ids=()):
+        """ Postpone the maintenance of the nested set for the records
+            ``ids``, which have been created or moved (from ``parent_ids``),
+            until :meth:`_parent_store_flush` is called, at the latest right
+            before the transaction is committed.
+        """
+        todo = cr.transaction.setdefault('parent_store_todo', {})
+        if self._name not in todo:
+            todo[self._name] = (set(), set())
+            cr.precommit(lambda: self._parent_store_flush(cr))
+        todo[self._name][0].update(ids)
+        todo[self._name][1].update(parent_id for parent_id in parent_ids if parent_id)
+
+    def _parent_store_flush(self, cr):
+        """ Update the nested set after deferred creations and moves (see the
+            context key ``defer_parent_store_computation``): new root records
+            are placed at the end of the tree, and only the subtrees of the
+            parents that gained or lost children are renumbered.
+        """
+        todo = cr.transaction.get('parent_store_todo', {}).pop(self._name, None)
+        if not todo:
+            return
+        ids, parent_ids = todo
+        roots = []
+        for sub_ids in cr.split_for_in_conditions(ids):
+            cr.execute('SELECT id, "%s" FROM "%s" WHERE id IN %%s' % (self._parent_name, self._table), (sub_ids,))
+            for id, parent_id in cr.fetchall():
+                if parent_id:
+                    parent_ids.add(parent_id)
+                else:
+                    roots.append(id)
+
+        done = set()
+        if roots:
+            cr.execute('SELECT max(parent_right) FROM "%s"' % self._table)
+            rows, pos = self._parent_store_positions(cr, sorted(roots), (cr.fetchone()[0] or 0) + self._parent_store_gap)
+            self._store_write_rows(cr, ('parent_left', 'parent_right'), rows)
+            done.update(row[0] for row in rows)
+        for parent_id in parent_ids:
+            if parent_id not in done:
+                renumbered = self._parent_store_renumber(cr, parent_id)
+                if renumbered is None:
+                    break
+                done.update(renumbered)
+
+    def _parent_store_renumber(self, cr, id):
+        """ Renumber the descendants of the record ``id`` within its current
+            bounds, or within the bounds of its closest ancestor which has
+            room enough for them; the whole tree is renumbered if none has.
+
+            :return: the ids of the renumbered records, or ``None`` if the
+                     whole tree has been renumbered
+        """
+        query = 'SELECT parent_left, parent_right, "%s" FROM "%s" WHERE id=%%s' % (self._parent_name, self._table)
+        while True:
+            cr.execute(query, (id,))
+            row = cr.fetchone()
+            if not row or row[0] is None:
+                # deleted, or new and renumbered with its ancestors
+                return set()
+            left, right, parent_id = row
+            rows, pos = self._parent_store_positions(cr, [id], left)
+            # the record itself keeps its bounds
+            rows.pop()
+            if pos - self._parent_store_gap <= right:
+                self._store_write_rows(cr, ('parent_left', 'parent_right'), rows)
+                return set(row[0] for row in rows)
+            if not parent_id:
+                self._parent_store_compute(cr)
+                return None
+            id = parent_id
+
     def _update_store(self, cr, f, k):
         _logger.info("storing computed values of fields.function '%s'", k)
         ss = self._columns[k]._symbol_set
@@ -3339,6 +3527,8 @@ class BaseModel(object):
 
         self.check_access_rights(cr, user, 'read')
         fields = self.check_field_access_rights(cr, user, 'read', fields)
+        if cr.transaction.get('store_queue'):
+            self._store_flush(cr, fields or self._all_columns.keys())
         if isinstance(ids, (int, long)):
             select = [ids]
         else:
@@ -3383,6 +3573,25 @@ class BaseModel(object):
             # or will at least contain self._table.
             rule_clause, rule_params, tables = self.pool.get('ir.rule').domain_get(cr, user, self._name, 'read', context=context)
 
+            # records found in the transaction read cache are not fetched
+            read_cache = None
+            cached = []
+            ids_to_fetch = ids
+            if self._read_cache and not context.get('bin_size') \
+                    and self.CONCURRENCY_CHECK_FIELD not in fields_pre:
+                read_cache = cr.transaction.setdefault('read_cache', {})\
+                               .setdefault((self._name, user, context.get('lang')), {})
+                stats = cr.cache.setdefault('read_cache_stats', {'hit': 0, 'miss': 0})
+                ids_to_fetch = []
+                for id in ids:
+                    values = read_cache.get(id)
+                    if values is not None and all(f in values for f in fields_pre):
+                        cached.append(dict([(f, values[f]) for f in fields_pre], id=id))
+                    else:
+                        ids_to_fetch.append(id)
+                stats['hit'] += len(cached)
+                stats['miss'] += len(ids_to_fetch)
+
             fields_pre2 = map(convert_field, fields_pre)
             order_by = self._parent_order or self._order
             select_fields = ','.join(fields_pre2 + ['%s.id' % self._table])
@@ -3390,7 +3599,7 @@ class BaseModel(object):
             if rule_clause:
                 query += " AND " + (' OR '.join(rule_clause))
             query += " ORDER BY " + order_by
-            for sub_ids in cr.split_for_in_conditions(ids):
+            for sub_ids in cr.split_for_in_conditions(ids_to_fetch):
                 cr.execute(query, [tuple(sub_ids)] + rule_params)
                 results = cr.dictfetchall()
                 result_ids = [x['id'] for x in results]
@@ -3401,15 +3610,26 @@ class BaseModel(object):
             res = map(lambda x: {'id': x}, ids)
 
         if context.get('lang'):
-            for f in fields_pre:
-                if f == self.CONCURRENCY_CHECK_FIELD:
-                    continue
-                if self._columns[f].translate:
-                    ids = [x['id'] for x in res]
-                    #TODO: optimize out of this loop
-                    res_trans = self.pool.get('ir.translation')._get_ids(cr, user, self._name+','+f, 'model', context['lang'], ids)
+            # fetch the translations of all the translatable fields at once
+            fields_trans = [f for f in fields_pre if f != self.CONCURRENCY_CHECK_FIELD and self._columns[f].translate]
+            if fields_trans:
+                res_ids = [x['id'] for x in res]
+                res_trans = self.pool.get('ir.translation')._get_ids_multi(cr, user,
+                    [self._name+','+f for f in fields_trans], 'model', context['lang'], res_ids)
+                for f in fields_trans:
+                    field_trans = res_trans[self._name+','+f]
                     for r in res:
-                        r[f] = res_trans.get(r['id'], False) or r[f]
+                        r[f] = field_trans.get(r['id'], False) or r[f]
+
+        if len(fields_pre) and read_cache is not None:
+            for r in res:
+                read_cache.setdefault(r['id'], {}).update(r)
+            # merge the fetched and cached records in the order of ids
+            by_id = dict((r['id'], r) for r in res + cached)
+            res = []
+            for id in ids:
+                if id in by_id:
+                    res.append(by_id.pop(id))
 
         for table in self._inherits:
             col = self._inherits[table]
@@ -3474,40 +3694,27 @@ class BaseModel(object):
             if field_column and field_column.deprecated:
                 _logger.warning('Field %s.%s is deprecated: %s', self._name, f, field_column.deprecated)
 
-        readonly = None
+        # mask the values of the fields restricted to groups of which the
+        # user is not a member; the membership is checked once per field
+        forbidden = {}
+        def is_forbidden(field):
+            if field not in forbidden:
+                groups = field in self._columns and self._columns[field].read
+                forbidden[field] = bool(groups) and \
+                    not self.pool['res.users']._has_groups(cr, user, tuple(groups))
+            return forbidden[field]
+
         for vals in res:
-            for field in vals.copy():
-                fobj = None
-                if field in self._columns:
-                    fobj = self._columns[field]
-
-                if fobj:
-                    groups = fobj.read
-                    if groups:
-                        edit = False
-                        for group in groups:
-                            module = group.split(".")[0]
-                            grp = group.split(".")[1]
-                            cr.execute("select count(*) from res_groups_users_rel where gid IN (select res_id from ir_model_data where name=%s and module=%s and model=%s) and uid=%s",  \
-                                       (grp, module, 'res.groups', user))
-                            readonly = cr.fetchall()
-                            if readonly[0][0] >= 1:
-                                edit = True
-                                break
-                            elif readonly[0][0] == 0:
-                                edit = False
-                            else:
-                                edit = False
-
-                        if not edit:
-                            if type(vals[field]) == type([]):
-                                vals[field] = []
-                            elif type(vals[field]) == type(0.0):
-                                vals[field] = 0
-                            elif type(vals[field]) == type(''):
-                                vals[field] = '=No Permission='
-                            else:
-                                vals[field] = False
+            for field in vals:
+                if is_forbidden(field):
+                    if type(vals[field]) == type([]):
+                        vals[field] = []
+                    elif type(vals[field]) == type(0.0):
+                        vals[field] = 0
+                    elif type(vals[field]) == type(''):
+                        vals[field] = '=No Permission='
+                    else:
+                        vals[field] = False
 
                 if vals[field] is None:
                     vals[field] = False
@@ -3734,6 +3941,8 @@ class BaseModel(object):
         self.delete_workflow(cr, uid, ids, context=context)
 
         self.check_access_rule(cr, uid, ids, 'unlink', context=context)
+        self._read_cache_invalidate(cr, ids)
+        self._hierarchy_invalidate(cr)
         pool_model_data = self.pool.get('ir.model.data')
         ir_values_obj = self.pool.get('ir.values')
         for sub_ids in cr.split_for_in_conditions(ids):
@@ -3757,6 +3966,9 @@ class BaseModel(object):
             if ir_value_ids:
                 ir_values_obj.unlink(cr, uid, ir_value_ids, context=context)
 
+        if context and context.get('defer_store_computation'):
+            self._store_defer(cr, [r for r in result_store if r[1] != self._name], context)
+            result_store = []
         for order, obj_name, store_ids, fields in result_store:
             if obj_name != self._name:
                 obj = self.pool[obj_name]
@@ -3830,20 +4042,8 @@ class BaseModel(object):
                 continue
             groups = fobj.write
 
-            if groups:
-                edit = False
-                for group in groups:
-                    module = group.split(".")[0]
-                    grp = group.split(".")[1]
-                    cr.execute("select count(*) from res_groups_users_rel where gid IN (select res_id from ir_model_data where name=%s and module=%s and model=%s) and uid=%s", \
-                               (grp, module, 'res.groups', user))
-                    readonly = cr.fetchall()
-                    if readonly[0][0] >= 1:
-                        edit = True
-                        break
-
-                if not edit:
-                    vals.pop(field)
+            if groups and not self.pool['res.users']._has_groups(cr, user, tuple(groups)):
+                vals.pop(field)
 
         if not context:
             context = {}
@@ -3854,12 +4054,15 @@ class BaseModel(object):
 
         self._check_concurrency(cr, ids, context)
         self.check_access_rights(cr, user, 'write')
+        self._read_cache_invalidate(cr, None if self._parent_store else ids)
 
         result = self._store_get_values(cr, user, ids, vals.keys(), context) or []
 
         # No direct update of parent_left/right
         vals.pop('parent_left', None)
         vals.pop('parent_right', None)
+        if self._parent_name in vals:
+            self._hierarchy_invalidate(cr)
 
         parents_changed = []
         parent_order = self._parent_order or self._order
@@ -3879,6 +4082,11 @@ class BaseModel(object):
                                 (self._table, self._parent_name, parent_order)
                 cr.execute(query, (tuple(ids),))
             parents_changed = map(operator.itemgetter(0), cr.fetchall())
+            if parents_changed and context.get('defer_parent_store_computation') and not self.pool._init:
+                cr.execute('SELECT DISTINCT "%s" FROM "%s" WHERE id IN %%s' % (self._parent_name, self._table),
+                           (tuple(parents_changed),))
+                self._parent_store_defer(cr, parents_changed, [row[0] for row in cr.fetchall()])
+                parents_changed = []
 
         upd0 = []
         upd1 = []
@@ -4023,6 +4231,9 @@ class BaseModel(object):
                         cr.execute('update '+self._table+' set parent_left=parent_left-%s, parent_right=parent_right-%s where parent_left>=%s and parent_left<%s', (pleft-position+distance, pleft-position+distance, pleft+distance, pright+distance))
 
         result += self._store_get_values(cr, user, ids, vals.keys(), context)
+        if context.get('defer_store_computation'):
+            self._store_defer(cr, result, context)
+            result = []
         result.sort()
 
         done = {}
@@ -4155,24 +4366,8 @@ class BaseModel(object):
             if not fobj:
                 continue
             groups = fobj.write
-            if groups:
-                edit = False
-                for group in groups:
-                    module = group.split(".")[0]
-                    grp = group.split(".")[1]
-                    cr.execute("select count(*) from res_groups_users_rel where gid IN (select res_id from ir_model_data where name='%s' and module='%s' and model='%s') and uid=%s" % \
-                               (grp, module, 'res.groups', user))
-                    readonly = cr.fetchall()
-                    if readonly[0][0] >= 1:
-                        edit = True
-                        break
-                    elif readonly[0][0] == 0:
-                        edit = False
-                    else:
-                        edit = False
-
-                if not edit:
-                    vals.pop(field)
+            if groups and not self.pool['res.users']._has_groups(cr, user, tuple(groups)):
+                vals.pop(field)
         for field in vals:
             current_field = self._columns[field]
             if current_field._classic_write:
@@ -4221,29 +4416,15 @@ class BaseModel(object):
         id_new, = cr.fetchone()
         upd_todo.sort(lambda x, y: self._columns[x].priority-self._columns[y].priority)
 
+        if vals.get(self._parent_name):
+            self._hierarchy_invalidate(cr)
         if self._parent_store and not context.get('defer_parent_store_computation'):
             if self.pool._init:
                 self.pool._init_parent[self._name] = True
             else:
-                parent = vals.get(self._parent_name, False)
-                if parent:
-                    cr.execute('select parent_right from '+self._table+' where '+self._parent_name+'=%s order by '+(self._parent_order or self._order), (parent,))
-                    pleft_old = None
-                    result_p = cr.fetchall()
-                    for (pleft,) in result_p:
-                        if not pleft:
-                            break
-                        pleft_old = pleft
-                    if not pleft_old:
-                        cr.execute('select parent_left from '+self._table+' where id=%s', (parent,))
-                        pleft_old = cr.fetchone()[0]
-                    pleft = pleft_old
-                else:
-                    cr.execute('select max(parent_right) from '+self._table)
-                    pleft = cr.fetchone()[0] or 0
-                cr.execute('update '+self._table+' set parent_left=parent_left+2 where parent_left>%s', (pleft,))
-                cr.execute('update '+self._table+' set parent_right=parent_right+2 where parent_right>%s', (pleft,))
-                cr.execute('update '+self._table+' set parent_left=%s,parent_right=%s where id=%s', (pleft+1, pleft+2, id_new))
+                self._parent_store_create(cr, vals.get(self._parent_name, False), [id_new])
+        elif self._parent_store and not self.pool._init:
+            self._parent_store_defer(cr, [id_new])
 
         # default element in context must be remove when call a one2many or many2many
         rel_context = context.copy()
@@ -4260,6 +4441,9 @@ class BaseModel(object):
             result += self._store_get_values(cr, user, [id_new],
                 list(set(vals.keys() + self._inherits.values())),
                 context)
+            if context.get('defer_store_computation'):
+                self._store_defer(cr, result, context)
+                result = []
             result.sort()
             done = []
             for order, model_name, ids, fields2 in result:
@@ -4277,6 +4461,287 @@ class BaseModel(object):
         self.create_workflow(cr, user, [id_new], context=context)
         return id_new
 
+    def create_multi(self, cr, uid, vals_list, context=None):
+        """
+        Create several new records for the model, like :meth:`create`.
+
+        The records are inserted with multi-row ``INSERT`` queries, and the
+        nested set maintenance, the constraints validation, the store
+        triggers, the access rules and the workflows are processed once for
+        all the new records.
+
+        Models that override :meth:`create` (or that use ``_inherits`` or
+        ``_log_create``) fall back on calling :meth:`create` for each record,
+        so that the overrides keep working.
+
+        :param vals_list: list of dictionaries of field values, one per record
+        :return: the ids of the new records, in the order of ``vals_list``
+        """
+        if context is None:
+            context = {}
+        if not vals_list:
+            return []
+        if getattr(type(self).create, 'im_func', None) is not BaseModel.create.im_func \
+                or self._inherits or self._log_create:
+            return [self.create(cr, uid, vals, context=context) for vals in vals_list]
+
+        if self.is_transient():
+            self._transient_vacuum(cr, uid)
+
+        self.check_access_rights(cr, uid, 'create')
+
+        if not self._sequence:
+            raise except_orm(
+                _('UserError'),
+                _('You cannot perform this operation. New Record Creation is not allowed for this object as this object is for reporting purpose.')
+            )
+
+        bool_fields = [x for x in self._columns.keys() if self._columns[x]._type=='boolean']
+        forbidden = {}          # field name -> not allowed by the field's write groups
+        def is_forbidden(field):
+            if field not in forbidden:
+                groups = self._columns[field].write
+                forbidden[field] = bool(groups) and \
+                    not self.pool['res.users']._has_groups(cr, uid, tuple(groups))
+            return forbidden[field]
+
+        records = []            # list of (vals, columns, upd_todo)
+        unknown_fields = set()
+        for vals in vals_list:
+            vals = dict(vals)
+            if self._log_access:
+                for f in LOG_ACCESS_COLUMNS:
+                    if vals.pop(f, None) is not None:
+                        _logger.warning(
+                            'Field `%s` is not allowed when creating the model `%s`.',
+                            f, self._name)
+            vals = self._add_missing_default_values(cr, uid, vals, context)
+            for field in vals.keys():
+                if field not in self._columns:
+                    del vals[field]
+                    unknown_fields.add(field)
+                elif is_forbidden(field):
+                    del vals[field]
+            for bool_field in bool_fields:
+                if bool_field not in vals:
+                    vals[bool_field] = False
+
+            columns = [('id', "nextval('%s')" % self._sequence)]
+            upd_todo = []
+            for field in vals:
+                current_field = self._columns[field]
+                if current_field._classic_write:
+                    columns.append((field, '%s', current_field._symbol_set[1](vals[field])))
+                    # see create() about function fields receiving a value
+                    if (hasattr(current_field, '_fnct_inv')) and not isinstance(current_field, fields.related):
+                        upd_todo.append(field)
+                elif not isinstance(current_field, fields.related):
+                    upd_todo.append(field)
+                if hasattr(current_field, 'selection') and vals[field]:
+                    self._check_selection_field_value(cr, uid, field, vals[field], context=context)
+            if self._log_access:
+                columns.append(('create_uid', '%s', uid))
+                columns.append(('write_uid', '%s', uid))
+                columns.append(('create_date', "(now() at time zone 'UTC')"))
+                columns.append(('write_date', "(now() at time zone 'UTC')"))
+            upd_todo.sort(lambda x, y: self._columns[x].priority-self._columns[y].priority)
+            records.append((vals, columns, upd_todo))
+
+        if unknown_fields:
+            _logger.warning(
+                'No such field(s) in model %s: %s.',
+                self._name, ', '.join(sorted(unknown_fields)))
+
+        # insert the records having the same columns together; the ids are
+        # returned in the order of the VALUES rows
+        ids = [None] * len(records)
+        batches = {}
+        for index, (vals, columns, upd_todo) in enumerate(records):
+            key = tuple((c[0], c[1]) for c in columns)
+            batches.setdefault(key, []).append(index)
+        for key, indexes in batches.iteritems():
+            row_format = '(%s)' % ', '.join(c[1] for c in key)
+            for chunk in tools.misc.split_every(cr.IN_MAX, indexes):
+                params = []
+                for index in chunk:
+                    params.extend(c[2] for c in records[index][1] if len(c) > 2)
+                cr.execute(
+                    """INSERT INTO "%s" (%s) VALUES %s RETURNING id""" % (
+                        self._table,
+                        ', '.join('"%s"' % c[0] for c in key),
+                        ', '.join([row_format] * len(chunk))
+                    ),
+                    params
+                )
+                for index, (id_new,) in zip(chunk, cr.fetchall()):
+                    ids[index] = id_new
+
+        if any(vals.get(self._parent_name) for vals, columns, upd_todo in records):
+            self._hierarchy_invalidate(cr)
+        if self._parent_store and not context.get('defer_parent_store_computation'):
+            if self.pool._init:
+                self.pool._init_parent[self._name] = True
+            else:
+                by_parent = {}
+                for id_new, (vals, columns, upd_todo) in zip(ids, records):
+                    by_parent.setdefault(vals.get(self._parent_name) or False, []).append(id_new)
+                for parent, parent_ids in by_parent.iteritems():
+                    self._parent_store_create(cr, parent, parent_ids)
+        elif self._parent_store and not self.pool._init:
+            self._parent_store_defer(cr, ids)
+
+        # default element in context must be remove when call a one2many or many2many
+        rel_context = context.copy()
+        for c in context.items():
+            if c[0].startswith('default_'):
+                del rel_context[c[0]]
+
+        result = []
+        for id_new, (vals, columns, upd_todo) in zip(ids, records):
+            for field in upd_todo:
+                result += self._columns[field].set(cr, self, id_new, field, vals[field], uid, rel_context) or []
+        self._validate(cr, uid, ids, context)
+
+        if not context.get('no_store_function', False):
+            written = set()
+            for vals, columns, upd_todo in records:
+                written.update(vals)
+            result += self._store_get_values(cr, uid, ids, list(written), context)
+            if context.get('defer_store_computation'):
+                self._store_defer(cr, result, context)
+                result = []
+            result.sort()
+            done = []
+            for order, model_name, store_ids, fields2 in result:
+                if not (model_name, store_ids, fields2) in done:
+                    self.pool[model_name]._store_set_values(cr, uid, store_ids, fields2, context)
+                    done.append((model_name, store_ids, fields2))
+
+        self.check_access_rule(cr, uid, ids, 'create', context=context)
+        self.create_workflow(cr, uid, ids, context=context)
+        return ids
+
+    def _parent_store_create(self, cr, parent, ids):
+        """ Allocate the nested set positions (``parent_left``,
+            ``parent_right``) of the new records ``ids``, which are inserted
+            consecutively among the children of ``parent`` (or among the roots
+            if ``parent`` is ``False``). The new records are placed in the free
+            positions left by ``_parent_store_gap`` between their siblings when
+            there are enough of them; otherwise the positions of the records on
+            their right are shifted once for all the new records.
+        """
+        gap = self._parent_store_gap
+        if parent:
+            cr.execute('select parent_left, parent_right from '+self._table+' where '+self._parent_name+'=%s order by '+(self._parent_order or self._order), (parent,))
+            # the new records are placed between the right bound of the
+            # sibling before them and the left bound of the sibling after them
+            pleft_old = None
+            next_left = None
+            new_found = False
+            for (sibling_left, sibling_right) in cr.fetchall():
+                if not sibling_right:
+                    new_found = True
+                elif new_found:
+                    next_left = sibling_left
+                    break
+                else:
+                    pleft_old = sibling_right
+            cr.execute('select parent_left, parent_right from '+self._table+' where id=%s', (parent,))
+            parent_left, parent_right = cr.fetchone()
+            if parent_right is None:
+                # the parent itself is waiting for its positions
+                self._parent_store_defer(cr, ids)
+                return
+            pleft = pleft_old or parent_left
+            bound = parent_right if next_left is None else next_left
+            # spread the new records in the free positions before that bound
+            step = min(gap, (bound - pleft - 1) // (2 * len(ids) + 1))
+        else:
+            cr.execute('select max(parent_right) from '+self._table)
+            pleft = cr.fetchone()[0] or 0
+            step = gap
+        if step < 1:
+            step = gap
+            width = 2 * len(ids) * gap
+            self._read_cache_invalidate(cr)
+            cr.execute('update '+self._table+' set parent_left=parent_left+%s where parent_left>%s', (width, pleft))
+            cr.execute('update '+self._table+' set parent_right=parent_right+%s where parent_right>%s', (width, pleft))
+        for index, id_new in enumerate(ids):
+            cr.execute('update '+self._table+' set parent_left=%s,parent_right=%s where id=%s', (pleft+step*(2*index+1), pleft+step*(2*index+2), id_new))
+
+    def _hierarchy_index(self, cr):
+        """ Return the index of the hierarchy of the model, as a dict mapping
+            each parent id to the list of its children ids (``None`` maps to
+            the roots). The index is shared through the registry, unless the
+            hierarchy has been modified in the current transaction or the
+            cursor is on a read replica. An index is not shared either if the
+            hierarchy was invalidated while building it, or if it was built
+            from a snapshot older than the last invalidation (see
+            :meth:`_hierarchy_invalidate`).
+        """
+        shared = not (self._name in cr.transaction.get('hierarchy_changed', ()) or cr.readonly)
+        if shared:
+            cache = self.pool._hierarchy_cache
+        else:
+            # not shared: it may be out of date on a read replica
+            cache = cr.transaction.setdefault('hierarchy_index', {})
+        index = cache.get(self._name)
+        if index is None:
+            count, txid = self.pool._hierarchy_invalidation.get(self._name, (0, None))
+            if txid is None:
+                cr.execute('SELECT id, "%s", true FROM "%s"' % (self._parent_name, self._table))
+            else:
+                # whether the last invalidating transaction is visible in the
+                # snapshot of the query itself (one row at least)
+                cr.execute("""SELECT t.id, t."%s", txid_visible_in_snapshot(%%s, txid_current_snapshot())
+                              FROM (SELECT 1) AS one LEFT JOIN "%s" t ON true"""
+                           % (self._parent_name, self._table), (txid,))
+            index = {}
+            fresh = True
+            for id, parent_id, visible in cr.fetchall():
+                fresh = fresh and visible
+                if id is not None:
+                    index.setdefault(parent_id, []).append(id)
+            if not shared or (fresh and count == self.pool._hierarchy_invalidation.get(self._name, (0, None))[0]):
+                cache[self._name] = index
+        return index
+
+    def _hierarchy_children(self, cr, ids):
+        """ Return ``ids`` followed by the ids of all their descendants,
+            active or not (like with ``_parent_store``), computed in memory
+            from the index of the hierarchy.
+        """
+        index = self._hierarchy_index(cr)
+        result = []
+        seen = set()
+        todo = list(ids)
+        while todo:
+            id = todo.pop()
+            if id not in seen:
+                seen.add(id)
+                result.append(id)
+                todo.extend(index.get(id, ()))
+        return result
+
+    def _hierarchy_invalidate(self, cr):
+        """ Drop the index of the hierarchy after a change of the parents of
+            the model's records. The shared index is dropped once the change
+            is committed, in the current process right after commit, and in
+            the others through the cache signaling; until then the current
+            transaction uses its own index. The indexes built from snapshots
+            that do not see the change are not shared.
+        """
+        if not self._parent_cache:
+            return
+        changed = cr.transaction.setdefault('hierarchy_changed', set())
+        if self._name not in changed:
+            changed.add(self._name)
+            cr.execute("SELECT txid_current()")
+            txid = cr.fetchone()[0]
+            cr.postcommit(lambda: self.pool.hierarchy_invalidate(self._name, txid))
+        cr.transaction.get('hierarchy_index', {}).pop(self._name, None)
+        self.pool.cache_cleared(self._name)
+
     def browse(self, cr, uid, select, context=None, list_class=None, fields_process=None):
         """Fetch records as objects allowing to use dot notation to browse fields and relations
 
@@ -4288,7 +4753,7 @@ class BaseModel(object):
 
         """
         self._list_class = list_class or browse_record_list
-        cache = {}
+        cache = browse_cache(cr)
         # need to accepts ints and longs because ids coming from a method
         # launched by button in the interface have a type long...
         if isinstance(select, (int, long)):
@@ -4357,29 +4822,133 @@ class BaseModel(object):
             result = reduce(operator.add, (call_map[k] for k in ordered_keys))
         return result
 
+    def _read_cache_invalidate(self, cr, ids=None):
+        """ Remove the given records (all of them if ``ids`` is ``None``) of
+            this model from the transaction read cache (see ``_read_cache``).
+        """
+        read_cache = cr.transaction.get('read_cache')
+        if not read_cache:
+            return
+        for key, records in read_cache.iteritems():
+            if key[0] == self._name:
+                if ids is None:
+                    records.clear()
+                else:
+                    for id in ids:
+                        records.pop(id, None)
+
+    def _store_defer(self, cr, result, context=None):
+        """ Queue the recomputations of stored function fields ``result`` (as
+            returned by :meth:`_store_get_values`) on the transaction of the
+            cursor, instead of performing them right away. Recomputations are
+            deduplicated by (model, field, record, context), and are performed
+            by :meth:`_store_flush`, at the latest before the transaction is
+            committed, with the keys ``STORE_DEFER_CONTEXT`` of ``context``.
+
+            This is the behavior of create(), write() and unlink() when the
+            context contains ``defer_store_computation``.
+        """
+        if not result:
+            return
+        queue = cr.transaction.setdefault('store_queue', {})
+        if not queue:
+            cr.precommit(lambda: self._store_flush(cr))
+        context = context or {}
+        ctx = tuple((key, context[key]) for key in STORE_DEFER_CONTEXT if key in context)
+        for order, model_name, ids, fields in result:
+            model_queue = queue.setdefault((order, model_name, ctx), {})
+            for f in fields:
+                model_queue.setdefault(f, set()).update(ids)
+
+    def _store_flush(self, cr, fields=None):
+        """ Perform the recomputations of stored function fields queued by
+            :meth:`_store_defer` on the transaction of the cursor.
+
+            :param fields: if given, the recomputations are only performed if
+                           some of these fields of the current model are
+                           pending, i.e. if reading or searching on them would
+                           give outdated results; ``None`` means all fields
+        """
+        queue = cr.transaction.get('store_queue')
+        if not queue or cr.transaction.get('store_flushing'):
+            return
+        if fields is not None:
+            fields = set(fields)
+            if not any(model_name == self._name and fields.intersection(model_queue)
+                       for (order, model_name, ctx), model_queue in queue.iteritems()):
+                return
+        # recomputations are performed by order of priority, the ones that
+        # read fields pending for a later priority do not trigger a flush
+        cr.transaction['store_flushing'] = True
+        try:
+            while queue:
+                key = min(queue)
+                model_queue = queue.pop(key)
+                order, model_name, ctx = key
+                model = self.pool[model_name]
+                # group the fields to recompute on the same records, to take
+                # advantage of 'multi' function fields
+                todo = {}
+                for f, ids in model_queue.iteritems():
+                    todo.setdefault(frozenset(ids), []).append(f)
+                for ids, fnames in todo.iteritems():
+                    # records may have been deleted in the meantime
+                    existing = []
+                    for sub_ids in cr.split_for_in_conditions(ids):
+                        cr.execute('select id from "%s" where id IN %%s' % model._table, (sub_ids,))
+                        existing.extend(row[0] for row in cr.fetchall())
+                    model._store_set_values(cr, SUPERUSER_ID, existing, fnames, dict(ctx))
+        finally:
+            cr.transaction.pop('store_flushing', None)
+        return True
+
+    def flush_store_computation(self, cr, uid, context=None):
+        """ Perform all the recomputations of stored function fields that
+            were deferred in the current transaction (see the context key
+            ``defer_store_computation`` of create() and write()).
+        """
+        self._store_flush(cr)
+        return True
+
+    def _store_search_fields(self, args, order):
+        """ Return the names of the fields of this model used by a search()
+            domain and order, or ``None`` if the search may depend on the
+            fields of other models.
+        """
+        names = set()
+        for leaf in args or []:
+            if isinstance(leaf, (list, tuple)) and len(leaf) == 3 and isinstance(leaf[0], basestring):
+                if '.' in leaf[0]:
+                    return None
+                names.add(leaf[0])
+        for name in re.findall(r'\w+', order or self._parent_order or self._order):
+            # ordering on a many2one uses the order of the comodel
+            if name in self._columns and self._columns[name]._type == 'many2one':
+                return None
+            names.add(name)
+        return names
+
     def _store_set_values(self, cr, uid, ids, fields, context):
         """Calls the fields.function's "implementation function" for all ``fields``, on records with ``ids`` (taking care of
            respecting ``multi`` attributes), and stores the resulting values in the database directly."""
         if not ids:
             return True
-        field_flag = False
-        field_dict = {}
-        if self._log_access:
+
+        # records whose stored fields must not be recomputed yet, because of
+        # the 'time length' of the store triggers of this model
+        delayed = {}
+        delays = [(f, hours) for f, hours in self.pool.store_delays(self._name) if f in fields]
+        if self._log_access and delays:
+            now = datetime.datetime.now()
             cr.execute('select id,write_date from '+self._table+' where id IN %s', (tuple(ids),))
-            res = cr.fetchall()
-            for r in res:
-                if r[1]:
-                    field_dict.setdefault(r[0], [])
-                    res_date = time.strptime((r[1])[:19], '%Y-%m-%d %H:%M:%S')
+            for id, write_date in cr.fetchall():
+                if write_date:
+                    res_date = time.strptime(write_date[:19], '%Y-%m-%d %H:%M:%S')
                     write_date = datetime.datetime.fromtimestamp(time.mktime(res_date))
-                    for i in self.pool._store_function.get(self._name, []):
-                        if i[5]:
-                            up_write_date = write_date + datetime.timedelta(hours=i[5])
-                            if datetime.datetime.now() < up_write_date:
-                                if i[1] in fields:
-                                    field_dict[r[0]].append(i[1])
-                                    if not field_flag:
-                                        field_flag = True
+                    for f, hours in delays:
+                        if now < write_date + datetime.timedelta(hours=hours):
+                            delayed.setdefault(id, set()).add(f)
+
         todo = {}
         keys = []
         for f in fields:
@@ -4387,52 +4956,75 @@ class BaseModel(object):
                 keys.append(self._columns[f]._multi)
             todo.setdefault(self._columns[f]._multi, [])
             todo[self._columns[f]._multi].append(f)
+
+        def get_value(f, value):
+            if self._columns[f]._type == 'many2one' and isinstance(value, (list, tuple)):
+                return value and value[0]
+            return value
+
+        # The values of each group of fields are written before computing the
+        # next group, as later fields may depend on the stored values of the
+        # former ones.
         for key in keys:
             val = todo[key]
             if key:
                 # use admin user for accessing objects having rules defined on store fields
                 result = self._columns[val[0]].get(cr, self, ids, val, SUPERUSER_ID, context=context)
+                rows = {}
                 for id, value in result.items():
-                    if field_flag:
-                        for f in value.keys():
-                            if f in field_dict[id]:
-                                value.pop(f)
-                    upd0 = []
-                    upd1 = []
-                    for v in value:
-                        if v not in val:
-                            continue
-                        if self._columns[v]._type == 'many2one':
-                            try:
-                                value[v] = value[v][0]
-                            except:
-                                pass
-                        upd0.append('"'+v+'"='+self._columns[v]._symbol_set[0])
-                        upd1.append(self._columns[v]._symbol_set[1](value[v]))
-                    upd1.append(id)
-                    if upd0 and upd1:
-                        cr.execute('update "' + self._table + '" set ' + \
-                            ','.join(upd0) + ' where id = %s', upd1)
-
+                    fnames = tuple(f for f in val if f in value and f not in delayed.get(id, ()))
+                    if fnames:
+                        rows.setdefault(fnames, []).append((id, [get_value(f, value[f]) for f in fnames]))
+                for fnames, values in rows.iteritems():
+                    self._store_write_rows(cr, fnames, values)
             else:
                 for f in val:
                     # use admin user for accessing objects having rules defined on store fields
                     result = self._columns[f].get(cr, self, ids, f, SUPERUSER_ID, context=context)
-                    for r in result.keys():
-                        if field_flag:
-                            if r in field_dict.keys():
-                                if f in field_dict[r]:
-                                    result.pop(r)
-                    for id, value in result.items():
-                        if self._columns[f]._type == 'many2one':
-                            try:
-                                value = value[0]
-                            except:
-                                pass
-                        cr.execute('update "' + self._table + '" set ' + \
-                            '"'+f+'"='+self._columns[f]._symbol_set[0] + ' where id = %s', (self._columns[f]._symbol_set[1](value), id))
+                    values = [(id, [get_value(f, value)])
+                              for id, value in result.items()
+                              if f not in delayed.get(id, ())]
+                    self._store_write_rows(cr, (f,), values)
         return True
 
+    def _store_write_rows(self, cr, fnames, rows):
+        """ Write the values of the stored fields ``fnames`` for several
+            records, with a single ``UPDATE ... FROM (VALUES ...)`` query per
+            chunk of records.
+
+            :param fnames: tuple of field names
+            :param rows: list of ``(id, [value for each field of fnames])``
+        """
+        if not rows:
+            return
+        self._read_cache_invalidate(cr, [row[0] for row in rows])
+        columns = [self._columns[f] for f in fnames]
+        pg_types = [get_pg_type(column) for column in columns]
+        if len(rows) == 1 or not all(pg_types):
+            query = 'update "%s" set %s where id = %%s' % (
+                self._table, ','.join('"%s"=%s' % (f, c._symbol_set[0]) for f, c in zip(fnames, columns)))
+            for id, values in rows:
+                cr.execute(query, [c._symbol_set[1](v) for c, v in zip(columns, values)] + [id])
+            return
+
+        # the values are cast explicitly, otherwise PostgreSQL cannot guess the
+        # type of the columns of the VALUES list (e.g. when they are all NULL);
+        # to the unsized types, as an explicit cast to VARCHAR(n) would
+        # truncate the values too long instead of failing like an update
+        row_format = '(%%s,%s)' % ','.join('CAST(%s AS %s)' % (c._symbol_set[0], t[0])
+                                           for c, t in zip(columns, pg_types))
+        query = 'update "%s" set %s from (values %%s) as v(id,%s) where "%s".id = v.id' % (
+            self._table,
+            ','.join('"%s"=v."%s"' % (f, f) for f in fnames),
+            ','.join('"%s"' % f for f in fnames),
+            self._table)
+        for chunk in tools.misc.split_every(cr.IN_MAX, rows):
+            params = []
+            for id, values in chunk:
+                params.append(id)
+                params.extend(c._symbol_set[1](v) for c, v in zip(columns, values))
+            cr.execute(query % ','.join([row_format] * len(chunk)), params)
+
     #
     # TODO: Validate
     #
@@ -4630,23 +5222,9 @@ class BaseModel(object):
         :param access_rights_uid: optional user ID to use when checking access rights
                                   (not for ir.rules, this is only for ir.model.access)
         """
-        if context is None:
-            context = {}
-        self.check_access_rights(cr, access_rights_uid or user, 'read')
-
-        # For transient models, restrict acces to the current user, except for the super-user
-        if self.is_transient() and self._log_access and user != SUPERUSER_ID:
-            args = expression.AND(([('create_uid', '=', user)], args or []))
-
-        query = self._where_calc(cr, user, args, context=context)
-        self._apply_ir_rules(cr, user, query, 'read', context=context)
-        order_by = self._generate_order_by(order, query)
-        from_clause, where_clause, where_clause_params = query.get_sql()
-
-        limit_str = limit and ' limit %d' % limit or ''
-        offset_str = offset and ' offset %d' % offset or ''
-        where_str = where_clause and (" WHERE %s" % where_clause) or ''
-        query_str = 'SELECT "%s".id FROM ' % self._table + from_clause + where_str + order_by + limit_str + offset_str
+        query_str, where_clause_params, joined = self._search_query(cr, user, args,
+            offset=offset, limit=limit, order=order, context=context,
+            access_rights_uid=access_rights_uid)
 
         if count:
             # /!\ the main query must be executed as a subquery, otherwise
@@ -4667,6 +5245,53 @@ class BaseModel(object):
 
         return _uniquify_list([x[0] for x in res])
 
+    def _search_query(self, cr, user, args, offset=0, limit=None, order=None, context=None, access_rights_uid=None):
+        """ Return the query selecting the ids of the records matching ``args``
+        and its parameters, and whether it joins other tables, as
+        ``(query, params, joined)``. See :meth:`_search` for the parameters. """
+        if context is None:
+            context = {}
+        self.check_access_rights(cr, access_rights_uid or user, 'read')
+
+        # For transient models, restrict acces to the current user, except for the super-user
+        if self.is_transient() and self._log_access and user != SUPERUSER_ID:
+            args = expression.AND(([('create_uid', '=', user)], args or []))
+
+        if cr.transaction.get('store_queue'):
+            self._store_flush(cr, self._store_search_fields(args, order))
+
+        query = self._where_calc(cr, user, args, context=context)
+        self._apply_ir_rules(cr, user, query, 'read', context=context)
+        order_by = self._generate_order_by(order, query)
+        from_clause, where_clause, where_clause_params = query.get_sql()
+
+        limit_str = limit and ' limit %d' % limit or ''
+        offset_str = offset and ' offset %d' % offset or ''
+        where_str = where_clause and (" WHERE %s" % where_clause) or ''
+        query_str = 'SELECT "%s".id FROM ' % self._table + from_clause + where_str + order_by + limit_str + offset_str
+        return query_str, where_clause_params, len(query.tables) > 1
+
+    def _iter_search(self, cr, user, args, order=None, context=None):
+        """ Iterate over the ids of the records matching ``args``, like
+        :meth:`search`, without fetching them all at once (see
+        :meth:`~openerp.sql_db.Cursor.stream`).
+
+        Overrides of :meth:`search` or :meth:`_search` may alter its result,
+        so the ids of models overriding them are simply taken from
+        :meth:`search`.
+        """
+        cls = type(self)
+        if cls.search.im_func is not BaseModel.search.im_func or \
+                cls._search.im_func is not BaseModel._search.im_func:
+            return iter(self.search(cr, user, args, order=order, context=context))
+        query_str, params, joined = self._search_query(cr, user, args, order=order, context=context)
+        rows = cr.stream(query_str, params)
+        if not joined:
+            return (row[0] for row in rows)
+        # the joined tables may yield the same record several times
+        seen = set()
+        return (row[0] for row in rows if row[0] not in seen and not seen.add(row[0]))
+
     # returns the different values ever entered for one field
     # this is used, for example, in the client when the user hits enter on
     # a char field
@@ -5183,6 +5808,9 @@ class TransientModel(BaseModel):
     _auto = True
     _register = False # not visible in ORM registry, meant to be python-inherited only
     _transient = True
+    # transient records are read right after their creation, a replica may
+    # not have them yet
+    _readonly_methods = ['fields_get', 'fields_view_get', 'default_get']
 
 class AbstractModel(BaseModel):
     """Abstract Model super-class for creating an abstract class meant to be
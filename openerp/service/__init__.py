@@ -21,9 +21,11 @@
 ##############################################################################
 
 import common
+import cron
 import db
 import model
 import report
+import shared_cache
 import wsgi_server
 import server
 
@@ -0,0 +1,211 @@
+#-----------------------------------------------------------
+# Event-driven scheduling of the cron jobs
+#-----------------------------------------------------------
+import errno
+import heapq
+import logging
+import os
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+try:
+    import fcntl
+except ImportError:
+    # not on Windows, where the scheduler is not available (see available())
+    fcntl = None
+
+import openerp
+
+_logger = logging.getLogger(__name__)
+
+# PostgreSQL channel notified when the jobs of a database change
+CHANNEL = 'ir_cron'
+
+def available():
+    """ Whether the scheduler can run on this platform: it waits on pipes and
+    sockets with select(), which needs fcntl (POSIX). """
+    return fcntl is not None
+
+class Scheduler(object):
+    """ Hand out the databases whose cron jobs are due.
+
+    Instead of polling every database, the scheduler keeps the date of the
+    next call of each database in a heap, and sleeps until the earliest one.
+    It listens (LISTEN/NOTIFY) on a dedicated connection per database, and
+    fetches again the date of the next call of a database when its jobs
+    change (see ``ir.cron``).
+
+    The scheduler may be shared by several threads: each of them calls
+    :meth:`next_database`, processes the returned database, then calls
+    :meth:`done` with it.
+
+    :param db_list: function returning the names of the databases to
+        schedule; it is called again every ``interval`` seconds
+    :param interval: delay in seconds between two refreshes of the list of
+        databases, and before trying again a job that was not processed
+    """
+
+    def __init__(self, db_list, interval):
+        self.db_list = db_list
+        self.interval = interval
+        self.heap = []              # (next call timestamp, database name)
+        self.nextcall = {}          # database name: timestamp in the heap
+        self.connections = {}       # database name: LISTEN connection
+        self.running = set()        # databases handed out and not done yet
+        self.todo = {}              # database name: earliest next call
+        self.synced = 0
+        self.lock = threading.Lock()        # protects running and todo
+        self.wait_lock = threading.Lock()   # a single thread waits
+        self.pipe = os.pipe()
+        for fd in self.pipe:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags)
+
+    def next_database(self, timeout):
+        """ Wait until the jobs of a database are due and return its name, or
+        return None after ``timeout`` seconds. """
+        deadline = time.time() + timeout
+        with self.wait_lock:
+            while True:
+                now = time.time()
+                if now >= self.synced + self.interval:
+                    self._sync()
+                self._refresh_todo()
+                db_name = self._pop_due(now)
+                if db_name:
+                    return db_name
+                if now >= deadline:
+                    return None
+                wakeup = min(deadline, self.synced + self.interval)
+                if self.heap:
+                    wakeup = min(wakeup, self.heap[0][0])
+                self._wait(max(wakeup - now, 0))
+
+    def done(self, db_name):
+        """ Mark the jobs of ``db_name`` as processed. The jobs still due (e.g.
+        because another process holds them) are tried again after
+        ``interval`` seconds, unless their database notifies a change. """
+        with self.lock:
+            self.running.discard(db_name)
+            self.todo[db_name] = time.time() + self.interval
+        self._wake_up()
+
+    def close(self):
+        for db_name in self.connections.keys():
+            self._disconnect(db_name)
+        for fd in self.pipe:
+            os.close(fd)
+
+    def _wake_up(self):
+        try:
+            os.write(self.pipe[1], '.')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _sync(self):
+        """ Listen to the databases returned by ``db_list`` (only). """
+        db_names = set(self.db_list())
+        for db_name in set(self.connections) - db_names:
+            self._disconnect(db_name)
+            self.nextcall.pop(db_name, None)
+        for db_name in db_names - set(self.connections):
+            try:
+                cnx = psycopg2.connect(openerp.sql_db.dsn(db_name))
+                cnx.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cnx.cursor().execute('LISTEN "%s"' % CHANNEL)
+            except psycopg2.Error:
+                _logger.warning('Cannot listen to the cron jobs of database %s.', db_name, exc_info=True)
+                continue
+            self.connections[db_name] = cnx
+            with self.lock:
+                self.todo.setdefault(db_name, 0)
+        self.synced = time.time()
+
+    def _disconnect(self, db_name):
+        cnx = self.connections.pop(db_name)
+        try:
+            cnx.close()
+        except psycopg2.Error:
+            pass
+
+    def _refresh_todo(self):
+        with self.lock:
+            todo, self.todo = self.todo, {}
+        for db_name, earliest in todo.iteritems():
+            self._refresh(db_name, earliest)
+
+    def _refresh(self, db_name, earliest):
+        """ Fetch the date of the next call of the jobs of ``db_name``. """
+        if db_name not in self.connections:
+            return
+        try:
+            cr = self.connections[db_name].cursor()
+            nextcall = openerp.addons.base.ir.ir_cron.ir_cron._next_call(cr)
+        except psycopg2.ProgrammingError:
+            # not an OpenERP database, or not initialized yet
+            nextcall = None
+        except psycopg2.Error:
+            _logger.warning('Lost the connection listening to database %s.', db_name, exc_info=True)
+            self._disconnect(db_name)
+            self.synced = 0
+            nextcall = None
+        if nextcall is None:
+            self.nextcall.pop(db_name, None)
+            return
+        timestamp = max(nextcall, earliest)
+        self.nextcall[db_name] = timestamp
+        heapq.heappush(self.heap, (timestamp, db_name))
+
+    def _pop_due(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            timestamp, db_name = heapq.heappop(self.heap)
+            # skip the entries replaced by a later refresh
+            if self.nextcall.get(db_name) != timestamp:
+                continue
+            del self.nextcall[db_name]
+            with self.lock:
+                if db_name in self.running:
+                    continue
+                self.running.add(db_name)
+            return db_name
+        return None
+
+    def _wait(self, delay):
+        """ Sleep ``delay`` seconds at most, and collect the notifications. """
+        fds = dict((cnx.fileno(), db_name) for db_name, cnx in self.connections.iteritems())
+        try:
+            ready = select.select(fds.keys() + [self.pipe[0]], [], [], delay)[0]
+        except select.error, e:
+            if e[0] != errno.EINTR:
+                raise
+            return
+        for fd in ready:
+            if fd == self.pipe[0]:
+                try:
+                    while os.read(fd, 512):
+                        pass
+                except OSError, e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+                continue
+            db_name = fds[fd]
+            cnx = self.connections[db_name]
+            try:
+                cnx.poll()
+            except psycopg2.Error:
+                _logger.warning('Lost the connection listening to database %s.', db_name, exc_info=True)
+                self._disconnect(db_name)
+                self.nextcall.pop(db_name, None)
+                self.synced = 0
+                continue
+            if cnx.notifies:
+                del cnx.notifies[:]
+                with self.lock:
+                    self.todo.setdefault(db_name, 0)
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -2,12 +2,14 @@
 
 from functools import wraps
 import logging
+import psycopg2
 from psycopg2 import IntegrityError, OperationalError, errorcodes
 import random
 import threading
 import time
 
 import openerp
+from openerp.tools.lru import LRU
 from openerp.tools.translate import translate
 from openerp.osv.orm import except_orm
 from contextlib import contextmanager
@@ -161,16 +163,71 @@ def execute_cr(cr, uid, obj, method, *args, **kw):
 def execute_kw(db, uid, obj, method, args, kw=None):
     return execute(db, uid, obj, method, *args, **kw or {})
 
+# The users who modified data run their read-only calls on the primary
+# database until the read replicas may have replayed the modification, so
+# that they read their own writes; see sql_db.replica_delay().
+_primary_until = LRU(4096)      # (database, uid): timestamp
+
+def _http_session():
+    """ Return the http session of the current request, or None. """
+    request = openerp.http.request
+    return request.session if request else None
+
+def use_replica(db, uid):
+    """ Whether the read-only calls of ``uid`` (None for an anonymous http
+    session) may run on a read replica of ``db``: not if it modified data
+    recently, as recorded by :func:`primary_used` in this process or in the
+    http session of the current request (shared with the other processes). """
+    now = time.time()
+    if uid and _primary_until.get((db, uid), 0) > now:
+        return False
+    session = _http_session()
+    return not (session is not None and session.get('primary_until', 0) > now)
+
+def primary_used(db, uid):
+    """ Record that ``uid`` (and the http session of the current request)
+    modified data of ``db``: call it only for cursors that did, see
+    ``Cursor.modified``. """
+    if not openerp.tools.config['db_replicas']:
+        return
+    until = time.time() + openerp.sql_db.replica_delay()
+    if uid:
+        _primary_until[(db, uid)] = until
+    session = _http_session()
+    if session is not None:
+        session['primary_until'] = until
+
+def readonly_call(db, fn, *args, **kw):
+    """ Call ``fn(cr, *args, **kw)`` with a read-only cursor, which may be
+    connected to a read replica of ``db``. If ``fn`` attempts to modify data,
+    it is called again with a cursor on the primary database. """
+    registry = openerp.registry(db)
+    try:
+        with registry.cursor(readonly=True) as cr:
+            return fn(cr, *args, **kw)
+    except psycopg2.Error, e:
+        if e.pgcode != errorcodes.READ_ONLY_SQL_TRANSACTION:
+            raise
+        _logger.info("%s cannot run on a read replica of %s, retrying on the primary database", fn.__name__, db)
+    with registry.cursor() as cr:
+        return fn(cr, *args, **kw)
+
 @check
 def execute(db, uid, obj, method, *args, **kw):
     threading.currentThread().dbname = db
-    with openerp.registry(db).cursor() as cr:
-        if method.startswith('_'):
-            raise except_orm('Access Denied', 'Private methods (such as %s) cannot be called remotely.' % (method,))
-        res = execute_cr(cr, uid, obj, method, *args, **kw)
-        if res is None:
-            _logger.warning('The method %s of the object %s can not return `None` !', method, obj)
-        return res
+    if method.startswith('_'):
+        raise except_orm('Access Denied', 'Private methods (such as %s) cannot be called remotely.' % (method,))
+    registry = openerp.registry(db)
+    if method in getattr(registry.get(obj), '_readonly_methods', ()) and use_replica(db, uid):
+        res = readonly_call(db, execute_cr, uid, obj, method, *args, **kw)
+    else:
+        with registry.cursor() as cr:
+            res = execute_cr(cr, uid, obj, method, *args, **kw)
+        if cr.modified:
+            primary_used(db, uid)
+    if res is None:
+        _logger.warning('The method %s of the object %s can not return `None` !', method, obj)
+    return res
 
 def exec_workflow_cr(cr, uid, obj, signal, *args):
     res_id = args[0]
@@ -180,6 +237,9 @@ def exec_workflow_cr(cr, uid, obj, signal, *args):
 @check
 def exec_workflow(db, uid, obj, signal, *args):
     with openerp.registry(db).cursor() as cr:
-        return exec_workflow_cr(cr, uid, obj, signal, *args)
+        res = exec_workflow_cr(cr, uid, obj, signal, *args)
+    if cr.modified:
+        primary_used(db, uid)
+    return res
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -14,6 +14,7 @@ if os.name == 'posix':
 else:
     resource = None
 import select
+import shutil
 import signal
 import socket
 import subprocess
@@ -36,7 +37,9 @@ except ImportError:
 import openerp
 from openerp.modules.registry import RegistryManager
 from openerp.release import nt_service_name
+from openerp.service import shared_cache
 import openerp.tools.config as config
+from openerp.tools.cache import SharedBackend, set_backend
 from openerp.tools.misc import stripped_sys_argv, dumpstacks
 
 _logger = logging.getLogger(__name__)
@@ -223,6 +226,8 @@ class ThreadedServer(CommonServer):
 
         #self.socket = None
         self.httpd = None
+        # see cron_spawn()
+        self.cron_scheduler = None
 
     def signal_handler(self, sig, frame):
         if sig in [signal.SIGINT, signal.SIGTERM]:
@@ -238,6 +243,8 @@ class ThreadedServer(CommonServer):
             self.quit_signals_received += 1
 
     def cron_thread(self, number):
+        if self.cron_scheduler:
+            return self.cron_thread_scheduled(number)
         while True:
             time.sleep(SLEEP_INTERVAL + number)     # Steve Reich timing style
             registries = openerp.modules.registry.RegistryManager.registries
@@ -248,6 +255,21 @@ class ThreadedServer(CommonServer):
                     if not acquired:
                         break
 
+    def cron_thread_scheduled(self, number):
+        """ Process the databases whose jobs are due, as soon as they are due
+        (see openerp.service.cron). """
+        while True:
+            db_name = self.cron_scheduler.next_database(SLEEP_INTERVAL)
+            if db_name is None:
+                continue
+            _logger.debug('cron%d processing jobs of %s', number, db_name)
+            try:
+                registry = openerp.modules.registry.RegistryManager.registries.get(db_name)
+                if registry is not None and registry.ready:
+                    openerp.addons.base.ir.ir_cron.ir_cron._acquire_job(db_name)
+            finally:
+                self.cron_scheduler.done(db_name)
+
     def cron_spawn(self):
         """ Start the above runner function in a daemon thread.
 
@@ -260,6 +282,15 @@ class ThreadedServer(CommonServer):
         # to prevent time.strptime AttributeError within the thread.
         # See: http://bugs.python.org/issue7980
         datetime.datetime.strptime('2012-01-01', '%Y-%m-%d')
+        if config['cron_scheduler'] and not openerp.service.cron.available():
+            _logger.warning("The cron scheduler is not available on this platform, the databases are polled.")
+        elif config['cron_scheduler']:
+            # the threads share the scheduler, hence a single connection per
+            # database to listen to
+            def db_list():
+                registries = openerp.modules.registry.RegistryManager.registries
+                return [db_name for db_name, registry in registries.items() if registry.ready]
+            self.cron_scheduler = openerp.service.cron.Scheduler(db_list, SLEEP_INTERVAL)
         for i in range(openerp.tools.config['max_cron_threads']):
             def target():
                 self.cron_thread(i)
@@ -419,6 +450,8 @@ class PreforkServer(CommonServer):
         self.generation = 0
         self.queue = []
         self.long_polling_pid = None
+        self.shared_cache_path = None
+        self.shared_cache_pid = None
 
     def pipe_new(self):
         pipe = os.pipe()
@@ -466,6 +499,22 @@ class PreforkServer(CommonServer):
         popen = subprocess.Popen(nargs)
         self.long_polling_pid = popen.pid
 
+    def shared_cache_spawn(self):
+        # bind before forking, so that the socket exists for the workers
+        server = shared_cache.SharedCacheServer(self.shared_cache_path, config['ormcache_shared_size'])
+        pid = os.fork()
+        if pid != 0:
+            server.server_close()
+            self.shared_cache_pid = pid
+            return
+        try:
+            self.socket.close()
+            setproctitle('openerp: shared cache')
+            server.run()
+        except Exception:
+            _logger.exception("Shared cache (%s) exception occured, exiting...", os.getpid())
+        os._exit(1)
+
     def worker_pop(self, pid):
         if pid in self.workers:
             _logger.debug("Worker (%s) unregistered", pid)
@@ -514,6 +563,9 @@ class PreforkServer(CommonServer):
                     msg = "Critial worker error (%s)"
                     _logger.critical(msg, wpid)
                     raise Exception(msg % wpid)
+                if wpid == self.shared_cache_pid:
+                    _logger.warning("Shared cache (%s) exited, respawning it", wpid)
+                    self.shared_cache_pid = None
                 self.worker_pop(wpid)
             except OSError, e:
                 if e.errno == errno.ECHILD:
@@ -529,6 +581,8 @@ class PreforkServer(CommonServer):
                 self.worker_kill(pid, signal.SIGKILL)
 
     def process_spawn(self):
+        if self.shared_cache_path and not self.shared_cache_pid:
+            self.shared_cache_spawn()
         while len(self.workers_http) < self.population:
             self.worker_spawn(WorkerHTTP, self.workers_http)
         while len(self.workers_cron) < config['max_cron_threads']:
@@ -579,6 +633,13 @@ class PreforkServer(CommonServer):
         self.socket.bind(self.address)
         self.socket.listen(8 * self.population)
 
+        # share the orm caches between the workers, the backend is inherited
+        # by the forked processes
+        if config['ormcache_backend'] == 'shared':
+            self.shared_cache_path = shared_cache.socket_path()
+            self.shared_cache_spawn()
+            set_backend(SharedBackend(shared_cache.SharedCacheClient(self.shared_cache_path)))
+
     def stop(self, graceful=True):
         if self.long_polling_pid is not None:
             # FIXME make longpolling process handle SIGTERM correctly
@@ -596,6 +657,11 @@ class PreforkServer(CommonServer):
             _logger.info("Stopping forcefully")
         for pid in self.workers.keys():
             self.worker_kill(pid, signal.SIGTERM)
+        if self.shared_cache_pid is not None:
+            self.worker_kill(self.shared_cache_pid, signal.SIGTERM)
+            self.shared_cache_pid = None
+        if self.shared_cache_path:
+            shutil.rmtree(os.path.dirname(self.shared_cache_path), ignore_errors=True)
         self.socket.close()
 
     def run(self, preload, stop):
@@ -768,8 +834,19 @@ class WorkerCron(Worker):
         # The variable db_index is keeping track of the next database to
         # process.
         self.db_index = 0
+        # Names of the databases whose registry is kept warm between two
+        # polls, least recently used first.
+        self.warm_registries = []
+        self.registry_stats = dict(build=0, build_time=0.0, reuse=0, evict=0)
+        # With --cron-scheduler, the worker processes the databases whose jobs
+        # are due instead of polling them in turn (see openerp.service.cron).
+        self.scheduler = None
+        self.due_db_name = None
 
     def sleep(self):
+        if self.scheduler:
+            self.due_db_name = self.scheduler.next_database(SLEEP_INTERVAL)
+            return
         # Really sleep once all the databases have been processed.
         if self.db_index == 0:
             interval = SLEEP_INTERVAL + self.pid % 10   # chorus effect
@@ -783,45 +860,109 @@ class WorkerCron(Worker):
         return db_names
 
     def process_work(self):
-        rpc_request = logging.getLogger('openerp.netsvc.rpc.request')
-        rpc_request_flag = rpc_request.isEnabledFor(logging.DEBUG)
         _logger.debug("WorkerCron (%s) polling for jobs", self.pid)
+        if self.scheduler:
+            db_name = self.due_db_name
+            if db_name:
+                try:
+                    self.process_db(db_name, self._db_list())
+                finally:
+                    self.scheduler.done(db_name)
+            return
         db_names = self._db_list()
         if len(db_names):
             self.db_index = (self.db_index + 1) % len(db_names)
-            db_name = db_names[self.db_index]
-            self.setproctitle(db_name)
-            if rpc_request_flag:
-                start_time = time.time()
-                start_rss, start_vms = psutil.Process(os.getpid()).get_memory_info()
-
-            import openerp.addons.base as base
-            base.ir.ir_cron.ir_cron._acquire_job(db_name)
-            openerp.modules.registry.RegistryManager.delete(db_name)
-
-            # dont keep cursors in multi database mode
-            if len(db_names) > 1:
-                openerp.sql_db.close_db(db_name)
-            if rpc_request_flag:
-                run_time = time.time() - start_time
-                end_rss, end_vms = psutil.Process(os.getpid()).get_memory_info()
-                vms_diff = (end_vms - start_vms) / 1024
-                logline = '%s time:%.3fs mem: %sk -> %sk (diff: %sk)' % \
-                    (db_name, run_time, start_vms / 1024, end_vms / 1024, vms_diff)
-                _logger.debug("WorkerCron (%s) %s", self.pid, logline)
-
-            self.request_count += 1
-            if self.request_count >= self.request_max and self.request_max < len(db_names):
-                _logger.error("There are more dabatases to process than allowed "
-                              "by the `limit_request` configuration variable: %s more.",
-                              len(db_names) - self.request_max)
+            self.process_db(db_names[self.db_index], db_names)
         else:
             self.db_index = 0
 
+    def process_db(self, db_name, db_names):
+        """ Process the jobs of database ``db_name``, ``db_names`` being all
+        the databases processed by the worker. """
+        rpc_request = logging.getLogger('openerp.netsvc.rpc.request')
+        rpc_request_flag = rpc_request.isEnabledFor(logging.DEBUG)
+        self.setproctitle(db_name)
+        if rpc_request_flag:
+            start_time = time.time()
+            start_rss, start_vms = psutil.Process(os.getpid()).get_memory_info()
+
+        # Keep the warm registry in sync with the other processes before
+        # using it; a registry reloaded here is accounted as a build.
+        warm = RegistryManager.registries.get(db_name)
+        if warm is not None and db_name in self.warm_registries:
+            RegistryManager.check_registry_signaling(db_name)
+
+        import openerp.addons.base as base
+        base.ir.ir_cron.ir_cron._acquire_job(db_name)
+
+        if db_name in self.warm_registries:
+            self.warm_registries.remove(db_name)
+        registry = RegistryManager.registries.get(db_name)
+        if registry is not None:
+            if registry is warm:
+                self.registry_stats['reuse'] += 1
+            else:
+                self.registry_stats['build'] += 1
+                self.registry_stats['build_time'] += registry.load_time
+            self.warm_registries.append(db_name)
+        self.evict_registries(db_names)
+
+        if rpc_request_flag:
+            run_time = time.time() - start_time
+            end_rss, end_vms = psutil.Process(os.getpid()).get_memory_info()
+            vms_diff = (end_vms - start_vms) / 1024
+            stats = self.registry_stats
+            logline = '%s time:%.3fs mem: %sk -> %sk (diff: %sk) ' \
+                      'registries: %d warm, %d built in %.3fs, %d reused, %d evicted' % \
+                (db_name, run_time, start_vms / 1024, end_vms / 1024, vms_diff,
+                 len(self.warm_registries), stats['build'], stats['build_time'],
+                 stats['reuse'], stats['evict'])
+            _logger.debug("WorkerCron (%s) %s", self.pid, logline)
+
+        self.request_count += 1
+        if self.request_count >= self.request_max and self.request_max < len(db_names):
+            _logger.error("There are more dabatases to process than allowed "
+                          "by the `limit_request` configuration variable: %s more.",
+                          len(db_names) - self.request_max)
+
+    def evict_registries(self, db_names):
+        """ Drop the least recently used registries when there are more than
+        ``cron_registries`` of them, or when the worker uses more than
+        ``cron_registries_memory`` bytes of resident memory (the most recently
+        used registry is kept in that case). """
+        for db_name in self.warm_registries[:]:
+            if db_name not in db_names:
+                self.warm_registries.remove(db_name)
+                self.evict_registry(db_name, 'dropped')
+        while len(self.warm_registries) > config['cron_registries']:
+            self.evict_registry(self.warm_registries.pop(0), 'count')
+        while len(self.warm_registries) > 1:
+            rss, vms = psutil.Process(os.getpid()).get_memory_info()
+            if rss <= config['cron_registries_memory']:
+                break
+            self.evict_registry(self.warm_registries.pop(0), 'memory')
+
+    def evict_registry(self, db_name, reason):
+        RegistryManager.delete(db_name)
+        # dont keep cursors of evicted databases
+        openerp.sql_db.close_db(db_name)
+        stats = self.registry_stats
+        stats['evict'] += 1
+        _logger.info("WorkerCron (%s) evicted registry %s (%s), "
+                     "registries built: %d in %.3fs, reused: %d, evicted: %d",
+                     self.pid, db_name, reason, stats['build'],
+                     stats['build_time'], stats['reuse'], stats['evict'])
+
     def start(self):
         os.nice(10)     # mommy always told me to be nice with others...
         Worker.start(self)
         self.multi.socket.close()
+        if config['cron_scheduler']:
+            self.scheduler = openerp.service.cron.Scheduler(self._db_list, SLEEP_INTERVAL)
+
+    def stop(self):
+        if self.scheduler:
+            self.scheduler.close()
 
 #----------------------------------------------------------
 # start/stop public api
@@ -0,0 +1,192 @@
+#-----------------------------------------------------------
+# Cache shared by the workers of the prefork server
+#-----------------------------------------------------------
+"""
+The orm caches of the workers (see ``openerp.tools.cache``) may be backed by
+a cache shared between them, kept in a dedicated process forked by the prefork
+server. The workers talk to it through a local (unix) socket, with a minimal
+protocol: each request starts with a header made of an operation code and the
+lengths of the key and the value that follow it.
+
+- ``G``: get the value of the key, answered with its length (-1 if the key is
+  not in the cache) followed by the value;
+- ``S``: set the value of the key, without answer;
+- ``T``: get the statistics of the cache, answered like ``G`` with a JSON
+  object.
+
+Keys and values are opaque strings; the cache keeps its most recently used
+entries only.
+"""
+import errno
+import logging
+import os
+import signal
+import socket
+import SocketServer
+import struct
+import tempfile
+import threading
+import time
+
+import simplejson
+
+from openerp.tools.lru import LRU
+
+_logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('!cII')
+LENGTH = struct.Struct('!i')
+
+def _recv(sock, size):
+    """ Read exactly ``size`` bytes from ``sock``, or None at end of file. """
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+class SharedCacheHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        cache = self.server.cache
+        while True:
+            header = _recv(self.request, HEADER.size)
+            if header is None:
+                return
+            op, klen, vlen = HEADER.unpack(header)
+            key = _recv(self.request, klen)
+            value = _recv(self.request, vlen)
+            if key is None or value is None:
+                return
+            if op == 'G':
+                self._reply(cache.get(key))
+            elif op == 'S':
+                cache[key] = value
+                self.server.sets += 1
+            elif op == 'T':
+                res = dict(cache.stats(), sets=self.server.sets)
+                self._reply(simplejson.dumps(res))
+            else:
+                _logger.warning("Unknown operation %r, closing the connection", op)
+                return
+
+    def _reply(self, value):
+        if value is None:
+            self.request.sendall(LENGTH.pack(-1))
+        else:
+            self.request.sendall(LENGTH.pack(len(value)) + value)
+
+class SharedCacheServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """ The process keeping the shared cache, serving the workers on the unix
+    socket ``path``; it keeps ``size`` entries at most. """
+    daemon_threads = True
+
+    def __init__(self, path, size):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path, SharedCacheHandler)
+        self.path = path
+        self.cache = LRU(size)
+        self.sets = 0
+
+    def watch_parent(self, beat=4):
+        ppid = os.getppid()
+        while True:
+            if ppid != os.getppid():
+                _logger.info("Shared cache (%s) parent changed, exiting", os.getpid())
+                os._exit(0)
+            time.sleep(beat)
+
+    def run(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        t = threading.Thread(target=self.watch_parent, name="openerp.service.shared_cache.watch_parent")
+        t.setDaemon(True)
+        t.start()
+        _logger.info("Shared cache (%s) serving on %s", os.getpid(), self.path)
+        self.serve_forever()
+
+class SharedCacheClient(object):
+    """ Connection of a process to the shared cache on the unix socket
+    ``path``. The cache is best effort: when the shared cache cannot be
+    reached, lookups miss and values are not stored for ``retry`` seconds.
+    """
+    def __init__(self, path, timeout=1.0, retry=10):
+        self.path = path
+        self.timeout = timeout
+        self.retry = retry
+        self.local = threading.local()
+        self.down_until = 0
+
+    def _socket(self):
+        # the connection is neither shared between threads nor inherited by
+        # forked processes
+        sock = getattr(self.local, 'sock', None)
+        if sock is not None and self.local.pid == os.getpid():
+            return sock
+        if time.time() < self.down_until:
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            self._fail(sock)
+            return None
+        self.local.sock = sock
+        self.local.pid = os.getpid()
+        return sock
+
+    def _fail(self, sock):
+        _logger.warning("Shared cache %s unreachable, retrying in %ss", self.path, self.retry, exc_info=True)
+        try:
+            sock.close()
+        except socket.error:
+            pass
+        self.local.sock = None
+        self.down_until = time.time() + self.retry
+
+    def _request(self, op, key='', value='', reply=True):
+        sock = self._socket()
+        if sock is None:
+            return None
+        try:
+            sock.sendall(HEADER.pack(op, len(key), len(value)) + key + value)
+            if not reply:
+                return None
+            length = _recv(sock, LENGTH.size)
+            if length is None:
+                raise socket.error(errno.ECONNRESET, "connection closed by the shared cache")
+            length = LENGTH.unpack(length)[0]
+            if length < 0:
+                return None
+            res = _recv(sock, length)
+            if res is None:
+                raise socket.error(errno.ECONNRESET, "connection closed by the shared cache")
+            return res
+        except socket.error:
+            self._fail(sock)
+            return None
+
+    def get(self, key):
+        """ Return the value of ``key``, or None. """
+        return self._request('G', key)
+
+    def set(self, key, value):
+        self._request('S', key, value, reply=False)
+
+    def stats(self):
+        """ Return the statistics of the shared cache, or None. """
+        res = self._request('T')
+        return res and simplejson.loads(res)
+
+def socket_path():
+    """ Return a new path for the socket of a shared cache, in a directory
+    only accessible to the current user: the values of the cache are
+    unpickled by the workers. """
+    return os.path.join(tempfile.mkdtemp(prefix='openerp-ormcache-'), 'socket')
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
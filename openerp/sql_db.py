@@ -27,9 +27,11 @@ the database, *not* a database abstraction toolkit. Database abstraction is what
 the ORM does, in fact.
 """
 
+from collections import deque
 from contextlib import contextmanager
 from functools import wraps
 import logging
+import random
 import time
 import uuid
 import psycopg2.extensions
@@ -62,17 +64,124 @@ psycopg2.extensions.register_type(psycopg2.extensions.new_type((700, 701, 1700,)
 
 import tools
 from tools.func import frame_codeinfo
-from datetime import datetime as mdt
-from datetime import timedelta
 import threading
 from inspect import currentframe
 
+import heapq
+import os
 import re
-re_from = re.compile('.* from "?([a-zA-Z_0-9]+)"? .*$')
-re_into = re.compile('.* into "?([a-zA-Z_0-9]+)"? .*$')
+import simplejson
 
 sql_counter = 0
 
+re_literal = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+re_spaces = re.compile(r'\s+')
+
+def query_fingerprint(query):
+    """ Return ``query`` without its parameters and literal values, in order
+    to identify the queries that only differ by those. """
+    query = re_literal.sub('?', query.replace('%s', '?'))
+    return re_spaces.sub(' ', query).strip()
+
+_openerp_dir = os.path.dirname(os.path.abspath(__file__))
+_framework_files = (os.path.join(_openerp_dir, 'sql_db.py'), os.path.join(_openerp_dir, 'osv', ''))
+
+def query_caller():
+    """ Return the first frame of the call stack outside of the ORM and of
+    this module, as a string ``file:line function``. """
+    frame = currentframe().f_back
+    while frame and frame.f_code.co_filename.startswith(_framework_files):
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return "%s:%s %s" % (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+class QueryProfiler(object):
+    """ Statistics about the queries executed while it is active, in order to
+    find the slowest statements and the ones repeated over and over (e.g. in
+    a loop over records).
+
+    A profiler is either attached to a cursor (see ``Cursor.sql_log``), or
+    activated for all the cursors of the current thread with
+    :func:`start_profiler`.
+    """
+    def __init__(self, top=10):
+        self.top = top
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = {}      # fingerprint: [count, duration, caller]
+        self.statements = {}        # hash of statement: count
+        self.slowest = []           # heap of (duration, query, caller)
+
+    def record(self, query, statement, duration):
+        """ Account the execution of ``query``, i.e. ``statement`` once its
+        parameters are substituted, that took ``duration`` seconds. """
+        self.count += 1
+        self.duration += duration
+        caller = query_caller()
+        fingerprint = query_fingerprint(query)
+        stats = self.fingerprints.get(fingerprint)
+        if stats is None:
+            self.fingerprints[fingerprint] = [1, duration, caller]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+        key = hash(statement)
+        self.statements[key] = self.statements.get(key, 0) + 1
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, (duration, query, caller))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, query, caller))
+
+    def summary(self):
+        """ Return the statistics as a JSON-serializable dictionary:
+
+        - ``count``, ``duration``: number of queries, and their total time
+          in seconds;
+        - ``duplicates``: number of statements executed again with the very
+          same parameters;
+        - ``repeated``: the ``top`` queries executed most often with different
+          values, with their number of executions, total time and the call
+          site of the first one;
+        - ``slowest``: the ``top`` slowest queries, with their time and call
+          site.
+        """
+        repeated = sorted((item for item in self.fingerprints.iteritems() if item[1][0] > 1),
+                          key=lambda item: item[1][0], reverse=True)
+        return {
+            'count': self.count,
+            'duration': round(self.duration, 6),
+            'duplicates': sum(count - 1 for count in self.statements.itervalues()),
+            'repeated': [{'query': fingerprint, 'count': count, 'duration': round(duration, 6), 'caller': caller}
+                         for fingerprint, (count, duration, caller) in repeated[:self.top]],
+            'slowest': [{'query': query, 'duration': round(duration, 6), 'caller': caller}
+                        for duration, query, caller in sorted(self.slowest, reverse=True)],
+        }
+
+    def log(self, logger, level=logging.INFO, **extra):
+        """ Log the summary as a line of JSON, with the given ``extra`` values. """
+        summary = self.summary()
+        summary.update(extra)
+        logger.log(level, "%s", simplejson.dumps(summary))
+
+_profiling = threading.local()
+
+def start_profiler(top=10):
+    """ Profile the queries executed by the current thread, and return the
+    profiler. """
+    _profiling.profiler = QueryProfiler(top)
+    return _profiling.profiler
+
+def stop_profiler():
+    """ Stop profiling the current thread, and return the profiler. """
+    profiler = getattr(_profiling, 'profiler', None)
+    _profiling.profiler = None
+    return profiler
+
+# first keywords of the statements that do not modify data, see Cursor.modified
+READ_STATEMENTS = frozenset(['SELECT', 'SHOW', 'SET', 'EXPLAIN', 'LOCK', 'LISTEN', 'NOTIFY',
+                             'SAVEPOINT', 'RELEASE', 'ROLLBACK', 'DECLARE', 'FETCH', 'CLOSE'])
+
 class Cursor(object):
     """Represents an open transaction to the PostgreSQL DB backend,
        acting as a lightweight wrapper around psycopg2's
@@ -142,6 +251,24 @@ class Cursor(object):
             ignores rollbacks and savepoints, it should not be used to store
             *any* data which may be modified during the life of the cursor.
 
+        .. attribute:: readonly
+
+            Whether the cursor is connected to a read replica of the database,
+            on which the transaction cannot modify any data.
+
+        .. attribute:: transaction
+
+            Dictionary with a transaction lifecycle: it is cleared when the
+            transaction is committed or rolled back. It can be used to keep
+            data that is pending until the end of the transaction, together
+            with :meth:`precommit` and :meth:`postcommit`.
+
+        .. attribute:: modified
+
+            Whether the cursor executed statements that may modify data
+            (other than ``READ_STATEMENTS``), in the current transaction or in
+            a committed one.
+
     """
     IN_MAX = 1000 # decent limit on size of IN queries - guideline = Oracle limit
 
@@ -156,13 +283,11 @@ class Cursor(object):
             return f(self, *args, **kwargs)
         return wrapper
 
-    def __init__(self, pool, dbname, serialized=True):
-        self.sql_from_log = {}
-        self.sql_into_log = {}
-
+    def __init__(self, pool, dbname, serialized=True, readonly=False):
         # default log level determined at cursor creation, could be
         # overridden later for debugging purposes
         self.sql_log = _logger.isEnabledFor(logging.DEBUG)
+        self._profiler = None       # profiler of the cursor when sql_log is set
 
         self.sql_log_count = 0
         self._closed = True    # avoid the call of close() (by __del__) if an exception
@@ -174,7 +299,11 @@ class Cursor(object):
         # see also the docstring of Cursor.  
         self._serialized = serialized
 
-        self._cnx = pool.borrow(dsn(dbname))
+        # A read-only cursor is connected to a replica lagging not too much
+        # behind the primary database, or to the primary database otherwise.
+        replica = readonly and replica_dsn(pool, dbname)
+        self.readonly = bool(replica)
+        self._cnx = pool.borrow(replica or dsn(dbname))
         self._obj = self._cnx.cursor(cursor_factory=psycopg1cursor)
         if self.sql_log:
             self.__caller = frame_codeinfo(currentframe(),2)
@@ -187,6 +316,11 @@ class Cursor(object):
         self._default_log_exceptions = True
 
         self.cache = {}
+        self.transaction = {}
+        self._precommit = []
+        self._postcommit = []
+        self._pending_writes = False        # see modified
+        self._committed_writes = False
 
     def __del__(self):
         if not self._closed and not self._cnx.closed:
@@ -213,8 +347,17 @@ class Cursor(object):
             _logger.error("SQL query parameters should be a tuple, list or dict; got %r", params)
             raise ValueError("SQL query parameters should be a tuple, list or dict; got %r" % (params,))
 
-        if self.sql_log:
-            now = mdt.now()
+        profiler = getattr(_profiling, 'profiler', None)
+        if self.sql_log or profiler:
+            start = time.time()
+
+        keyword = query.lstrip()[:10].split(None, 1)[0].upper() if query.strip() else ''
+        if keyword not in READ_STATEMENTS:
+            self._pending_writes = True
+        if 'read_cache' in self.transaction and keyword == 'ROLLBACK':
+            # a rollback to a savepoint may restore values that were modified
+            # since they were cached: the cached values are no longer reliable
+            del self.transaction['read_cache']
 
         try:
             params = params or None
@@ -228,24 +371,66 @@ class Cursor(object):
                 _logger.exception("bad query: %s", self._obj.query or query)
             raise
 
-        if self.sql_log:
-            delay = mdt.now() - now
-            delay = delay.seconds * 1E6 + delay.microseconds
-
-            _logger.debug("query: %s", self._obj.query)
-            self.sql_log_count+=1
-            res_from = re_from.match(query.lower())
-            if res_from:
-                self.sql_from_log.setdefault(res_from.group(1), [0, 0])
-                self.sql_from_log[res_from.group(1)][0] += 1
-                self.sql_from_log[res_from.group(1)][1] += delay
-            res_into = re_into.match(query.lower())
-            if res_into:
-                self.sql_into_log.setdefault(res_into.group(1), [0, 0])
-                self.sql_into_log[res_into.group(1)][0] += 1
-                self.sql_into_log[res_into.group(1)][1] += delay
+        if self.sql_log or profiler:
+            self._profile(profiler, query, self._obj.query, time.time() - start)
         return res
 
+    def _profile(self, profiler, query, statement, duration):
+        if self.sql_log:
+            _logger.debug("query: %s", statement)
+            self.sql_log_count += 1
+            if self._profiler is None:
+                self._profiler = QueryProfiler()
+            self._profiler.record(query, statement, duration)
+        if profiler:
+            profiler.record(query, statement, duration)
+
+    @check
+    def stream(self, query, params=None, itersize=2000, dictfetch=False):
+        """ Execute ``query`` with a server-side cursor, and return an iterator
+        over the rows of its result. The rows are fetched ``itersize`` at a
+        time, so that a large result is never held in memory as a whole.
+
+        Other queries may be executed on the cursor during the iteration, but
+        the transaction must not end before the iteration does.
+
+        :param dictfetch: whether to return the rows as dictionaries
+        """
+        if params and not isinstance(params, (tuple, list, dict)):
+            _logger.error("SQL query parameters should be a tuple, list or dict; got %r", params)
+            raise ValueError("SQL query parameters should be a tuple, list or dict; got %r" % (params,))
+
+        profiler = getattr(_profiling, 'profiler', None)
+        if self.sql_log or profiler:
+            start = time.time()
+
+        obj = self._cnx.cursor('stream_%s' % uuid.uuid1().hex, cursor_factory=psycopg1cursor)
+        try:
+            obj.execute(query, params or None)
+        except Exception:
+            _logger.exception("bad query: %s", obj.query or query)
+            obj.close()
+            raise
+
+        if self.sql_log or profiler:
+            self._profile(profiler, query, obj.query, time.time() - start)
+        return self._stream(obj, itersize, dictfetch)
+
+    def _stream(self, obj, itersize, dictfetch):
+        fetchmany = obj.dictfetchmany if dictfetch else obj.fetchmany
+        try:
+            while True:
+                rows = fetchmany(itersize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            try:
+                obj.close()
+            except psycopg2.Error:
+                # the transaction has ended, and the cursor with it
+                pass
 
     def split_for_in_conditions(self, ids):
         """Split a list of identifiers into one or more smaller tuples
@@ -257,26 +442,17 @@ class Cursor(object):
         sql_counter += self.sql_log_count
         if not self.sql_log:
             return
-        def process(type):
-            sqllogs = {'from':self.sql_from_log, 'into':self.sql_into_log}
-            sum = 0
-            if sqllogs[type]:
-                sqllogitems = sqllogs[type].items()
-                sqllogitems.sort(key=lambda k: k[1][1])
-                _logger.debug("SQL LOG %s:", type)
-                sqllogitems.sort(lambda x,y: cmp(x[1][0], y[1][0]))
-                for r in sqllogitems:
-                    delay = timedelta(microseconds=r[1][1])
-                    _logger.debug("table: %s: %s/%s",
-                                        r[0], delay, r[1][0])
-                    sum+= r[1][1]
-                sqllogs[type].clear()
-            sum = timedelta(microseconds=sum)
-            _logger.debug("SUM %s:%s/%d [%d]",
-                                type, sum, self.sql_log_count, sql_counter)
-            sqllogs[type].clear()
-        process('from')
-        process('into')
+        if self._profiler:
+            summary = self._profiler.summary()
+            _logger.debug("SQL: %d queries in %.3fs, %d duplicates [%d]",
+                          summary['count'], summary['duration'], summary['duplicates'], sql_counter)
+            for stats in summary['repeated']:
+                _logger.debug("SQL repeated %dx in %.3fs from %s: %s",
+                              stats['count'], stats['duration'], stats['caller'], stats['query'])
+            for stats in summary['slowest']:
+                _logger.debug("SQL slowest %.3fs from %s: %s",
+                              stats['duration'], stats['caller'], stats['query'])
+            self._profiler = None
         self.sql_log_count = 0
         self.sql_log = False
 
@@ -288,7 +464,14 @@ class Cursor(object):
         if not self._obj:
             return
 
+        if self.sql_log and self.cache.get('browse_stats'):
+            _logger.debug("browse cache: %(hit)d hits, %(miss)d misses, %(read)d reads",
+                          self.cache['browse_stats'])
+        if self.sql_log and self.cache.get('read_cache_stats'):
+            _logger.debug("read cache: %(hit)d hits, %(miss)d misses",
+                          self.cache['read_cache_stats'])
         del self.cache
+        self._reset_transaction()
 
         if self.sql_log:
             self.__closer = frame_codeinfo(currentframe(),3)
@@ -308,7 +491,7 @@ class Cursor(object):
         self._cnx.rollback()
 
         if leak:
-            self._cnx.leaked = True
+            self.__pool.leak(self._cnx)
         else:
             chosen_template = tools.config['db_template']
             templates_list = tuple(set(['template0', 'template1', 'postgres', chosen_template]))
@@ -335,18 +518,63 @@ class Cursor(object):
                                   else ISOLATION_LEVEL_READ_COMMITTED
         self._cnx.set_isolation_level(isolation_level)
 
+    def precommit(self, func):
+        """ Register a function to call (without arguments) right before the
+            current transaction is committed. The function is called once,
+            and is forgotten if the transaction is rolled back.
+        """
+        if func not in self._precommit:
+            self._precommit.append(func)
+
+    def _run_precommit(self):
+        # functions may register other functions while being called
+        while self._precommit:
+            func = self._precommit.pop(0)
+            func()
+
+    def postcommit(self, func):
+        """ Register a function to call (without arguments) right after the
+            current transaction is committed, when its changes are visible to
+            the other transactions. The function is called once, and is
+            forgotten if the transaction is rolled back.
+        """
+        if func not in self._postcommit:
+            self._postcommit.append(func)
+
+    def _run_postcommit(self, funcs):
+        for func in funcs:
+            func()
+
+    def _reset_transaction(self):
+        self.transaction.clear()
+        self._precommit = []
+        self._postcommit = []
+
     @check
     def commit(self):
         """ Perform an SQL `COMMIT`
         """
-        return self._cnx.commit()
+        self._run_precommit()
+        result = self._cnx.commit()
+        self._committed_writes = self._committed_writes or self._pending_writes
+        self._pending_writes = False
+        postcommit = self._postcommit
+        self._reset_transaction()
+        self._run_postcommit(postcommit)
+        return result
 
     @check
     def rollback(self):
         """ Perform an SQL `ROLLBACK`
         """
+        self._reset_transaction()
+        self._pending_writes = False
         return self._cnx.rollback()
 
+    @property
+    def modified(self):
+        return self._pending_writes or self._committed_writes
+
     def __enter__(self):
         """ Using the cursor as a contextmanager automatically commits and
             closes it::
@@ -411,10 +639,18 @@ class TestCursor(Cursor):
         _logger.debug("TestCursor.autocommit(%r) does nothing", on)
 
     def commit(self):
+        self._run_precommit()
         self.execute("RELEASE SAVEPOINT test_cursor")
         self.execute("SAVEPOINT test_cursor")
+        self._committed_writes = self._committed_writes or self._pending_writes
+        self._pending_writes = False
+        postcommit = self._postcommit
+        self._reset_transaction()
+        self._run_postcommit(postcommit)
 
     def rollback(self):
+        self._reset_transaction()
+        self._pending_writes = False
         self.execute("ROLLBACK TO SAVEPOINT test_cursor")
         self.execute("SAVEPOINT test_cursor")
 
@@ -426,11 +662,22 @@ class ConnectionPool(object):
     
         Keep a set of connections to pg databases open, and reuse them
         to open cursors for all transactions.
-        
-        The connections are *not* automatically closed. Only a close_db()
-        can trigger that.
+
+        The idle connections are kept in a stack per database (dsn), and the
+        most recently used one is borrowed first. The lock of the pool is only
+        held for constant-time operations: connecting to the database and
+        checking a connection are done without it.
+
+        The connections idle for more than ``idle_timeout`` seconds (if set)
+        are closed, except the ``min_idle`` most recent ones of each database.
+        Those are also opened as soon as a database is used.
+        When the pool is full, a borrower waits up to ``wait_timeout`` seconds
+        for a connection to be given back.
     """
 
+    # idle connections older than this (in seconds) are checked before use
+    check_after = 30
+
     def locked(fun):
         @wraps(fun)
         def _locked(self, *args, **kwargs):
@@ -442,94 +689,228 @@ class ConnectionPool(object):
         return _locked
 
 
-    def __init__(self, maxconn=64):
-        self._connections = []
+    def __init__(self, maxconn=64, idle_timeout=0, min_idle=0, wait_timeout=10):
+        self._idle = {}             # dsn key: deque of (connection, idle since)
+        self._used = set()
+        self._leaked = []           # see leak()
+        self._keys = {}             # dsn: dsn key
+        self._count = 0             # number of connections, opened or being opened
         self._maxconn = max(maxconn, 1)
+        self._idle_timeout = idle_timeout
+        self._min_idle = min_idle
+        self._wait_timeout = wait_timeout
+        self._next_reap = 0
         self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self.counters = dict(created=0, reused=0, broken=0, waits=0, reaped=0, evicted=0)
 
     def __repr__(self):
-        used = len([1 for c, u in self._connections[:] if u])
-        count = len(self._connections)
-        return "ConnectionPool(used=%d/count=%d/max=%d)" % (used, count, self._maxconn)
+        return "ConnectionPool(used=%d/count=%d/max=%d)" % (len(self._used), self._count, self._maxconn)
 
     def _debug(self, msg, *args):
         _logger.debug(('%r ' + msg), self, *args)
 
-    @locked
+    def _key(self, dsn):
+        key = self._keys.get(dsn)
+        if key is None:
+            key = self._keys[dsn] = dsn_key(dsn)
+        return key
+
     def borrow(self, dsn):
         self._debug('Borrow connection to %r', dsn)
+        key = self._key(dsn)
+        while True:
+            with self._lock:
+                self._free_leaked()
+                self._reap()
+                prewarm = key not in self._idle
+                entry = self._pop_idle(key)
+                if entry is None:
+                    self._reserve()
+                else:
+                    self._used.add(entry[0])
+                    self.counters['reused'] += 1
 
-        # free dead and leaked connections
-        for i, (cnx, _) in tools.reverse_enumerate(self._connections):
-            if cnx.closed:
-                self._connections.pop(i)
-                self._debug('Removing closed connection at index %d: %r', i, cnx.dsn)
-                continue
-            if getattr(cnx, 'leaked', False):
-                delattr(cnx, 'leaked')
-                self._connections.pop(i)
-                self._connections.append((cnx, False))
-                _logger.warning('%r: Free leaked connection to %r', self, cnx.dsn)
-
-        for i, (cnx, used) in enumerate(self._connections):
-            if not used and dsn_are_equals(cnx.dsn, dsn):
-                try:
-                    cnx.reset()
-                except psycopg2.OperationalError:
-                    self._debug('Cannot reset connection at index %d: %r', i, cnx.dsn)
-                    # psycopg2 2.4.4 and earlier do not allow closing a closed connection
-                    if not cnx.closed:
-                        cnx.close()
-                    continue
-                self._connections.pop(i)
-                self._connections.append((cnx, True))
-                self._debug('Existing connection found at index %d', i)
+            if entry is None:
+                cnx = self._connect(dsn, key, used=True)
+                if prewarm and self._min_idle:
+                    self._prewarm(dsn, key)
+                return cnx
 
+            cnx, since = entry
+            if time.time() - since < self.check_after or self._check(cnx):
+                self._debug('Existing connection found')
                 return cnx
 
-        if len(self._connections) >= self._maxconn:
-            # try to remove the oldest connection not used
-            for i, (cnx, used) in enumerate(self._connections):
-                if not used:
-                    self._connections.pop(i)
-                    self._debug('Removing old connection at index %d: %r', i, cnx.dsn)
-                    break
-            else:
-                # note: this code is called only if the for loop has completed (no break)
+    def _pop_idle(self, key):
+        """ Return the most recently used idle connection to ``key`` and the
+        time since when it is idle, or None. """
+        idle = self._idle.setdefault(key, deque())
+        while idle:
+            cnx, since = idle.pop()
+            if cnx.closed:
+                self._count -= 1
+                self._debug('Removing closed connection: %r', cnx.dsn)
+                continue
+            return cnx, since
+        return None
+
+    def _reserve(self):
+        """ Reserve room for a new connection, by closing the oldest idle
+        connection or by waiting for a connection to be given back when the
+        pool is full. """
+        deadline = None
+        while self._count >= self._maxconn:
+            if self._evict():
+                break
+            now = time.time()
+            if deadline is None:
+                self.counters['waits'] += 1
+                deadline = now + self._wait_timeout
+            elif now >= deadline:
                 raise PoolError('The Connection Pool Is Full')
-
+            self._cond.wait(deadline - now)
+        self._count += 1
+
+    def _evict(self):
+        """ Close the oldest idle connection, and return whether there was one. """
+        oldest = None
+        for idle in self._idle.itervalues():
+            if idle and (oldest is None or idle[0][1] < oldest[0][1]):
+                oldest = idle
+        if oldest is None:
+            return False
+        cnx, since = oldest.popleft()
+        self._debug('Removing old connection: %r', cnx.dsn)
+        if not cnx.closed:
+            cnx.close()
+        self._count -= 1
+        self.counters['evicted'] += 1
+        return True
+
+    def _connect(self, dsn, key, used):
+        """ Open a connection for which room has been reserved. """
         try:
-            result = psycopg2.connect(dsn=dsn, connection_factory=PsycoConnection)
+            cnx = psycopg2.connect(dsn=dsn, connection_factory=PsycoConnection)
         except psycopg2.Error:
+            with self._lock:
+                self._count -= 1
+                self._cond.notify()
             _logger.exception('Connection to the database failed')
             raise
-        self._connections.append((result, True))
+        cnx._pool_key = key
+        with self._lock:
+            self.counters['created'] += 1
+            if used:
+                self._used.add(cnx)
+            else:
+                self._idle.setdefault(key, deque()).append((cnx, time.time()))
+                self._cond.notify()
         self._debug('Create new connection')
-        return result
+        return cnx
+
+    def _prewarm(self, dsn, key):
+        """ Open ``min_idle`` idle connections to the given database. """
+        for i in range(self._min_idle):
+            with self._lock:
+                if self._count >= self._maxconn:
+                    return
+                self._count += 1
+            try:
+                self._connect(dsn, key, used=False)
+            except psycopg2.Error:
+                return
+
+    def _check(self, cnx):
+        """ Check that the given borrowed connection is still usable, and
+        forget it otherwise. """
+        try:
+            cnx.reset()
+            return True
+        except psycopg2.OperationalError:
+            self._debug('Cannot reset connection: %r', cnx.dsn)
+            # psycopg2 2.4.4 and earlier do not allow closing a closed connection
+            if not cnx.closed:
+                cnx.close()
+        with self._lock:
+            self._used.discard(cnx)
+            self._count -= 1
+            self.counters['broken'] += 1
+            self._cond.notify()
+        return False
+
+    def _reap(self):
+        """ Close the connections idle for too long. """
+        if not self._idle_timeout:
+            return
+        now = time.time()
+        if now < self._next_reap:
+            return
+        self._next_reap = now + min(self._idle_timeout, 60)
+        limit = now - self._idle_timeout
+        for idle in self._idle.itervalues():
+            while len(idle) > self._min_idle and idle[0][1] < limit:
+                cnx, since = idle.popleft()
+                self._debug('Closing idle connection: %r', cnx.dsn)
+                if not cnx.closed:
+                    cnx.close()
+                self._count -= 1
+                self.counters['reaped'] += 1
+
+    def leak(self, connection):
+        """ Take back a connection whose cursor was not closed explicitly.
+        This may be called by the garbage collector, hence without lock: the
+        connection is put in the pool at the next borrow. """
+        self._leaked.append(connection)
+
+    def _free_leaked(self):
+        while self._leaked:
+            cnx = self._leaked.pop()
+            if cnx in self._used:
+                self._used.remove(cnx)
+                self._idle.setdefault(cnx._pool_key, deque()).append((cnx, time.time()))
+                _logger.warning('%r: Free leaked connection to %r', self, cnx.dsn)
 
-    @locked
     def give_back(self, connection, keep_in_pool=True):
         self._debug('Give back connection to %r', connection.dsn)
-        for i, (cnx, used) in enumerate(self._connections):
-            if cnx is connection:
-                self._connections.pop(i)
-                if keep_in_pool:
-                    self._connections.append((cnx, False))
-                    self._debug('Put connection to %r in pool', cnx.dsn)
-                else:
-                    self._debug('Forgot connection to %r', cnx.dsn)
-                    cnx.close()
-                break
-        else:
-            raise PoolError('This connection does not below to the pool')
+        with self._lock:
+            if connection not in self._used:
+                raise PoolError('This connection does not below to the pool')
+            self._used.remove(connection)
+            if keep_in_pool and not connection.closed:
+                self._idle.setdefault(connection._pool_key, deque()).append((connection, time.time()))
+                self._debug('Put connection to %r in pool', connection.dsn)
+            else:
+                self._debug('Forgot connection to %r', connection.dsn)
+                if not connection.closed:
+                    connection.close()
+                self._count -= 1
+            self._cond.notify()
 
     @locked
     def close_all(self, dsn=None):
         _logger.info('%r: Close all connections to %r', self, dsn)
-        for i, (cnx, used) in tools.reverse_enumerate(self._connections):
-            if dsn is None or dsn_are_equals(cnx.dsn, dsn):
+        key = dsn and self._key(dsn)
+        for cnx_key, idle in self._idle.items():
+            if key is None or cnx_key == key:
+                for cnx, since in idle:
+                    cnx.close()
+                    self._count -= 1
+                del self._idle[cnx_key]
+        for cnx in list(self._used):
+            if key is None or cnx._pool_key == key:
                 cnx.close()
-                self._connections.pop(i)
+                self._used.remove(cnx)
+                self._count -= 1
+        self._cond.notify_all()
+
+    @locked
+    def stats(self):
+        """ Return the counters of the pool, with its current usage. """
+        res = dict(self.counters)
+        res.update(used=len(self._used), count=self._count, max=self._maxconn,
+                   idle=sum(len(idle) for idle in self._idle.itervalues()))
+        return res
 
 
 class Connection(object):
@@ -540,10 +921,10 @@ class Connection(object):
         self.dbname = dbname
         self.__pool = pool
 
-    def cursor(self, serialized=True):
-        cursor_type = serialized and 'serialized ' or ''
+    def cursor(self, serialized=True, readonly=False):
+        cursor_type = (serialized and 'serialized ' or '') + (readonly and 'read-only ' or '')
         _logger.debug('create %scursor to %r', cursor_type, self.dbname)
-        return Cursor(self.__pool, self.dbname, serialized=serialized)
+        return Cursor(self.__pool, self.dbname, serialized=serialized, readonly=readonly)
 
     def test_cursor(self, serialized=True):
         cursor_type = serialized and 'serialized ' or ''
@@ -572,12 +953,113 @@ def dsn(db_name):
 
     return '%sdbname=%s' % (_dsn, db_name)
 
+def replica_dsns(db_name):
+    """ Return the dsn of the read replicas of ``db_name``. """
+    res = []
+    for replica in (tools.config['db_replicas'] or '').split(','):
+        replica = replica.strip()
+        if not replica:
+            continue
+        host, _, port = replica.partition(':')
+        _dsn = 'host=%s ' % host
+        if port or tools.config['db_port']:
+            _dsn += 'port=%s ' % (port or tools.config['db_port'])
+        for p in ('user', 'password'):
+            cfg = tools.config['db_' + p]
+            if cfg:
+                _dsn += '%s=%s ' % (p, cfg)
+        res.append('%sdbname=%s' % (_dsn, db_name))
+    return res
+
+# delay in seconds of a replica behind its primary database, or None when it
+# is not a replica; the parameter is the WAL location of the primary database
+# sampled right before. A replica having replayed all that it received may
+# still be behind (e.g. when its WAL stream is disconnected), hence the
+# comparison with the primary database itself.
+REPLICA_LAG_QUERY = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() THEN NULL
+                WHEN pg_xlog_location_diff(pg_last_xlog_replay_location(), %s) >= 0 THEN 0
+                ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+           END
+"""
+REPLICA_CHECK_INTERVAL = 5              # seconds between two checks of a replica
+_replica_lags = {}                      # dsn: (time of check, lag)
+_replica_lock = threading.Lock()
+
+def _query_one(pool, dsn, query, params=None):
+    """ Return the value of the single-value ``query`` on the database
+    ``dsn``, or None if it fails. """
+    try:
+        cnx = pool.borrow(dsn)
+    except (psycopg2.Error, PoolError):
+        _logger.warning('Cannot connect to database %r', dsn, exc_info=True)
+        return None
+    try:
+        cr = cnx.cursor()
+        cr.execute(query, params)
+        value = cr.fetchone()[0]
+        cr.close()
+        cnx.rollback()
+    except psycopg2.Error:
+        _logger.warning('Cannot query database %r', dsn, exc_info=True)
+        pool.give_back(cnx, keep_in_pool=False)
+        return None
+    pool.give_back(cnx)
+    return value
+
+def replica_lag(pool, replica, primary):
+    """ Return the delay in seconds of the replica ``replica`` behind the
+    primary database ``primary`` (both dsn), or None if it is unreachable or
+    not a replica. The result of a check is kept for
+    ``REPLICA_CHECK_INTERVAL`` seconds. """
+    now = time.time()
+    checked, lag = _replica_lags.get(replica, (0, None))
+    if now < checked + REPLICA_CHECK_INTERVAL:
+        return lag
+    with _replica_lock:
+        checked, lag = _replica_lags.get(replica, (0, None))
+        if now < checked + REPLICA_CHECK_INTERVAL:
+            return lag
+        lag = None
+        location = _query_one(pool, primary, "SELECT pg_current_xlog_location()::text")
+        if location is not None:
+            lag = _query_one(pool, replica, REPLICA_LAG_QUERY, (location,))
+        if lag is not None:
+            lag = float(lag)
+        _replica_lags[replica] = (now, lag)
+        return lag
+
+def replica_delay():
+    """ Return the delay in seconds after which a change committed on the
+    primary database is visible on any replica that may be used: a replica
+    is used while it lagged at most ``db_replica_max_lag`` seconds when last
+    checked, which was less than ``REPLICA_CHECK_INTERVAL`` seconds ago (one
+    more second covers the time until the change is committed). """
+    return float(tools.config['db_replica_max_lag']) + REPLICA_CHECK_INTERVAL + 1
+
+def replica_dsn(pool, db_name):
+    """ Return the dsn of a read replica of ``db_name`` lagging at most
+    ``db_replica_max_lag`` seconds behind it, or None if there is no such
+    replica. """
+    replicas = replica_dsns(db_name)
+    if not replicas:
+        return None
+    max_lag = float(tools.config['db_replica_max_lag'])
+    fresh = []
+    for replica in replicas:
+        lag = replica_lag(pool, replica, dsn(db_name))
+        if lag is not None and lag <= max_lag:
+            fresh.append(replica)
+    return fresh and random.choice(fresh) or None
+
+def dsn_key(dsn):
+    """ Return a hashable key identifying the database of ``dsn``. """
+    k = dict(x.split('=', 1) for x in dsn.strip().split())
+    k.pop('password', None) # password is not relevant
+    return tuple(sorted(k.iteritems()))
+
 def dsn_are_equals(first, second):
-    def key(dsn):
-        k = dict(x.split('=', 1) for x in dsn.strip().split())
-        k.pop('password', None) # password is not relevant
-        return k
-    return key(first) == key(second)
+    return dsn_key(first) == dsn_key(second)
 
 
 _Pool = None
@@ -585,7 +1067,9 @@ _Pool = None
 def db_connect(db_name):
     global _Pool
     if _Pool is None:
-        _Pool = ConnectionPool(int(tools.config['db_maxconn']))
+        _Pool = ConnectionPool(int(tools.config['db_maxconn']),
+                               idle_timeout=int(tools.config['db_pool_idle_timeout']),
+                               min_idle=int(tools.config['db_pool_min_idle']))
     return Connection(_Pool, db_name)
 
 def close_db(db_name):
@@ -593,6 +1077,8 @@ def close_db(db_name):
     global _Pool
     if _Pool:
         _Pool.close_all(dsn(db_name))
+        for replica in replica_dsns(db_name):
+            _Pool.close_all(replica)
 
 def close_all():
     global _Pool
@@ -1,15 +1,152 @@
+import cPickle
+import hashlib
 import lru
 import logging
 
+__all__ = ['ormcache', 'ormcache_context', 'ormcache_multi', 'dummy_cache', 'cache']
+
 logger = logging.getLogger(__name__)
 
+class LocalBackend(object):
+    """ Backend of the orm caches keeping them in the memory of the process,
+    with a LRU per model and method.
+    """
+    def lru(self, model, method, size, max_size=None):
+        try:
+            ormcache = getattr(model, '_ormcache')
+        except AttributeError:
+            ormcache = model._ormcache = {}
+        try:
+            d = ormcache[method]
+        except KeyError:
+            d = ormcache[method] = lru.LRU(size, max_size=max_size)
+        return d
+
+class SharedBackend(LocalBackend):
+    """ Backend of the orm caches sharing the values that can be pickled
+    between processes, through ``client`` (see
+    ``openerp.service.shared_cache``), behind the LRUs of the process.
+
+    The shared values are versioned with the registry signaling: the caches of
+    a model are not shared between their invalidation and its signaling, and
+    the processes which receive the invalidation use a new version of them.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def lru(self, model, method, size, max_size=None):
+        d = super(SharedBackend, self).lru(model, method, size, max_size)
+        version = model.pool.cache_version(model._name)
+        if version is None:
+            return d
+        namespace = (model.pool.db_name, model._name,
+                     '%s.%s' % (method.__module__, method.__name__)) + version
+        return SharedLRU(d, self.client, namespace)
+
+class SharedLRU(object):
+    """ Mapping looking up its keys in a local LRU, then in a shared cache. """
+    __slots__ = ['local', 'client', 'namespace']
+
+    def __init__(self, local, client, namespace):
+        self.local = local
+        self.client = client
+        self.namespace = namespace
+
+    def _key(self, key):
+        try:
+            return hashlib.sha1(cPickle.dumps((self.namespace, key), 2)).digest()
+        except Exception:
+            return None     # not shareable
+
+    def __getitem__(self, key):
+        try:
+            return self.local[key]
+        except KeyError:
+            pass
+        skey = self._key(key)
+        data = skey and self.client.get(skey)
+        if data is None:
+            raise KeyError(key)
+        value = self.local[key] = cPickle.loads(data)
+        return value
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+        skey = self._key(key)
+        if skey is None:
+            return
+        try:
+            data = cPickle.dumps(value, 2)
+        except Exception:
+            return      # not shareable, e.g. browse records
+        self.client.set(skey, data)
+
+    def clear(self):
+        self.local.clear()
+
+# the backend of all orm caches
+backend = LocalBackend()
+
+def set_backend(new_backend):
+    """ Set the backend of all orm caches. """
+    global backend
+    backend = new_backend
+
+def freeze(value):
+    """ Return a hashable equivalent of ``value``, where the lists, sets and
+    dicts it contains are replaced by tuples and frozensets, or raise
+    TypeError if that is not possible. """
+    if isinstance(value, tuple):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, list):
+        return ('<list>',) + tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return ('<dict>', frozenset((k, freeze(v)) for k, v in value.iteritems()))
+    hash(value)
+    return value
+
+def stats(registry):
+    """ Return the statistics of the orm caches of the models of ``registry``
+    and of its cache of domains, as a list of dicts with the keys ``model``,
+    ``method``, ``errors`` (the number of calls of the method with arguments
+    that cannot be cached, for all models), and the ones returned by
+    ``LRU.stats()``. The counters are reset when the caches are cleared.
+    """
+    res = []
+    for model_name, model in sorted(registry.models.iteritems()):
+        for method, d in getattr(model, '_ormcache', {}).items():
+            decorator = getattr(method, 'ormcache', None)
+            vals = d.stats()
+            vals.update(model=model_name, method=method.__name__,
+                        errors=decorator.stat_err if decorator else 0)
+            res.append(vals)
+    vals = registry._domain_cache.stats()
+    vals.update(model=None, method='domain_shape', errors=0)
+    res.append(vals)
+    return res
+
+_missing = object()
+
+def cacheable(cr):
+    """ Whether the values computed with ``cr`` may be cached. The cursors on
+    read replicas (see ``sql_db.Cursor.readonly``) may see the data from
+    before the last invalidation of the caches. """
+    return not getattr(cr, 'readonly', False)
+
 class ormcache(object):
     """ LRU cache decorator for orm methods,
+
+    :param size: maximum number of entries of the cache of each model
+    :param max_size: maximum size in bytes of the cache of each model (as
+        estimated by ``lru.sizeof``), or None for no limit
     """
 
-    def __init__(self, skiparg=2, size=8192, multi=None, timeout=None):
+    def __init__(self, skiparg=2, size=8192, multi=None, timeout=None, max_size=None):
         self.skiparg = skiparg
         self.size = size
+        self.max_size = max_size
         self.method = None
         self.stat_miss = 0
         self.stat_hit = 0
@@ -17,6 +154,7 @@ class ormcache(object):
 
     def __call__(self,m):
         self.method = m
+        m.ormcache = self
         def lookup(self2, cr, *args, **argv):
             r = self.lookup(self2, cr, *args, **argv)
             return r
@@ -27,30 +165,42 @@ class ormcache(object):
         return "lookup-stats hit=%s miss=%s err=%s ratio=%.1f" % (self.stat_hit,self.stat_miss,self.stat_err, (100*float(self.stat_hit))/(self.stat_miss+self.stat_hit) )
 
     def lru(self, self2):
+        return backend.lru(self2, self.method, self.size, self.max_size)
+
+    def get(self, d, key):
+        """ Look up ``key`` in the cache ``d``, and return the key to store its
+        value with (made hashable if needed, or None if it cannot be) and its
+        value, or ``_missing``.
+        """
         try:
-            ormcache = getattr(self2, '_ormcache')
-        except AttributeError:
-            ormcache = self2._ormcache = {}
-        try:
-            d = ormcache[self.method]
+            value = d[key]
         except KeyError:
-            d = ormcache[self.method] = lru.LRU(self.size)
-        return d
+            value = _missing
+        except TypeError:
+            # unhashable arguments, like lists of ids
+            try:
+                key = freeze(key)
+            except TypeError:
+                self.stat_err += 1
+                return None, _missing
+            try:
+                value = d[key]
+            except KeyError:
+                value = _missing
+        if value is _missing:
+            self.stat_miss += 1
+        else:
+            self.stat_hit += 1
+        return key, value
 
     def lookup(self, self2, cr, *args, **argv):
         d = self.lru(self2)
-        key = args[self.skiparg-2:]
-        try:
-           r = d[key]
-           self.stat_hit += 1
-           return r
-        except KeyError:
-           self.stat_miss += 1
-           value = d[key] = self.method(self2, cr, *args)
-           return value
-        except TypeError:
-           self.stat_err += 1
-           return self.method(self2, cr, *args)
+        key, value = self.get(d, args[self.skiparg-2:])
+        if value is _missing:
+            value = self.method(self2, cr, *args)
+            if key is not None and cacheable(cr):
+                d[key] = value
+        return value
 
     def clear(self, self2, *args):
         """ Remove *args entry from the cache or all keys if *args is undefined 
@@ -61,11 +211,11 @@ class ormcache(object):
                         "(while clearing caches on (%s).%s)",
                         self2._name, self.method.__name__)
         d.clear()
-        self2.pool._any_cache_cleared = True
+        self2.pool.cache_cleared(self2._name)
 
 class ormcache_context(ormcache):
-    def __init__(self, skiparg=2, size=8192, accepted_keys=()):
-        super(ormcache_context,self).__init__(skiparg,size)
+    def __init__(self, skiparg=2, size=8192, accepted_keys=(), max_size=None):
+        super(ormcache_context,self).__init__(skiparg,size,max_size=max_size)
         self.accepted_keys = accepted_keys
 
     def lookup(self, self2, cr, *args, **argv):
@@ -75,24 +225,17 @@ class ormcache_context(ormcache):
         ckey = filter(lambda x: x[0] in self.accepted_keys, context.items())
         ckey.sort()
 
-        d = self.lru(self2)
-        key = args[self.skiparg-2:]+tuple(ckey)
-        try:
-           r = d[key]
-           self.stat_hit += 1
-           return r
-        except KeyError:
-           self.stat_miss += 1
-           value = d[key] = self.method(self2, cr, *args, **argv)
-           return value
-        except TypeError:
-           self.stat_err += 1
-           return self.method(self2, cr, *args, **argv)
+        key, value = self.get(d, args[self.skiparg-2:]+tuple(ckey))
+        if value is _missing:
+            value = self.method(self2, cr, *args, **argv)
+            if key is not None and cacheable(cr):
+                d[key] = value
+        return value
 
 
 class ormcache_multi(ormcache):
-    def __init__(self, skiparg=2, size=8192, multi=3):
-        super(ormcache_multi,self).__init__(skiparg,size)
+    def __init__(self, skiparg=2, size=8192, multi=3, max_size=None):
+        super(ormcache_multi,self).__init__(skiparg,size,max_size=max_size)
         self.multi = multi - 2
 
     def lookup(self, self2, cr, *args, **argv):
@@ -102,25 +245,25 @@ class ormcache_multi(ormcache):
         ids = args[multi]
         r = {}
         miss = []
+        keys = {}
 
         for i in ids:
             args[multi] = i
-            key = tuple(args[self.skiparg-2:])
-            try:
-               r[i] = d[key]
-               self.stat_hit += 1
-            except Exception:
-               self.stat_miss += 1
-               miss.append(i)
+            key, value = self.get(d, tuple(args[self.skiparg-2:]))
+            if value is _missing:
+                miss.append(i)
+                keys[i] = key
+            else:
+                r[i] = value
 
         if miss:
             args[multi] = miss
             r.update(self.method(self2, cr, *args))
 
-        for i in miss:
-            args[multi] = i
-            key = tuple(args[self.skiparg-2:])
-            d[key] = r[i]
+        if cacheable(cr):
+            for i in miss:
+                if keys[i] is not None:
+                    d[keys[i]] = r[i]
 
         return r
 
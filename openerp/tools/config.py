@@ -155,6 +155,16 @@ class configmanager(object):
         group = optparse.OptionGroup(parser, "Web interface Configuration")
         group.add_option("--db-filter", dest="dbfilter", my_default='.*',
                          help="Filter listed database", metavar="REGEXP")
+        group.add_option("--gzip-min-size", dest="gzip_min_size", my_default=0,
+                         help="Compress the JSON-RPC responses of at least this size (in bytes) for the "
+                              "clients accepting gzip. 0 (default) does not compress them.", type="int")
+        group.add_option("--session-store", dest="session_store", my_default='filesystem',
+                         type="choice", choices=['filesystem', 'sqlite', 'postgresql'],
+                         help="Store the http sessions in files (default), in a local SQLite database shared by "
+                              "the processes of the host, or in a PostgreSQL database (see --session-db) shared "
+                              "by all the hosts.")
+        group.add_option("--session-db", dest="session_db", my_default=False,
+                         help="specify the database storing the http sessions with --session-store=postgresql")
         parser.add_option_group(group)
 
         # Testing Group
@@ -180,6 +190,9 @@ class configmanager(object):
         group.add_option('--log-web', action="append_const", dest="log_handler", const="openerp.http:DEBUG", help='shortcut for --log-handler=openerp.http:DEBUG')
         group.add_option('--log-sql', action="append_const", dest="log_handler", const="openerp.sql_db:DEBUG", help='shortcut for --log-handler=openerp.sql_db:DEBUG')
         group.add_option('--log-db', dest='log_db', help="Logging database", my_default=False)
+        group.add_option('--sql-profiler', dest='sql_profiler', action="store_true", my_default=False,
+                         help="allow profiling the SQL queries of HTTP requests in debug mode or with the X-OpenERP-Profile header; "
+                              "the profile is logged by openerp.http.profiler and added to the JSON-RPC responses")
         # For backward-compatibility, map the old log levels to something
         # quite close.
         levels = [
@@ -222,6 +235,16 @@ class configmanager(object):
                          help="specify the database port", type="int")
         group.add_option("--db_maxconn", dest="db_maxconn", type='int', my_default=64,
                          help="specify the the maximum number of physical connections to posgresql")
+        group.add_option("--db-pool-idle-timeout", dest="db_pool_idle_timeout", type='int', my_default=0,
+                         help="close the connections to postgresql idle for more than this number of seconds (default 0, never close them)")
+        group.add_option("--db-pool-min-idle", dest="db_pool_min_idle", type='int', my_default=0,
+                         help="specify the number of connections kept open to each database, even when they are idle")
+        group.add_option("--db-replicas", dest="db_replicas", my_default=False,
+                         help="specify a comma-separated list of read replicas (host or host:port) of the database server, "
+                              "used for the read-only calls (with the same user, password and database names)")
+        group.add_option("--db-replica-max-lag", dest="db_replica_max_lag", type='float', my_default=1.0,
+                         help="specify the maximum delay in seconds of a read replica behind the database server (default 1); "
+                              "the read-only calls use the database server when no replica is fresh enough")
         group.add_option("--db-template", dest="db_template", my_default="template1",
                          help="specify a custom database template to create a new database")
         parser.add_option_group(group)
@@ -271,6 +294,11 @@ class configmanager(object):
         group.add_option("--max-cron-threads", dest="max_cron_threads", my_default=2,
                          help="Maximum number of threads processing concurrently cron jobs (default 2).",
                          type="int")
+        group.add_option("--cron-job-threads", dest="cron_job_threads", my_default=1,
+                         help="Maximum number of threads running concurrently the due jobs of a database, for each cron thread or worker (default 1).",
+                         type="int")
+        group.add_option("--cron-scheduler", dest="cron_scheduler", my_default=False, action="store_true",
+                         help="Process the cron jobs when they are due, and when they are changed (using PostgreSQL LISTEN/NOTIFY), instead of polling the databases every minute.")
         group.add_option("--unaccent", dest="unaccent", my_default=False, action="store_true",
                          help="Use the unaccent function provided by the database when available.")
         parser.add_option_group(group)
@@ -296,6 +324,19 @@ class configmanager(object):
             group.add_option("--limit-request", dest="limit_request", my_default=8192,
                              help="Maximum number of request to be processed per worker (default 8192).",
                              type="int")
+            group.add_option("--cron-registries", dest="cron_registries", my_default=4,
+                             help="Maximum number of registries kept loaded by a cron worker between two polls, 0 reloads them at each poll (default 4).",
+                             type="int")
+            group.add_option("--cron-registries-memory", dest="cron_registries_memory", my_default=1024 * 1024 * 1024,
+                             help="Resident memory of a cron worker above which its least recently used registries are unloaded (default 1073741824 aka 1GB).",
+                             type="int")
+            group.add_option("--ormcache-backend", dest="ormcache_backend", my_default='local',
+                             type="choice", choices=['local', 'shared'],
+                             help="Where the workers keep the values of the orm caches: 'local' (default) in each worker, "
+                                  "'shared' also in a cache process shared by the workers.")
+            group.add_option("--ormcache-shared-size", dest="ormcache_shared_size", my_default=100000,
+                             help="Maximum number of entries of the shared orm cache (default 100000).",
+                             type="int")
             parser.add_option_group(group)
 
         # Copy all optparse options (i.e. MyOption) into self.options.
@@ -383,10 +424,12 @@ class configmanager(object):
                 'db_name', 'db_user', 'db_password', 'db_host',
                 'db_port', 'db_template', 'logfile', 'pidfile', 'smtp_port',
                 'email_from', 'smtp_server', 'smtp_user', 'smtp_password',
-                'db_maxconn', 'import_partial', 'addons_path',
+                'db_maxconn', 'db_pool_idle_timeout', 'db_pool_min_idle', 'db_replicas', 'db_replica_max_lag',
+                'import_partial', 'addons_path',
                 'xmlrpc', 'syslog', 'without_demo', 'timezone',
                 'xmlrpcs_interface', 'xmlrpcs_port', 'xmlrpcs',
-                'secure_cert_file', 'secure_pkey_file', 'dbfilter', 'log_handler', 'log_level', 'log_db'
+                'secure_cert_file', 'secure_pkey_file', 'dbfilter', 'gzip_min_size',
+                'session_store', 'session_db', 'log_handler', 'log_level', 'log_db'
                 ]
 
         for arg in keys:
@@ -401,6 +444,10 @@ class configmanager(object):
         if isinstance(self.options['log_handler'], basestring):
             self.options['log_handler'] = self.options['log_handler'].split(',')
 
+        # checked once the config file values are merged, as they may be set there
+        die(self.options['session_store'] == 'postgresql' and not self.options['session_db'],
+            "the session-store=postgresql option cannot be used without the session-db option")
+
         # if defined but None take the configfile value
         keys = [
             'language', 'translate_out', 'translate_in', 'overwrite_existing_translations',
@@ -408,14 +455,16 @@ class configmanager(object):
             'stop_after_init', 'logrotate', 'without_demo', 'xmlrpc', 'syslog',
             'list_db', 'xmlrpcs', 'proxy_mode',
             'test_file', 'test_enable', 'test_commit', 'test_report_directory',
-            'osv_memory_count_limit', 'osv_memory_age_limit', 'max_cron_threads', 'unaccent',
-            'data_dir',
+            'osv_memory_count_limit', 'osv_memory_age_limit', 'max_cron_threads', 'cron_job_threads', 'cron_scheduler', 'unaccent',
+            'data_dir', 'sql_profiler',
         ]
 
         posix_keys = [
             'auto_reload', 'workers',
             'limit_memory_hard', 'limit_memory_soft',
             'limit_time_cpu', 'limit_time_real', 'limit_request',
+            'cron_registries', 'cron_registries_memory',
+            'ormcache_backend', 'ormcache_shared_size',
         ]
 
         if os.name == 'posix':
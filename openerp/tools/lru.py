@@ -1,122 +1,164 @@
 # -*- coding: utf-8 -*-
-# taken from http://code.activestate.com/recipes/252524-length-limited-o1-lru-cache-implementation/
+import sys
 import threading
-from func import synchronized
 
 __all__ = ['LRU']
 
+def sizeof(key, value):
+    """ Default estimation of the size of an entry of a LRU, in bytes; only the
+    key and value objects themselves are counted, not what they refer to. """
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
 class LRUNode(object):
-    __slots__ = ['prev', 'next', 'me']
-    def __init__(self, prev, me):
-        self.prev = prev
-        self.me = me
-        self.next = None
+    __slots__ = ['prev', 'next', 'key', 'value', 'size']
 
 class LRU(object):
+    """ Length-limited O(1) LRU mapping, optionally limited in size too.
+
+    The entries are kept in a dict of nodes, which are linked in a circular
+    list around a sentinel node, from the least to the most recently used.
+    Looking up an entry moves its node to the end of the list, without
+    allocating anything.
+
+    :param count: maximum number of entries
+    :param max_size: maximum total size of the entries, as estimated by
+        ``sizeof``, or None (default) for no limit
+    :param sizeof: function returning the size of an entry given its key and
+        value; see :func:`sizeof`
+
+    The mapping counts its ``hits``, ``misses`` (lookups of missing keys) and
+    ``evictions`` since its creation or last :meth:`clear`.
     """
-    Implementation of a length-limited O(1) LRU queue.
-    Built for and used by PyPE:
-    http://pype.sourceforge.net
-    Copyright 2003 Josiah Carlson.
-    """
-    def __init__(self, count, pairs=[]):
+    def __init__(self, count, pairs=[], max_size=None, sizeof=sizeof):
         self._lock = threading.RLock()
         self.count = max(count, 1)
-        self.d = {}
-        self.first = None
-        self.last = None
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.clear()
         for key, value in pairs:
             self[key] = value
 
-    @synchronized()
+    def _unlink(self, node):
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+    def _append(self, node):
+        root = self._root
+        node.prev = root.prev
+        node.next = root
+        root.prev.next = node
+        root.prev = node
+
+    def _evict(self):
+        root = self._root
+        while len(self.d) > self.count or \
+                (self.max_size is not None and self.size > self.max_size and len(self.d) > 1):
+            node = root.next
+            self._unlink(node)
+            del self.d[node.key]
+            self.size -= node.size
+            self.evictions += 1
+
     def __contains__(self, obj):
         return obj in self.d
 
-    @synchronized()
     def __getitem__(self, obj):
-        a = self.d[obj].me
-        self[a[0]] = a[1]
-        return a[1]
+        with self._lock:
+            try:
+                node = self.d[obj]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            if node.next is not self._root:
+                self._unlink(node)
+                self._append(node)
+            return node.value
+
+    def get(self, obj, default=None):
+        try:
+            return self[obj]
+        except KeyError:
+            return default
 
-    @synchronized()
     def __setitem__(self, obj, val):
-        if obj in self.d:
-            del self[obj]
-        nobj = LRUNode(self.last, (obj, val))
-        if self.first is None:
-            self.first = nobj
-        if self.last:
-            self.last.next = nobj
-        self.last = nobj
-        self.d[obj] = nobj
-        if len(self.d) > self.count:
-            if self.first == self.last:
-                self.first = None
-                self.last = None
-                return
-            a = self.first
-            a.next.prev = None
-            self.first = a.next
-            a.next = None
-            del self.d[a.me[0]]
-            del a
-
-    @synchronized()
+        with self._lock:
+            size = self.sizeof(obj, val) if self.max_size is not None else 0
+            node = self.d.get(obj)
+            if node is None:
+                node = self.d[obj] = LRUNode()
+                node.key = obj
+                node.size = 0
+            else:
+                self._unlink(node)
+            node.value = val
+            self.size += size - node.size
+            node.size = size
+            self._append(node)
+            self._evict()
+
     def __delitem__(self, obj):
-        nobj = self.d[obj]
-        if nobj.prev:
-            nobj.prev.next = nobj.next
-        else:
-            self.first = nobj.next
-        if nobj.next:
-            nobj.next.prev = nobj.prev
-        else:
-            self.last = nobj.prev
-        del self.d[obj]
-
-    @synchronized()
-    def __iter__(self):
-        cur = self.first
-        while cur is not None:
-            cur2 = cur.next
-            yield cur.me[1]
-            cur = cur2
+        with self._lock:
+            node = self.d.pop(obj)
+            self._unlink(node)
+            self.size -= node.size
 
-    @synchronized()
     def __len__(self):
         return len(self.d)
 
-    @synchronized()
+    def _nodes(self):
+        root = self._root
+        node = root.next
+        while node is not root:
+            yield node
+            node = node.next
+
+    def __iter__(self):
+        # values, from the least to the most recently used
+        with self._lock:
+            return iter([node.value for node in self._nodes()])
+
     def iteritems(self):
-        cur = self.first
-        while cur is not None:
-            cur2 = cur.next
-            yield cur.me
-            cur = cur2
+        with self._lock:
+            return iter([(node.key, node.value) for node in self._nodes()])
 
-    @synchronized()
     def iterkeys(self):
-        return iter(self.d)
+        with self._lock:
+            return iter(self.d.keys())
 
-    @synchronized()
     def itervalues(self):
-        for i,j in self.iteritems():
-            yield j
+        return iter(self)
 
-    @synchronized()
     def keys(self):
-        return self.d.keys()
+        with self._lock:
+            return self.d.keys()
 
-    @synchronized()
-    def pop(self,key):
-        v=self[key]
-        del self[key]
-        return v
+    def pop(self, key):
+        with self._lock:
+            v = self[key]
+            del self[key]
+            return v
 
-    @synchronized()
     def clear(self):
-        self.d = {}
-        self.first = None
-        self.last = None
+        with self._lock:
+            root = self._root = LRUNode()
+            root.prev = root.next = root
+            self.d = {}
+            self.size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """ Return the counters and the current usage of the mapping. """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.d),
+            'count': self.count,
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'ratio': lookups and 100.0 * self.hits / lookups,
+        }
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
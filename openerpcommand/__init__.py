@@ -3,10 +3,14 @@ import textwrap
 
 from .call import Call
 from .client import Open, Show, ConsumeNothing, ConsumeMemory, LeakMemory, ConsumeCPU
-from .benchmarks import Bench, BenchRead, BenchFieldsViewGet, BenchDummy, BenchLogin
+from .benchmarks import Bench, BenchRead, BenchListView, BenchFieldsViewGet, BenchDummy, BenchLogin
 from .bench_sale_mrp import BenchSaleMrp
+from .bench_store import BenchSaleOrderLines, BenchMoveLines
 from . import common
 
+from . import bench_json
+from . import bench_stream
+from . import bench_where_calc
 from . import conf # Not really server-side (in the `for` below).
 from . import cron
 from . import drop
@@ -20,13 +24,13 @@ from . import update
 from . import web
 from . import grunt_tests
 
-command_list_server = (conf, cron, drop, initialize, model, module, read,
+command_list_server = (bench_json, bench_stream, bench_where_calc, conf, cron, drop, initialize, model, module, read,
                        scaffold, uninstall, update, web, grunt_tests, )
 
 command_list_client = (Call, Open, Show, ConsumeNothing, ConsumeMemory,
-                       LeakMemory, ConsumeCPU, Bench, BenchRead,
+                       LeakMemory, ConsumeCPU, Bench, BenchRead, BenchListView,
                        BenchFieldsViewGet, BenchDummy, BenchLogin,
-                       BenchSaleMrp, )
+                       BenchSaleMrp, BenchSaleOrderLines, BenchMoveLines, )
 
 def main_parser():
     parser = argparse.ArgumentParser(
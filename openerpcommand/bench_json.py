@@ -0,0 +1,71 @@
+"""
+Measure the memory and time used to serialize large JSON-RPC results, at once
+or streamed (openerp.http.json_chunks()).
+"""
+import os
+import resource
+import sys
+import time
+
+import psutil
+
+COLUMNS = 10
+
+def rss():
+    return psutil.Process(os.getpid()).get_memory_info()[0]
+
+def records(cells):
+    """ Return a search_read result of ``cells`` values. """
+    return {
+        'length': cells // COLUMNS,
+        'records': [
+            dict([('id', i), ('name', u'Record %s' % i), ('active', True),
+                  ('partner_id', [i % 100 + 1, u'Partner %s' % (i % 100)])] +
+                 [('value_%s' % c, i * 1.5 + c) for c in range(COLUMNS - 4)])
+            for i in xrange(cells // COLUMNS)
+        ],
+    }
+
+def measure(label, encode, cells):
+    """ Serialize ``cells`` values with ``encode`` in a child process, so that
+    its peak memory (ru_maxrss) is not hidden by the previous runs. """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        response = {'jsonrpc': '2.0', 'id': None, 'result': records(cells)}
+        start_rss = rss()
+        t0 = time.time()
+        size = sum(len(chunk) for chunk in encode(response))
+        t1 = time.time()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        print "%-12s %8d cells %6dk %8.3fs  peak memory +%dk" % (label, cells,
+            size / 1024, t1 - t0, max(peak_rss - start_rss, 0) / 1024)
+        sys.stdout.flush()
+    finally:
+        os._exit(0)
+
+def run(args):
+    import simplejson
+    import openerp.http
+
+    encoders = [
+        ('dumps', lambda response: [simplejson.dumps(response)]),
+        ('iterencode', lambda response: simplejson.JSONEncoder().iterencode(response)),
+        ('stream', openerp.http.json_chunks),
+        ('stream-gzip', lambda response: openerp.http.gzip_chunks(openerp.http.json_chunks(response))),
+    ]
+    for cells in args.cells:
+        for label, encode in encoders:
+            measure(label, encode, cells)
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('bench-json',
+        description='Measure the memory and time used to serialize large '
+                    'JSON-RPC results, at once or streamed.')
+    parser.add_argument('cells', metavar='CELLS', type=int, nargs='*',
+        default=[10000, 100000, 1000000],
+        help='number of values of the results (default: 10000 100000 1000000)')
+
+    parser.set_defaults(run=run)
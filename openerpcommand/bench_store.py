@@ -0,0 +1,83 @@
+"""
+Benchmarks of the creation of order and journal lines, to compare the
+immediate and the deferred recomputation of stored function fields (see the
+`defer_store_computation` context key).
+"""
+
+import time
+
+from .benchmarks import Bench
+
+class BenchStoreLines(Bench):
+    """\
+    Base class for the benchmarks creating a document with many lines.
+
+    Each measure creates one document with --lines lines. With --defer, the
+    stored function fields (e.g. the totals of the document) are recomputed
+    once at the end of the transaction instead of once per line.
+    """
+
+    def __init__(self, subparsers=None):
+        super(BenchStoreLines, self).__init__(subparsers)
+        self.parser.add_argument('-l', '--lines', metavar='INT',
+            default=100, help='number of lines per document')
+        self.parser.add_argument('--defer', action='store_true',
+            default=False, help='defer the recomputation of stored fields')
+
+    def context(self):
+        return {'defer_store_computation': True} if self.args.defer else {}
+
+    def ref(self, module, xml_id):
+        return self.execute('ir.model.data', 'get_object_reference', module, xml_id)[1]
+
+class BenchSaleOrderLines(BenchStoreLines):
+    """\
+    Create a sale order with many lines (requires the `sale` module and its
+    demo data).
+    """
+
+    command_name = 'bench-sale-order-lines'
+    bench_name = 'sale.order.create(lines)'
+
+    def measure_once(self, i):
+        product = self.ref('product', 'product_product_4')
+        uom = self.ref('product', 'product_uom_unit')
+        partner = self.ref('base', 'res_partner_2')
+        pricelist = self.ref('product', 'list0')
+        lines = [(0, 0, {
+            'name': 'Line %s' % n,
+            'product_id': product,
+            'product_uom': uom,
+            'product_uom_qty': 1.0 + n,
+            'price_unit': 10.0,
+        }) for n in xrange(int(self.args.lines))]
+        self.execute('sale.order', 'create', {
+            'partner_id': partner,
+            'partner_invoice_id': partner,
+            'partner_shipping_id': partner,
+            'pricelist_id': pricelist,
+            'order_line': lines,
+        }, self.context())
+
+class BenchMoveLines(BenchStoreLines):
+    """\
+    Create a balanced journal entry with many lines (requires the `account`
+    module and a configured chart of accounts).
+    """
+
+    command_name = 'bench-move-lines'
+    bench_name = 'account.move.create(lines)'
+
+    def measure_once(self, i):
+        journal = self.execute('account.journal', 'search', [('type', '=', 'general')], 0, 1)[0]
+        period = self.execute('account.period', 'find', time.strftime('%Y-%m-%d'))[0]
+        account = self.execute('account.account', 'search', [('type', '=', 'other')], 0, 1)[0]
+        lines = []
+        for n in xrange(int(self.args.lines) / 2):
+            lines.append((0, 0, {'name': 'Debit %s' % n, 'account_id': account, 'debit': 10.0}))
+            lines.append((0, 0, {'name': 'Credit %s' % n, 'account_id': account, 'credit': 10.0}))
+        self.execute('account.move', 'create', {
+            'journal_id': journal,
+            'period_id': period,
+            'line_id': lines,
+        }, self.context())
@@ -0,0 +1,70 @@
+"""
+Measure the memory used to read a large query result, with and without
+streaming it (sql_db.Cursor.stream()).
+"""
+import gc
+import os
+import time
+
+import psutil
+
+import common
+
+QUERY = "SELECT id, name, value FROM bench_stream ORDER BY id"
+
+def rss():
+    return psutil.Process(os.getpid()).get_memory_info()[0]
+
+def run(args):
+    assert args.database
+    import openerp
+    config = openerp.tools.config
+    config['log_handler'] = [':CRITICAL']
+    openerp.netsvc.init_logger()
+    count = int(args.count)
+    itersize = int(args.itersize)
+
+    db = openerp.sql_db.db_connect(args.database)
+    cr = db.cursor()
+    try:
+        # a temporary table, dropped with the transaction
+        cr.execute("""CREATE TEMPORARY TABLE bench_stream ON COMMIT DROP AS
+                      SELECT i AS id, 'name ' || i AS name, i * 1.5 AS value
+                      FROM generate_series(1, %s) AS i""", (count,))
+
+        # streaming first, as the memory freed by Python is seldom given back
+        # to the system
+        for label, fetch in (
+                ('stream', lambda: cr.stream(QUERY, itersize=itersize)),
+                ('dictstream', lambda: cr.stream(QUERY, itersize=itersize, dictfetch=True)),
+                ('fetchall', lambda: cr.execute(QUERY) or cr.fetchall()),
+                ('dictfetchall', lambda: cr.execute(QUERY) or cr.dictfetchall()),
+            ):
+            gc.collect()
+            start_rss = peak_rss = rss()
+            t0 = time.time()
+            rows = 0
+            for row in fetch():
+                rows += 1
+                if not rows % itersize:
+                    peak_rss = max(peak_rss, rss())
+            peak_rss = max(peak_rss, rss())
+            t1 = time.time()
+            print "%-12s %8d rows %8.2fs  peak memory +%dk" % (label, rows,
+                t1 - t0, (peak_rss - start_rss) / 1024)
+    finally:
+        cr.rollback()
+        cr.close()
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('bench-stream',
+        description='Measure the memory used to read a large query result, '
+                    'with and without a server-side cursor.')
+    parser.add_argument('-d', '--database', metavar='DATABASE',
+        **common.required_or_default('DATABASE', 'the database to connect to'))
+    parser.add_argument('-n', '--count', metavar='INT', default=1000000,
+        help='number of rows of the table')
+    parser.add_argument('--itersize', metavar='INT', default=2000,
+        help='number of rows fetched at once by the server-side cursor')
+
+    parser.set_defaults(run=run)
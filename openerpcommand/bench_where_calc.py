@@ -0,0 +1,53 @@
+"""
+Benchmark the translation of domains into SQL (BaseModel._where_calc()).
+"""
+import time
+
+import common
+
+# typical domains, by model; the values change at each call to measure the
+# reuse of the SQL of structurally identical domains
+DOMAINS = [
+    ('res.partner', lambda i: [('customer', '=', True), ('name', 'ilike', 'a%s' % i)]),
+    ('res.partner', lambda i: ['|', ('parent_id', '=', False), ('company_id', 'in', [1, i, False])]),
+    ('res.partner', lambda i: [('id', 'in', range(i % 50 + 1)), ('email', '!=', False)]),
+    ('res.users', lambda i: [('name', 'ilike', 'adm%s' % i), ('login', '!=', 'x%s' % i)]),
+    ('ir.model.data', lambda i: [('module', '=', 'base'), ('name', '=', 'xml_id_%s' % i)]),
+]
+
+def run(args):
+    assert args.database
+    import openerp
+    config = openerp.tools.config
+    config['log_handler'] = [':CRITICAL']
+    common.set_addons(args)
+    openerp.netsvc.init_logger()
+    registry = openerp.modules.registry.RegistryManager.get(
+        args.database, update_module=False)
+    count = int(args.count)
+
+    with registry.cursor() as cr:
+        for model_name, make_domain in DOMAINS:
+            model = registry[model_name]
+            for label, clear in (('parse', True), ('cached', False)):
+                registry._domain_cache.clear()
+                t0 = time.time()
+                for i in xrange(count):
+                    if clear:
+                        registry._domain_cache.clear()
+                    model._where_calc(cr, 1, make_domain(i))
+                t1 = time.time()
+                print "%-14s %-7s %8.1f us/call  %s" % (model_name, label,
+                    (t1 - t0) * 1e6 / count, make_domain(0))
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('bench-where-calc',
+        description='Measure the translation of typical domains into SQL, '
+                    'with and without the cache of domain shapes.')
+    parser.add_argument('-d', '--database', metavar='DATABASE',
+        **common.required_or_default('DATABASE', 'the database to connect to'))
+    common.add_addons_argument(parser)
+    parser.add_argument('-n', '--count', metavar='INT', default=10000,
+        help='number of calls per domain')
+
+    parser.set_defaults(run=run)
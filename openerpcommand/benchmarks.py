@@ -126,6 +126,30 @@ class BenchRead(Bench):
     def measure_once(self, i):
         self.execute(self.args.model, 'read', [self.args.id], [])
 
+class BenchListView(Bench):
+    """Read records the way a list view does, in a given language."""
+
+    command_name = 'bench-list-view'
+    bench_name = 'product.template.search_read(tree, lang)'
+
+    def __init__(self, subparsers=None):
+        super(BenchListView, self).__init__(subparsers)
+        self.parser.add_argument('-m', '--model', metavar='MODEL',
+            default='product.template', help='the model')
+        self.parser.add_argument('-l', '--lang', metavar='LANG',
+            default='fr_FR', help='the language of the read (must be installed)')
+        self.parser.add_argument('--limit', metavar='INT',
+            default=80, help='number of records per read')
+        self.fields = None
+
+    def measure_once(self, i):
+        context = {'lang': self.args.lang}
+        if self.fields is None:
+            view = self.execute(self.args.model, 'fields_view_get', False, 'tree', context)
+            self.fields = view['fields'].keys()
+        self.execute(self.args.model, 'search_read', [], self.fields, 0,
+            int(self.args.limit), False, context)
+
 class BenchFieldsViewGet(Bench):
     """Read a record's fields and view architecture repeatedly."""
 